@@ -0,0 +1,332 @@
+import os
+import sys
+import csv
+import json
+import gzip
+import time
+import argparse
+import datetime
+import resource
+import pymysql
+import pymysql.cursors
+import config
+import storage
+from record_store import best_rows, best_upsert_sql
+
+try:
+    import pyarrow  # Opzionale: formato Parquet
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+    parquet = None
+
+# Esportazione e importazione delle tabelle in streaming, a memoria costante:
+#  - export legge con un cursore lato server (SSCursor: le righe arrivano a blocchi invece
+#    di essere caricate tutte come con DictCursor) e scrive CSV, JSONL o Parquet
+#  - import inserisce a lotti con INSERT multi-riga e salva un checkpoint dopo ogni commit,
+#    così un'importazione interrotta riprende dall'ultimo lotto scritto; importando lo storico
+#    (records) i migliori tempi in best_records si aggiornano nella stessa transazione di ogni lotto
+# I file .gz sono compressi/decompressi al volo.
+#
+#   python admin.py export records records.csv.gz --game puzzle
+#   python admin.py import records records.csv.gz --game puzzle
+#   python admin.py export user utenti.parquet
+
+# Colonne e tipi di ogni tabella esportabile
+TABLES = {
+    'user': (('id', 'int'), ('username', 'str'), ('password', 'str')),
+    'records': (('id', 'int'), ('time', 'float'), ('date', 'datetime'), ('user', 'str'), ('difficulty', 'str')),
+    'best_records': (('user', 'str'), ('difficulty', 'str'), ('time', 'float'), ('date', 'datetime')),
+    'daily_records': (('day', 'date'), ('difficulty', 'str'), ('user', 'str'), ('time', 'float'), ('date', 'datetime')),
+}
+FORMATS = ('csv', 'jsonl', 'parquet')
+REPORT_INTERVAL = 5.0  # Avanzamento stampato ogni (s)
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lstrip('.')
+    return 'jsonl' if extension == 'json' else extension
+
+def open_text(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='', compresslevel=6)
+    return open(path, mode, encoding='utf-8', newline='')
+
+def to_text(value):
+    """Valore per CSV e JSONL: le date nel formato accettato da MySQL e SQLite."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+def from_text(value, kind):
+    """Valore letto da CSV/JSONL/Parquet nel tipo della colonna (stringa vuota = NULL)."""
+    if value is None or value == '':
+        return None
+    if kind == 'int':
+        return int(value)
+    if kind == 'float':
+        return float(value)
+    return to_text(value) if kind in ('datetime', 'date') else str(value)
+
+class Progress:
+    """Righe al secondo, stampate a intervalli e nel riepilogo finale."""
+    def __init__(self, label, interval=REPORT_INTERVAL):
+        self.label = label
+        self.interval = interval
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.reported = self.start
+
+    def add(self, count):
+        self.rows += count
+        now = time.perf_counter()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            print(f"{self.label}: {self.rows} righe, {self.rows / (now - self.start):.0f} righe/s")
+
+    def summary(self, path):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        # ru_maxrss è in kB su Linux; con SQLite comprende anche le pagine del file mappate (mmap_size)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{self.label}: {self.rows} righe in {elapsed:.1f} s ({self.rows / elapsed:.0f} righe/s), "
+              f"file {size / 1e6:.1f} MB, RSS massimo {peak:.0f} MB")
+        return {'rows': self.rows, 'seconds': round(elapsed, 2), 'rows_per_s': round(self.rows / elapsed)}
+
+# --- Scrittori e lettori -------------------------------------------------------
+
+class CSVWriter:
+    def __init__(self, path, columns):
+        self.file = open_text(path, 'w')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        self.writer.writerows([['' if value is None else to_text(value) for value in row] for row in rows])
+
+    def close(self):
+        self.file.close()
+
+class JSONLWriter:
+    def __init__(self, path, columns):
+        self.file = open_text(path, 'w')
+        self.names = [name for name, _ in columns]
+
+    def write(self, rows):
+        names = self.names
+        self.file.write(''.join(
+            json.dumps(dict(zip(names, map(to_text, row))), ensure_ascii=False) + '\n' for row in rows
+        ))
+
+    def close(self):
+        self.file.close()
+
+def arrow_schema(columns):
+    types = {
+        'int': pyarrow.int64(), 'float': pyarrow.float64(), 'str': pyarrow.string(),
+        'datetime': pyarrow.timestamp('s'), 'date': pyarrow.date32(),
+    }
+    return pyarrow.schema([(name, types[kind]) for name, kind in columns])
+
+def to_arrow(value, kind):
+    if value is None or kind not in ('datetime', 'date') or isinstance(value, datetime.date):
+        return value
+    parsed = datetime.datetime.fromisoformat(str(value))  # SQLite restituisce le date come stringhe
+    return parsed if kind == 'datetime' else parsed.date()
+
+class ParquetWriter:
+    """Un row group per lotto: in memoria c'è sempre un solo lotto."""
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.schema = arrow_schema(columns)
+        self.writer = parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        arrays = [[to_arrow(row[index], kind) for row in rows] for index, (_, kind) in enumerate(self.columns)]
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=field.type) for values, field in zip(arrays, self.schema)],
+            schema=self.schema
+        ))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLWriter, 'parquet': ParquetWriter}
+
+def read_csv(path, columns, batch_size):
+    with open_text(path, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        positions = [header.index(name) for name, _ in columns]
+        batch = []
+        for record in reader:
+            batch.append(tuple(from_text(record[position], kind) for position, (_, kind) in zip(positions, columns)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def read_jsonl(path, columns, batch_size):
+    with open_text(path, 'r') as f:
+        batch = []
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            batch.append(tuple(from_text(item.get(name), kind) for name, kind in columns))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def read_parquet(path, columns, batch_size):
+    names = [name for name, _ in columns]
+    for record_batch in parquet.ParquetFile(path).iter_batches(batch_size=batch_size, columns=names):
+        data = record_batch.to_pydict()
+        yield [tuple(from_text(value, kind) for value, (_, kind) in zip(values, columns))
+               for values in zip(*(data[name] for name in names))]
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'parquet': read_parquet}
+
+# --- Comandi ------------------------------------------------------------------
+
+def export_table(connection, table, path, file_format, batch_size):
+    """Scrive la tabella nel file leggendo a blocchi di batch_size righe."""
+    columns = TABLES[table]
+    writer = WRITERS[file_format](path, columns)
+    progress = Progress(f"Esportazione di {table}")
+    try:
+        # SSCursor: MySQL invia le righe man mano invece di caricarle tutte nel client
+        with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+            cursor.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table}")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                writer.write(rows)
+                progress.add(len(rows))
+    finally:
+        writer.close()
+    return progress.summary(path)
+
+def insert_sql(table, columns):
+    # Le righe con una chiave già presente si saltano: ripetere un lotto non crea duplicati
+    verb = 'INSERT OR IGNORE' if config.STORAGE_BACKEND == 'sqlite' else 'INSERT IGNORE'
+    names = ', '.join(name for name, _ in columns)
+    return f"{verb} INTO {table} ({names}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+def source_signature(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+def load_checkpoint(path, table, source):
+    """Righe già importate secondo il checkpoint (0 se assente); None se riguarda un altro file."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return 0
+    if checkpoint.get('table') != table or checkpoint.get('source') != source:
+        return None
+    return checkpoint['rows']
+
+def save_checkpoint(path, table, source, rows):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump({'table': table, 'source': source, 'rows': rows,
+                   'updated_at': datetime.datetime.now().isoformat(timespec='seconds')}, f)
+    os.replace(temporary, path)
+
+def import_table(connection, table, path, file_format, batch_size, checkpoint_path, restart=False):
+    """Inserisce le righe del file a lotti, con commit e checkpoint dopo ogni lotto."""
+    columns = TABLES[table]
+    source = source_signature(path)
+    done = 0 if restart else load_checkpoint(checkpoint_path, table, source)
+    if done is None:
+        print(f"Il checkpoint {checkpoint_path} è di un altro file o tabella: usa --restart per ricominciare")
+        return None
+    if done:
+        print(f"Ripresa dopo {done} righe già importate")
+    sql = insert_sql(table, columns)
+    progress = Progress(f"Importazione in {table}")
+    skip = done  # Righe scritte in un'esecuzione precedente: si leggono ma non si inseriscono
+    for batch in READERS[file_format](path, columns, batch_size):
+        if skip:
+            if len(batch) <= skip:
+                skip -= len(batch)
+                continue
+            batch, skip = batch[skip:], 0
+        with connection.cursor() as cursor:
+            # pymysql trasforma executemany su INSERT ... VALUES in un'unica INSERT multi-riga
+            cursor.executemany(sql, batch)
+            if table == 'records':
+                # Classifiche e record personali leggono best_records: va aggiornata con lo storico
+                cursor.executemany(best_upsert_sql(), best_rows(
+                    [row[1:] for row in batch if None not in row[1:]]
+                ))
+        connection.commit()
+        done += len(batch)
+        save_checkpoint(checkpoint_path, table, source, done)
+        progress.add(len(batch))
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)  # Importazione completata
+    return progress.summary(path)
+
+def database_for(table, game):
+    return config.DB_NAME if table == 'user' else config.GAME_DATABASES[game]
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='admin.py', description="Esportazione e importazione delle tabelle in streaming")
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('table', choices=tuple(TABLES))
+    parser.add_argument('file')
+    parser.add_argument('--game', choices=tuple(config.GAME_DATABASES), default='memory',
+                        help="database dei record (predefinito: memory)")
+    parser.add_argument('--database', help="nome del database, se diverso da quello del gioco")
+    parser.add_argument('--format', choices=FORMATS, help="predefinito: dall'estensione del file")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--checkpoint', help="file del checkpoint (predefinito: <file>.checkpoint.json)")
+    parser.add_argument('--restart', action='store_true', help="ignora il checkpoint e importa da capo")
+    args = parser.parse_args(argv[1:])
+
+    file_format = args.format or detect_format(args.file)
+    if file_format not in FORMATS:
+        print(f"Formato non riconosciuto per {args.file}: usa --format {'|'.join(FORMATS)}")
+        return 1
+    if file_format == 'parquet' and parquet is None:
+        print("Il formato Parquet richiede pyarrow (pip install pyarrow)")
+        return 1
+    if args.command == 'import' and not os.path.exists(args.file):
+        print(f"File non trovato: {args.file}")
+        return 1
+
+    database = args.database or database_for(args.table, args.game)
+    try:
+        # Lotti grandi possono durare più di DB_READ_TIMEOUT
+        connection = storage.connect(database, dict_rows=False, read_timeout=None)
+    except pymysql.MySQLError as e:
+        print(f"Errore nella connessione al database {database}: {e}")
+        return 1
+    try:
+        if args.command == 'export':
+            export_table(connection, args.table, args.file, file_format, args.batch_size)
+        else:
+            checkpoint = args.checkpoint or f'{args.file}.checkpoint.json'
+            if import_table(connection, args.table, args.file, file_format, args.batch_size, checkpoint,
+                            restart=args.restart) is None:
+                return 1
+    except pymysql.MySQLError as e:
+        print(f"Errore del database ({args.command} di {args.table}): {e}")
+        return 1
+    finally:
+        connection.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import math
+import hashlib
+import threading
+import time
+import pymysql
+import config
+import storage
+from leaderboard import DIFFICULTIES, IdGaps
+
+# Statistiche dei tempi per gioco e difficoltà (partite completate, media, varianza,
+# mediana, p90) aggiornate in modo incrementale: ogni riga dello storico (records)
+# viene contata una sola volta seguendo l'id, come fanno le classifiche; gli id saltati
+# perché scritti da transazioni ancora aperte si ricontrollano (IdGaps in leaderboard.py).
+# Media e varianza con l'algoritmo di Welford, quantili con uno sketch logaritmico
+# (errore relativo fisso) che si può unire con altri sketch.
+# Lo stato si salva periodicamente in un file JSON e al riavvio si riparte da lì;
+# per ricalcolare tutto dallo storico:
+#   python aggregates.py rebuild [gioco ...]
+# (poi si riavvia il server, altrimenti i worker riscrivono lo snapshot con il loro stato)
+
+class RunningStats:
+    """Conteggio, media, varianza, minimo e massimo con l'algoritmo di Welford."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Somma dei quadrati degli scarti dalla media
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def merge(self, other):
+        """Unisce le statistiche di un altro insieme (formula di Chan)."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def variance(self):
+        """Varianza campionaria (None con meno di due valori)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.minimum, 'max': self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = data['count'], data['mean'], data['m2']
+        stats.minimum, stats.maximum = data['min'], data['max']
+        return stats
+
+class QuantileSketch:
+    """Sketch dei quantili a bucket logaritmici: errore relativo al massimo `accuracy`.
+
+    Ogni valore positivo finisce nel bucket ceil(log(x) / log(gamma)); due sketch con la
+    stessa accuratezza si uniscono sommando i conteggi, quindi l'unione è esatta.
+    """
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}  # indice -> conteggio
+        self.zeros = 0  # Valori <= 0, fuori dalla scala logaritmica
+        self.count = 0
+
+    def add(self, value, count=1):
+        if value <= 0:
+            self.zeros += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError("Si possono unire solo sketch con la stessa accuratezza")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        """Valore al quantile q (0..1), oppure None se lo sketch è vuoto."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Punto medio (in senso relativo) del bucket (gamma^(i-1), gamma^i]
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'accuracy': self.accuracy, 'zeros': self.zeros, 'buckets': {str(k): v for k, v in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['accuracy'])
+        sketch.zeros = data['zeros']
+        sketch.buckets = {int(k): v for k, v in data['buckets'].items()}
+        sketch.count = sketch.zeros + sum(sketch.buckets.values())
+        return sketch
+
+class TimeStats:
+    """Statistiche dei tempi di un gioco e di una difficoltà, con il JSON già pronto."""
+    def __init__(self, accuracy=0.01):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(accuracy)
+        self.body = None
+        self.etag = None
+
+    def add(self, value):
+        self.stats.add(value)
+        self.sketch.add(value)
+        self.body = None
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+        self.body = None
+
+    def quantile(self, q):
+        # Il punto medio del bucket può uscire dai tempi osservati: si riporta tra minimo e massimo
+        value = self.sketch.quantile(q)
+        if value is None or self.stats.minimum is None:
+            return value
+        return min(max(value, self.stats.minimum), self.stats.maximum)
+
+    def render(self, game, difficulty):
+        """JSON ed ETag, ricalcolati solo dopo nuovi tempi."""
+        if self.body is None:
+            variance = self.stats.variance()
+            self.body = json.dumps({
+                'game': game,
+                'difficulty': difficulty,
+                'completed': self.stats.count,
+                'mean': self.stats.mean if self.stats.count else None,
+                'variance': variance,
+                'stddev': math.sqrt(variance) if variance is not None else None,
+                'min': self.stats.minimum,
+                'max': self.stats.maximum,
+                'median': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+            }).encode('utf-8')
+            self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        return self.body, self.etag
+
+    def to_dict(self):
+        return {'stats': self.stats.to_dict(), 'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls()
+        result.stats = RunningStats.from_dict(data['stats'])
+        result.sketch = QuantileSketch.from_dict(data['sketch'])
+        return result
+
+class Aggregates:
+    def __init__(self, connect, games, snapshot_path=None, snapshot_interval=60.0, max_staleness=5.0,
+                 accuracy=0.01, batch_size=5000):
+        self.connect = connect  # Funzione gioco -> connessione (o None)
+        self.games = tuple(games)
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.max_staleness = max_staleness
+        self.accuracy = accuracy
+        self.batch_size = batch_size
+        self.tables = {(game, difficulty): TimeStats(accuracy) for game in self.games for difficulty in DIFFICULTIES}
+        self.last_id = {game: 0 for game in self.games}
+        self.gaps = {game: IdGaps() for game in self.games}
+        self.refreshed_at = {game: 0.0 for game in self.games}
+        self.saved_at = time.monotonic()
+        self._refresh_locks = {game: threading.Lock() for game in self.games}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load_snapshot()
+
+    def add_rows(self, game, rows):
+        """Aggiunge righe (id, tempo, difficoltà) dello storico successive a last_id o rimaste indietro."""
+        with self._lock:
+            gaps = self.gaps[game]
+            for record_id, record_time, difficulty in rows:
+                if record_id <= self.last_id[game]:
+                    if not gaps.fill(record_id):
+                        continue  # Già contata
+                else:
+                    gaps.skip(self.last_id[game], record_id)
+                    self.last_id[game] = record_id
+                table = self.tables.get((game, difficulty))
+                if table is not None and record_time is not None:
+                    table.add(record_time)
+                self._dirty = True
+
+    def refresh(self, game, force=False):
+        """Legge i record nuovi se le statistiche sono più vecchie del limite di staleness."""
+        if game not in self._refresh_locks:
+            return
+        if not force and time.monotonic() - self.refreshed_at[game] < self.max_staleness:
+            return
+        lock = self._refresh_locks[game]
+        if not lock.acquire(blocking=False):
+            return  # Un altro thread sta già aggiornando: si servono i dati attuali
+        try:
+            connection = self.connect(game)
+            if connection is None:
+                return
+            try:
+                rows = self.gaps[game].fetch(connection, 'id, time, difficulty')
+                self.add_rows(game, [(row['id'], row['time'], row['difficulty']) for row in rows])
+                while True:
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            'SELECT id, time, difficulty FROM records WHERE id > %s ORDER BY id LIMIT %s',
+                            (self.last_id[game], self.batch_size)
+                        )
+                        rows = cursor.fetchall()
+                    self.add_rows(game, [(row['id'], row['time'], row['difficulty']) for row in rows])
+                    if len(rows) < self.batch_size:
+                        break
+            finally:
+                connection.close()
+            self.refreshed_at[game] = time.monotonic()
+        except pymysql.MySQLError as e:
+            print(f"Errore nell'aggiornamento delle statistiche di {game}: {e}")
+        finally:
+            lock.release()
+        if time.monotonic() - self.saved_at >= self.snapshot_interval:
+            self.save_snapshot()
+
+    def get(self, game, difficulty):
+        """Restituisce (json, etag) delle statistiche, oppure None se non esistono."""
+        table = self.tables.get((game, difficulty))
+        if table is None:
+            return None
+        self.refresh(game)
+        with self._lock:
+            return table.render(game, difficulty)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'accuracy': self.accuracy,
+                'last_id': dict(self.last_id),
+                'gaps': {game: sorted(gaps.pending) for game, gaps in self.gaps.items()},
+                'tables': {f'{game}/{difficulty}': table.to_dict() for (game, difficulty), table in self.tables.items()},
+            }
+
+    def save_snapshot(self):
+        """Scrive lo stato su file in modo atomico (ogni worker può farlo: vince il più recente)."""
+        self.saved_at = time.monotonic()
+        if not self.snapshot_path or not self._dirty:
+            return
+        data = self.snapshot()
+        self._dirty = False
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+        temporary = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temporary, self.snapshot_path)
+        except OSError as e:
+            print(f"Impossibile salvare le statistiche in {self.snapshot_path}: {e}")
+
+    def load_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Snapshot delle statistiche illeggibile, si riparte dallo storico: {e}")
+            return
+        if data.get('accuracy') != self.accuracy:
+            print("Snapshot delle statistiche con un'altra accuratezza: si riparte dallo storico")
+            return
+        for game in self.games:
+            self.last_id[game] = data['last_id'].get(game, 0)
+            self.gaps[game].pending = dict.fromkeys(data.get('gaps', {}).get(game, []), time.monotonic())
+            for difficulty in DIFFICULTIES:
+                table = data['tables'].get(f'{game}/{difficulty}')
+                if table is not None:
+                    self.tables[(game, difficulty)] = TimeStats.from_dict(table)
+
+def rebuild(games, snapshot_path, accuracy):
+    """Ricalcola da zero i giochi indicati leggendo lo storico a blocchi; gli altri restano come nello snapshot."""
+    def connect(game):
+        return storage.connect(config.GAME_DATABASES[game])
+
+    aggregates = Aggregates(connect, config.GAME_DATABASES, snapshot_path=snapshot_path, accuracy=accuracy)
+    for game in games:
+        start = time.perf_counter()
+        aggregates.last_id[game] = 0
+        aggregates.gaps[game] = IdGaps()
+        for difficulty in DIFFICULTIES:
+            aggregates.tables[(game, difficulty)] = TimeStats(accuracy)
+        aggregates.refresh(game, force=True)
+        count = sum(aggregates.tables[(game, difficulty)].stats.count for difficulty in DIFFICULTIES)
+        print(f"{game}: {count} partite fino all'id {aggregates.last_id[game]} ({time.perf_counter() - start:.2f} s)")
+    aggregates._dirty = True
+    aggregates.save_snapshot()
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ('rebuild', 'show'):
+        print("Uso: python aggregates.py rebuild|show [gioco ...]")
+        return 1
+    games = argv[2:] or list(config.GAME_DATABASES)
+    unknown = [game for game in games if game not in config.GAME_DATABASES]
+    if unknown:
+        print(f"Giochi sconosciuti: {', '.join(unknown)}")
+        return 1
+    try:
+        if argv[1] == 'rebuild':
+            rebuild(games, config.AGGREGATES_SNAPSHOT_PATH, config.AGGREGATES_ACCURACY)
+    except pymysql.MySQLError as e:
+        print(f"Errore durante la ricostruzione delle statistiche: {e}")
+        return 1
+    aggregates = Aggregates(None, games, snapshot_path=config.AGGREGATES_SNAPSHOT_PATH, accuracy=config.AGGREGATES_ACCURACY)
+    for game in games:
+        for difficulty in DIFFICULTIES:
+            body, _ = aggregates.tables[(game, difficulty)].render(game, difficulty)
+            print(body.decode('utf-8'))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
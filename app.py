@@ -1,44 +1,130 @@
 import re
 import os
-import base64
+import hmac
 import mimetypes
+from functools import wraps
 from flask import Flask, jsonify, render_template, redirect, url_for, request, flash, send_from_directory
+from werkzeug.middleware.proxy_fix import ProxyFix
+from itsdangerous import URLSafeTimedSerializer
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 import pymysql.cursors
 import datetime
-import json
+import config
+from db_pool import ConnectionPool, PoolTimeout
+from user_cache import TTLCache
+import schema
+import resilience
+from hashing import PasswordHasher, HashQueueFull, build_method
+from leaderboard import LeaderboardCache, DIFFICULTIES
+import leaderboard_stream
+from ranking import RankService
+from aggregates import Aggregates
+from record_buffer import WriteBehindBuffer, BufferFull
+import atexit
+import threading
+from static_files import send_static, session_login_required, IMMUTABLE_MAX_AGE
+from metrics import Registry, instrument_app, statement_verb
+from throttle import create_limiter, ConcurrencyLimiter
+from page_cache import FragmentCacheExtension, TemplateVersion, compress_responses
+from sessions import load_secret_key, SessionStore, ServerSessionInterface
+import telemetry
+import race_server
+import daily
+import uploads
 
 # Aggiungi il MIME type per i file .wasm
 mimetypes.add_type('application/wasm', '.wasm')
 
-# Genera una chiave segreta casuale di 24 byte
-secret_key = base64.urlsafe_b64encode(os.urandom(24)).decode('utf-8')
-
 app = Flask(__name__)
-app.config['SECRET_KEY'] = secret_key
+# Chiave stabile fra riavvii e worker, con le chiavi precedenti accettate durante la rotazione
+app.config['SECRET_KEY'] = load_secret_key(config.SECRET_KEY, config.SECRET_KEY_PATH)
+app.config['SECRET_KEY_FALLBACKS'] = config.SECRET_KEY_FALLBACKS
+if config.SESSION_STORE == 'server':
+    session_store = SessionStore(config.SESSION_DB_PATH, cache_size=config.SESSION_CACHE_SIZE,
+                                 cache_ttl=config.SESSION_CACHE_TTL)
+    app.session_interface = ServerSessionInterface(session_store)
+if config.PROXY_FIX_HOPS:
+    # L'IP del client (usato dai limiti di login) arriva dal proxy in X-Forwarded-For
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.PROXY_FIX_HOPS)
+
+# Frammenti dei template in cache, per stato di autenticazione e versione dei template
+app.jinja_env.add_extension(FragmentCacheExtension)
+fragment_cache = TTLCache(max_size=config.FRAGMENT_CACHE_SIZE, ttl=config.FRAGMENT_CACHE_TTL)
+template_version = TemplateVersion(os.path.join(app.root_path, app.template_folder), config.TEMPLATE_CHECK_INTERVAL)
+app.jinja_env.fragment_cache = fragment_cache if config.FRAGMENT_CACHE_SIZE else None
+app.jinja_env.fragment_cache_key = lambda: (current_user.is_authenticated, template_version())
+
+# Pagine HTML compresse con br/gzip sopra la soglia
+compressed_pages = compress_responses(app, min_size=config.HTML_COMPRESS_MIN_SIZE, level=config.HTML_COMPRESS_LEVEL)
+
+# Metriche esposte su /metrics: latenza per route, stati, richieste in corso, tempi SQL
+metrics_registry = Registry()
+instrument_app(app, metrics_registry)
+db_query_seconds = metrics_registry.histogram('db_query_duration_seconds', 'Durata delle istruzioni SQL', ('database', 'statement'))
+db_acquire_seconds = metrics_registry.histogram('db_pool_acquire_seconds', 'Attesa per ottenere una connessione dal pool', ('database',))
+
+# Il backend (MySQL remoto o SQLite locale) si sceglie con STORAGE_BACKEND
+db_name = config.DB_NAME
+
+def open_db_connection(database=None):
+    # Il pool controlla il circuit breaker in acquire(): qui solo timeout e nuovi tentativi
+    return resilience.connect(database or db_name, check=False)
+
+def create_pool(database=None):
+    """Pool di connessioni limitato; le connessioni si aprono al primo uso."""
+    label = database or db_name
+    return ConnectionPool(
+        lambda: open_db_connection(database),
+        min_size=config.DB_POOL_MIN_SIZE,
+        max_size=config.DB_POOL_MAX_SIZE,
+        timeout=config.DB_POOL_TIMEOUT,
+        recycle=config.DB_POOL_RECYCLE,
+        ping_interval=config.DB_POOL_PING_INTERVAL,
+        acquire_observer=lambda seconds: db_acquire_seconds.observe(seconds, label),
+        query_observer=lambda query, seconds: db_query_seconds.observe(seconds, label, statement_verb(query)),
+        breaker=resilience.breaker_for(label)
+    )
+
+# Pool di connessioni condiviso da tutte le route
+db_pool = create_pool()
+
+# Ogni gioco salva i record nel proprio database: un pool per ciascuno, riusando quello principale
+game_pools = {
+    game: db_pool if database == db_name else create_pool(database)
+    for game, database in config.GAME_DATABASES.items()
+}
 
-# Leggi le variabili d'ambiente
-db_host = 'RobertaMerlo.mysql.pythonanywhere-services.com'
-db_user = 'RobertaMerlo'
-db_password = 'Y9puX%40a8'
-db_name = 'RobertaMerlo$db'
+# Lo schema si crea e si aggiorna con "python schema.py migrate";
+# all'avvio basta controllarne la versione alla prima connessione
+schema_checked = False
 
-# Crea la connessione al database
+# Prende una connessione dal pool; close() la restituisce al pool
 def get_db_connection():
+    global schema_checked
     try:
-        return pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            port=3306,  # porta predefinita
-            cursorclass=pymysql.cursors.DictCursor
-        )
+        connection = db_pool.acquire()
+        if not schema_checked:
+            schema_checked = True
+            schema.check_schema(connection)
+        return connection
+    except PoolTimeout as e:
+        print(f"Pool di connessioni esaurito: {e}")
+        return None
     except pymysql.MySQLError as e:
         print(f"Errore nella connessione al database: {e}")
         return None
 
+# Connessione al database dei record di un gioco
+def get_game_connection(game):
+    try:
+        return game_pools[game].acquire()
+    except PoolTimeout as e:
+        print(f"Pool di connessioni esaurito: {e}")
+        return None
+    except pymysql.MySQLError as e:
+        print(f"Errore nella connessione al database di {game}: {e}")
+        return None
+
 # Inizializza Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -50,58 +136,36 @@ class User(UserMixin):
         self.id = id
         self.username = username
 
+# Cache degli utenti: la query viene eseguita solo in caso di miss
+user_cache = TTLCache(max_size=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+
+def invalidate_user(user_id):
+    """Da chiamare ogni volta che la riga dell'utente viene modificata."""
+    user_cache.invalidate(str(user_id))
+
 @login_manager.user_loader
 def load_user(user_id):
+    cached = user_cache.get(str(user_id))
+    if cached is not None:
+        return cached
     connection = get_db_connection()
     if connection is None:
         return None  # Gestione dell'errore di connessione
     try:
         with connection.cursor() as cursor:
-            sql = 'SELECT * FROM user WHERE id = %s'
+            sql = 'SELECT id, username FROM user WHERE id = %s'
             cursor.execute(sql, (user_id,))
             user = cursor.fetchone()
             if user:
-                return User(user['id'], user['username'])
+                user_obj = User(user['id'], user['username'])
+                user_cache.put(str(user['id']), user_obj)
+                return user_obj
     except pymysql.MySQLError as e:
         print(f"Errore nel caricamento dell'utente: {e}")
     finally:
         connection.close()
     return None
 
-# Funzione per creare il database e la tabella
-def create_database_and_table():
-    connection = pymysql.connect(
-        host=db_host,
-        user=db_user,
-        password=db_password
-    )
-    try:
-        with connection.cursor() as cursor:
-            # Crea il database, se non esiste
-            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
-            connection.commit()
-
-        # Connettiti al database appena creato
-        connection.select_db(db_name)
-
-        # Crea la tabella degli utenti, se non esiste
-        with connection.cursor() as cursor:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(255) NOT NULL UNIQUE,
-                    password VARCHAR(510) NOT NULL
-                )
-            ''')
-            connection.commit()
-    except pymysql.MySQLError as e:
-        print(f"Errore nella creazione del database o della tabella: {e}")
-    finally:
-        connection.close()
-
-# Esegui la creazione del database e della tabella prima di avviare l'app
-create_database_and_table()
-
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -119,16 +183,48 @@ def start_p():
     # Se il file esiste, invialo come risposta
     return send_from_directory('p/build/web', 'index.html')
 
+# Cartella della build WASM servita dalle route statiche
+web_build_directory = os.path.join(app.root_path, 'p/build/web')
+
 @app.route('/p.apk')
-@login_required
+@session_login_required
 def serve_apk():
-    return send_from_directory('/home/RobertaMerlo/My_Games/p/build/web', 'p.apk')
+    return send_static(web_build_directory, 'p.apk')
 
 @app.route('/assets/games/<path:filename>')
-@login_required
+@session_login_required
 def serve_game_assets(filename):
-    assets_directory = os.path.join(app.root_path, 'p/build/web/assets/games')
-    return send_from_directory(assets_directory, filename)
+    assets_directory = os.path.join(web_build_directory, 'assets/games')
+    return send_static(assets_directory, filename)
+
+# Pool limitato per gli hash delle password, con metodo e costo configurabili
+password_hasher = PasswordHasher(
+    method=build_method(config.PASSWORD_HASH_METHOD, config.PASSWORD_HASH_ITERATIONS),
+    workers=config.PASSWORD_HASH_WORKERS,
+    max_pending=config.PASSWORD_HASH_MAX_PENDING,
+    executor=config.PASSWORD_HASH_EXECUTOR
+)
+
+def upgrade_password_hash(user, password):
+    """Dopo un login riuscito ricalcola l'hash se è stato creato con parametri superati."""
+    if not password_hasher.needs_rehash(user['password']):
+        return
+    try:
+        new_hash = password_hasher.hash(password)
+    except HashQueueFull:
+        return  # Si riproverà al prossimo login
+    connection = get_db_connection()
+    if connection is None:
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE user SET password = %s WHERE id = %s', (new_hash, user['id']))
+            connection.commit()
+            invalidate_user(user['id'])
+    except pymysql.MySQLError as e:
+        print(f"Errore nell'aggiornamento dell'hash della password: {e}")
+    finally:
+        connection.close()
 
 def validate_password(password):
     """Verifica se la password soddisfa i criteri richiesti."""
@@ -142,7 +238,50 @@ def validate_password(password):
         return False
     return True
 
+# Limiti per login e registrazione, controllati prima di toccare database e hash
+ip_limiter = create_limiter(config.LOGIN_IP_PER_MINUTE / 60.0, config.LOGIN_IP_BURST,
+                            config.THROTTLE_STORE_PATH, namespace='ip:')
+user_limiter = create_limiter(config.LOGIN_USER_PER_MINUTE / 60.0, config.LOGIN_USER_BURST,
+                              config.THROTTLE_STORE_PATH, namespace='user:')
+auth_concurrency = ConcurrencyLimiter(config.AUTH_MAX_CONCURRENCY)
+throttled_requests = metrics_registry.counter('auth_throttled_total', 'Richieste di login e registrazione rifiutate',
+                                              ('endpoint', 'reason'))
+metrics_registry.callback_gauge('auth_in_flight', 'Login e registrazioni in corso', (),
+                                lambda: [((), auth_concurrency.in_flight)])
+
+def throttled(template, per_user=False):
+    """Applica ai POST il limite di concorrenza e i token bucket per IP (e per username)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'POST':
+                return view(*args, **kwargs)
+            if not auth_concurrency.acquire():
+                # Risposta immediata e senza template: sotto attacco ogni millisecondo conta
+                throttled_requests.inc(request.endpoint, 'concurrency')
+                return app.response_class('Troppe richieste, riprova tra poco.', status=429,
+                                          mimetype='text/plain', headers={'Retry-After': '1'})
+            try:
+                wait = ip_limiter.hit(request.remote_addr or '')
+                reason = 'ip'
+                username = (request.form.get('username') or '').strip().lower()
+                if not wait and per_user and username:
+                    wait = user_limiter.hit(username)
+                    reason = 'user'
+                if wait:
+                    throttled_requests.inc(request.endpoint, reason)
+                    flash('Troppi tentativi, riprova tra qualche minuto.', 'danger')
+                    response = app.make_response((render_template(template), 429))
+                    response.headers['Retry-After'] = str(int(wait) + 1)
+                    return response
+                return view(*args, **kwargs)
+            finally:
+                auth_concurrency.release()
+        return wrapper
+    return decorator
+
 @app.route('/register', methods=['GET', 'POST'])
+@throttled('register.html')
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -169,6 +308,13 @@ def register():
             flash('Le password non corrispondono.', 'danger')
             return redirect(url_for('register'))
 
+        # L'hash viene calcolato sul pool dedicato, prima di occupare una connessione
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashQueueFull:
+            flash('Il server è momentaneamente sovraccarico, riprova tra qualche secondo.', 'danger')
+            return render_template('register.html'), 503
+
         connection = get_db_connection()
         if connection is None:
             flash('Errore nella connessione al database', 'danger')
@@ -176,7 +322,7 @@ def register():
 
         try:
             with connection.cursor() as cursor:
-                sql = 'SELECT * FROM user WHERE username = %s'
+                sql = 'SELECT id FROM user WHERE username = %s'
                 cursor.execute(sql, (username,))
                 user = cursor.fetchone()
 
@@ -184,10 +330,10 @@ def register():
                     flash('Username già esistente. Per favore scegli un nome diverso.', 'danger')
                     return redirect(url_for('register'))
 
-                hashed_password = generate_password_hash(password)
                 sql = 'INSERT INTO user (username, password) VALUES (%s, %s)'
                 cursor.execute(sql, (username, hashed_password))
                 connection.commit()
+                invalidate_user(cursor.lastrowid)
                 flash('Registrazione avvenuta con successo! Per favore effettua il login.', 'success')
 
                 return redirect(url_for('login'))
@@ -199,6 +345,7 @@ def register():
     return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@throttled('login.html', per_user=True)
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -211,21 +358,30 @@ def login():
 
         try:
             with connection.cursor() as cursor:
-                sql = 'SELECT * FROM user WHERE username = %s'
+                sql = 'SELECT id, username, password FROM user WHERE username = %s'
                 cursor.execute(sql, (username,))
                 user = cursor.fetchone()
-
-                if user and check_password_hash(user['password'], password):
-                    user_obj = User(user['id'], user['username'])
-                    login_user(user_obj)
-                    return redirect(url_for('index'))
-                else:
-                    flash('Accesso fallito. Controlla username e/o password', 'danger')
         except pymysql.MySQLError as e:
             flash(f'Errore durante il login: {e}', 'danger')
             print(f"Errore nel database durante il login: {e}")
+            return render_template('login.html')
         finally:
             connection.close()
+
+        # La verifica gira sul pool degli hash, senza tenere occupata la connessione
+        try:
+            valid = bool(user and password) and password_hasher.verify(user['password'], password)
+        except HashQueueFull:
+            flash('Il server è momentaneamente sovraccarico, riprova tra qualche secondo.', 'danger')
+            return render_template('login.html'), 503
+
+        if valid:
+            upgrade_password_hash(user, password)
+            user_obj = User(user['id'], user['username'])
+            user_cache.put(str(user['id']), user_obj)
+            login_user(user_obj)
+            return redirect(url_for('index'))
+        flash('Accesso fallito. Controlla username e/o password', 'danger')
     return render_template('login.html')
 
 @app.route('/logout')
@@ -236,9 +392,417 @@ def logout():
 
 # Nuova route per servire i file .wasm
 @app.route('/<path:filename>')
-@login_required
+@session_login_required
 def serve_file(filename):
-    return send_from_directory('p/build/web', filename)
+    return send_static(web_build_directory, filename)
+
+# Classifiche servite dalla memoria, aggiornate in modo incrementale
+leaderboards = LeaderboardCache(
+    get_game_connection,
+    config.GAME_DATABASES,
+    size=config.LEADERBOARD_SIZE,
+    max_staleness=config.LEADERBOARD_MAX_STALENESS
+)
+
+@app.route('/api/leaderboard/<game>/<difficulty>', methods=['GET'])
+@session_login_required
+def leaderboard(game, difficulty):
+    """Migliori tempi per utente; con If-None-Match risponde 304 se non è cambiato nulla."""
+    result = leaderboards.get(game, difficulty)
+    if result is None:
+        return jsonify({'error': 'Classifica non trovata'}), 404
+    body, etag = result
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Classifiche in diretta: il server asyncio (leaderboard_stream.py) accetta i token firmati con la stessa chiave
+leaderboard_stream_tokens = URLSafeTimedSerializer(app.secret_key, salt=leaderboard_stream.TOKEN_SALT)
+
+@app.route('/api/leaderboard/stream/token', methods=['GET'])
+@login_required
+def leaderboard_stream_token():
+    """Token di breve durata per seguire le classifiche in diretta con l'utente loggato."""
+    return jsonify({'token': leaderboard_stream_tokens.dumps({'user': current_user.username}),
+                    'url': config.LEADERBOARD_STREAM_URL, 'expires_in': config.LEADERBOARD_STREAM_TOKEN_MAX_AGE})
+
+# Posizione e percentile di ogni giocatore, aggiornati dagli stessi eventi delle classifiche
+rank_service = RankService(leaderboards, resolution=config.RANK_RESOLUTION, max_time=config.RANK_MAX_TIME)
+
+@app.route('/api/rank/<game>/<difficulty>', methods=['GET'])
+@login_required
+def rank(game, difficulty):
+    """Posizione, percentile e giocatori vicini dell'utente loggato."""
+    radius = min(max(request.args.get('around', 5, type=int), 0), 50)
+    try:
+        result = rank_service.position(game, difficulty, current_user.username, radius)
+    except KeyError:
+        return jsonify({'error': 'Classifica non trovata'}), 404
+    if result is None:
+        total = len(rank_service.indexes[(game, difficulty)].best)
+        return jsonify({'user': current_user.username, 'rank': None, 'total': total})
+    return jsonify(result)
+
+# Statistiche dei tempi per gioco e difficoltà, aggiornate leggendo solo le righe nuove dello storico
+aggregates = Aggregates(
+    get_game_connection,
+    config.GAME_DATABASES.keys(),
+    snapshot_path=config.AGGREGATES_SNAPSHOT_PATH,
+    snapshot_interval=config.AGGREGATES_SNAPSHOT_INTERVAL,
+    max_staleness=config.LEADERBOARD_MAX_STALENESS,
+    accuracy=config.AGGREGATES_ACCURACY
+)
+atexit.register(aggregates.save_snapshot)
+
+@app.route('/api/stats/<game>/<difficulty>', methods=['GET'])
+@session_login_required
+def game_stats(game, difficulty):
+    """Partite completate, media, varianza, mediana e p90 dei tempi, già calcolati."""
+    result = aggregates.get(game, difficulty)
+    if result is None:
+        return jsonify({'error': 'Statistiche non trovate'}), 404
+    body, etag = result
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def update_leaderboards(game, rows):
+    """Dopo ogni scrittura del buffer aggiorna subito le classifiche e le statistiche."""
+    for record_time, date, user, difficulty in rows:
+        leaderboards.record(game, user, difficulty, record_time, date)
+    aggregates.refresh(game, force=True)  # Le righe appena scritte, lette per id dallo storico
+
+# Buffer write-behind per i risultati inviati dai client, svuotato anche in chiusura
+record_buffer = WriteBehindBuffer(
+    get_game_connection,
+    max_size=config.RECORD_BUFFER_MAX_SIZE,
+    batch_size=config.RECORD_BUFFER_BATCH_SIZE,
+    flush_interval=config.RECORD_BUFFER_FLUSH_INTERVAL,
+    spill_path=config.RECORD_BUFFER_SPILL_PATH,
+    max_attempts=config.RECORD_BUFFER_MAX_ATTEMPTS,
+    on_flush=update_leaderboards
+)
+atexit.register(record_buffer.close)
+
+def parse_record(item, username, now):
+    """Valida un risultato inviato dal client; restituisce (gioco, riga) oppure un messaggio d'errore."""
+    if not isinstance(item, dict):
+        return None, 'Ogni risultato deve essere un oggetto'
+    game = item.get('game')
+    difficulty = item.get('difficulty')
+    record_time = item.get('time')
+    if game not in config.GAME_DATABASES:
+        return None, 'Gioco non valido'
+    if difficulty not in DIFFICULTIES:
+        return None, 'Difficoltà non valida'
+    if isinstance(record_time, bool) or not isinstance(record_time, (int, float)) or not 0 < record_time < 86400:
+        return None, 'Tempo non valido'
+    date = now
+    if item.get('date') is not None:
+        try:
+            date = datetime.datetime.fromisoformat(str(item['date'])).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return None, 'Data non valida'
+    return (game, (record_time, date, username, difficulty)), None
+
+@app.route('/api/records', methods=['POST'])
+@login_required
+def ingest_records():
+    """Riceve un array di risultati e li accoda per la scrittura a lotti."""
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get('records')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Serve un array di risultati'}), 400
+    if len(items) > config.RECORD_INGEST_MAX_ITEMS:
+        return jsonify({'error': f'Massimo {config.RECORD_INGEST_MAX_ITEMS} risultati per richiesta'}), 413
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    records = []
+    errors = []
+    for index, item in enumerate(items):
+        record, error = parse_record(item, current_user.username, now)
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            records.append(record)
+    if errors:
+        return jsonify({'error': 'Risultati non validi', 'details': errors}), 400
+
+    try:
+        record_buffer.add(records)
+    except BufferFull:
+        response = jsonify({'error': 'Server occupato, riprova più tardi'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({'accepted': len(records)}), 202
+
+# Telemetria delle partite: lotti binari scritti per colonne in segmenti orari append-only
+telemetry_writer = telemetry.SegmentWriter(config.TELEMETRY_DIR)
+atexit.register(telemetry_writer.close)
+telemetry_max_bytes = telemetry.BATCH_HEADER.size + 1024 + config.TELEMETRY_MAX_EVENTS * telemetry.EVENT.size
+telemetry_events = metrics_registry.counter('telemetry_events_total', 'Eventi di telemetria ricevuti', ('game',))
+
+@app.route('/api/telemetry/<game>', methods=['POST'])
+def ingest_telemetry(game):
+    """Riceve un lotto di eventi (application/octet-stream) da una sessione o con il token dei giochi."""
+    token = request.headers.get('Authorization', '')
+    by_token = bool(config.TELEMETRY_TOKEN) and hmac.compare_digest(token, f'Bearer {config.TELEMETRY_TOKEN}')
+    if not by_token and not current_user.is_authenticated:
+        return login_manager.unauthorized()
+    if game not in config.GAME_DATABASES:
+        return jsonify({'error': 'Gioco non valido'}), 404
+    if request.content_length is None or request.content_length > telemetry_max_bytes:
+        return jsonify({'error': f'Massimo {config.TELEMETRY_MAX_EVENTS} eventi per richiesta'}), 413
+    try:
+        meta, columns = telemetry.decode_batch(request.get_data(cache=False))
+    except telemetry.InvalidBatch as e:
+        return jsonify({'error': str(e)}), 400
+    if not by_token:
+        meta['user'] = current_user.username  # Con la sessione vale l'utente loggato, non quello dichiarato
+    telemetry_writer.append(game, meta, columns)
+    telemetry_events.inc(game, amount=len(columns[0]))
+    return '', 204
+
+# Gare in tempo reale: il server asyncio (race_server.py) accetta i token firmati con la stessa chiave
+race_tokens = URLSafeTimedSerializer(app.secret_key, salt=race_server.TOKEN_SALT)
+
+@app.route('/api/race/token', methods=['GET'])
+@login_required
+def race_token():
+    """Token di breve durata per entrare in una gara con l'utente loggato."""
+    return jsonify({'token': race_tokens.dumps({'user': current_user.username}), 'url': config.RACE_URL,
+                    'expires_in': config.RACE_TOKEN_MAX_AGE})
+
+# Sfide giornaliere: plance generate una volta e servite come blob immutabili (anche dalle cache HTTP)
+daily_boards = daily.DailyBoards(config.DAILY_DIR, app.secret_key,
+                                 keep_days=max(config.DAILY_KEEP_DAYS, config.DAILY_SUBMIT_DAYS))
+daily_leaderboards = daily.DailyLeaderboards(get_game_connection, size=config.LEADERBOARD_SIZE,
+                                             max_staleness=config.LEADERBOARD_MAX_STALENESS)
+
+def seconds_to_midnight():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), now.tzinfo)
+    return max(int((tomorrow - now).total_seconds()), 1)
+
+@app.route('/api/daily', methods=['GET'])
+def daily_index():
+    """Giorno della sfida corrente e indirizzi delle plance, in cache fino alla mezzanotte UTC."""
+    day = daily.today().isoformat()
+    response = jsonify({
+        'date': day,
+        'boards': {
+            game: {difficulty: url_for('daily_board', day=day, game=game, difficulty=difficulty)
+                   for difficulty in DIFFICULTIES}
+            for game in daily.GAMES
+        },
+    })
+    response.cache_control.public = True
+    response.cache_control.max_age = seconds_to_midnight()
+    return response
+
+@app.route('/api/daily/<day>/<game>/<difficulty>', methods=['GET'])
+def daily_board(day, game, difficulty):
+    """Blob della plancia (formato in daily.py): uguale per tutti e mai più modificato."""
+    day = daily.parse_day(day)
+    result = daily_boards.get(day, game, difficulty) if day else None
+    if result is None:
+        return jsonify({'error': 'Sfida non trovata'}), 404
+    body, etag = result
+    response = app.response_class(body, mimetype='application/octet-stream')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@app.route('/api/daily/<day>/<game>/<difficulty>/leaderboard', methods=['GET'])
+@session_login_required
+def daily_leaderboard(day, game, difficulty):
+    """Classifica della sfida, con ETag come le classifiche normali."""
+    day = daily.parse_day(day)
+    if day is None or game not in config.GAME_DATABASES or difficulty not in DIFFICULTIES or not daily_boards.in_window(day):
+        return jsonify({'error': 'Classifica non trovata'}), 404
+    result = daily_leaderboards.get(day, game, difficulty)
+    if result is None:
+        return jsonify({'error': 'Classifica non disponibile'}), 503
+    body, etag = result
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/daily/<day>/<game>/<difficulty>/result', methods=['POST'])
+@login_required
+def daily_result(day, game, difficulty):
+    """Tempo dell'utente loggato nella sfida di oggi (o dei DAILY_SUBMIT_DAYS giorni precedenti)."""
+    day = daily.parse_day(day)
+    if day is None or game not in config.GAME_DATABASES or difficulty not in DIFFICULTIES:
+        return jsonify({'error': 'Sfida non trovata'}), 404
+    if not 0 <= (daily.today() - day).days <= config.DAILY_SUBMIT_DAYS:
+        return jsonify({'error': 'Sfida chiusa'}), 409
+    record_time = (request.get_json(silent=True) or {}).get('time')
+    if isinstance(record_time, bool) or not isinstance(record_time, (int, float)) or not 0 < record_time < 86400:
+        return jsonify({'error': 'Tempo non valido'}), 400
+    if not daily_leaderboards.submit(day, game, difficulty, current_user.username, record_time):
+        response = jsonify({'error': 'Server occupato, riprova più tardi'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({'accepted': True}), 201
+
+# Immagini del puzzle caricate dagli utenti: elaborate una volta sola su un pool di processi
+upload_processor = uploads.UploadProcessor(config.UPLOAD_DIR, workers=config.UPLOAD_WORKERS,
+                                           max_pending=config.UPLOAD_MAX_PENDING)
+atexit.register(upload_processor.shutdown)
+
+def upload_response(key, state, detail):
+    if state == 'ready':
+        base = url_for('serve_upload', key=key, filename='')
+        return jsonify({'id': key, 'status': state, 'base_url': base, 'manifest': detail}), 200
+    response = jsonify({'id': key, 'status': state, 'status_url': url_for('upload_status', key=key)})
+    response.headers['Retry-After'] = '1'
+    return response, 202
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def upload_image():
+    """Riceve un'immagine (campo "image" o corpo della richiesta); 202 finché le tessere non sono pronte."""
+    if request.content_length is None or request.content_length > config.UPLOAD_MAX_BYTES:
+        return jsonify({'error': f'Immagine oltre {config.UPLOAD_MAX_BYTES} byte'}), 413
+    upload = request.files.get('image')
+    data = upload.read() if upload else request.get_data(cache=False)
+    if not data:
+        return jsonify({'error': 'Serve un\'immagine'}), 400
+    try:
+        key, manifest = upload_processor.submit(data)
+    except uploads.UploadQueueFull:
+        response = jsonify({'error': 'Server occupato, riprova più tardi'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    if manifest is not None:
+        return upload_response(key, 'ready', manifest)
+    return upload_response(key, 'processing', None)
+
+@app.route('/api/uploads/<key>', methods=['GET'])
+@session_login_required
+def upload_status(key):
+    """Stato dell'elaborazione; quando è pronta restituisce il manifest delle tessere."""
+    result = upload_processor.status(key) if uploads.is_image_id(key) else None
+    if result is None:
+        return jsonify({'error': 'Immagine non trovata'}), 404
+    state, detail = result
+    if state == 'failed':
+        return jsonify({'id': key, 'status': state, 'error': detail}), 422
+    return upload_response(key, state, detail)
+
+@app.route('/uploads/<key>/<path:filename>')
+def serve_upload(key, filename):
+    """Tessere e immagine ridotta: il percorso contiene l'hash del contenuto, quindi non cambiano mai."""
+    if not uploads.is_image_id(key):
+        return jsonify({'error': 'Immagine non trovata'}), 404
+    response = send_static(uploads.image_dir(config.UPLOAD_DIR, key), filename)
+    response.cache_control.no_cache = None
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def pool_samples():
+    samples = []
+    for database, pool in {config.GAME_DATABASES[game]: pool for game, pool in game_pools.items()}.items():
+        stats = pool.stats()
+        samples += [((database, 'in_use'), stats['in_use']), ((database, 'idle'), stats['idle']), ((database, 'waiting'), stats['waiting'])]
+    return samples
+
+def stats_samples(source, keys):
+    stats = source.stats()
+    return [((key,), stats[key]) for key in keys]
+
+metrics_registry.callback_gauge('db_pool_connections', 'Connessioni del pool per stato', ('database', 'state'), pool_samples)
+metrics_registry.callback_gauge('db_circuit_breaker', 'Circuit breaker per database (state: 0 chiuso, 1 prova, 2 aperto)',
+                                ('database', 'stat'),
+                                lambda: [((database, key), value) for database, breaker in list(resilience.breakers.items())
+                                         for key, value in breaker.stats().items()])
+metrics_registry.callback_gauge('db_retries', 'Nuovi tentativi di connessione e budget rimasto', ('stat',),
+                                lambda: stats_samples(resilience.retry_budget, ('retries', 'exhausted', 'tokens')))
+metrics_registry.callback_gauge('user_cache', 'Cache degli utenti', ('stat',),
+                                lambda: stats_samples(user_cache, ('size', 'hits', 'misses', 'evictions')))
+metrics_registry.callback_gauge('fragment_cache', 'Cache dei frammenti dei template', ('stat',),
+                                lambda: stats_samples(fragment_cache, ('size', 'hits', 'misses', 'evictions')))
+if config.SESSION_STORE == 'server':
+    metrics_registry.callback_gauge('session_cache', 'Cache delle sessioni lato server', ('stat',),
+                                    lambda: stats_samples(session_store.cache, ('size', 'hits', 'misses', 'evictions')))
+metrics_registry.callback_gauge('record_buffer', 'Buffer write-behind dei record', ('stat',),
+                                lambda: stats_samples(record_buffer, ('pending', 'flushed', 'rejected', 'failures', 'spilled')))
+metrics_registry.callback_gauge('telemetry_writer', 'Segmenti di telemetria scritti da questo processo', ('stat',),
+                                lambda: stats_samples(telemetry_writer, ('events', 'blocks', 'bytes')))
+metrics_registry.callback_gauge('daily_boards', 'Plance delle sfide giornaliere', ('stat',),
+                                lambda: stats_samples(daily_boards, ('cached', 'generated', 'loaded')))
+metrics_registry.callback_gauge('uploads', 'Elaborazione delle immagini caricate', ('stat',),
+                                lambda: stats_samples(upload_processor, ('pending', 'processed', 'duplicates', 'failures', 'rejected')))
+metrics_registry.callback_gauge('password_hash_rejected', 'Hash rifiutati per coda piena', (),
+                                lambda: [((), password_hasher.rejected)])
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Tutte le metriche nel formato testuale di Prometheus."""
+    return app.response_class(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats/record_buffer', methods=['GET'])
+def record_buffer_stats():
+    """Statistiche del buffer write-behind dei record."""
+    return jsonify(record_buffer.stats())
+
+@app.route('/stats/db_pool', methods=['GET'])
+def db_pool_stats():
+    """Statistiche del pool di connessioni (in uso, libere, tempi di attesa)."""
+    return jsonify(db_pool.stats())
+
+@app.route('/stats/user_cache', methods=['GET'])
+def user_cache_stats():
+    """Statistiche della cache degli utenti (hit, miss, invalidazioni)."""
+    return jsonify(user_cache.stats())
+
+# Preparazione del worker (dopo il fork con serve.py): finché non è completa /ready risponde 503
+warm_lock = threading.Lock()
+worker_ready = False
+
+def warm_up():
+    """Apre le connessioni minime, avvia il buffer, carica le classifiche e compila i template."""
+    global worker_ready
+    # Un solo thread prepara il worker: le altre sonde di /ready rispondono subito invece di accodarsi
+    if not warm_lock.acquire(blocking=False):
+        return worker_ready
+    try:
+        if worker_ready:
+            return True
+        try:
+            for pool in {db_pool, *game_pools.values()}:
+                pool.warm()
+        except (PoolTimeout, pymysql.MySQLError) as e:
+            print(f"Preparazione del worker non riuscita: {e}")
+            return False
+        record_buffer.start()
+        for game in leaderboards.games:
+            leaderboards.refresh(game, force=True)
+            aggregates.refresh(game, force=True)
+        with app.test_request_context('/'):
+            render_template('index.html')
+        worker_ready = True
+        return True
+    finally:
+        warm_lock.release()
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness per il bilanciatore: 200 solo quando il worker è pronto."""
+    if worker_ready or warm_up():
+        return jsonify({'status': 'ready', 'pid': os.getpid()})
+    return jsonify({'status': 'warming', 'pid': os.getpid()}), 503
 
 @app.route('/user', methods=['GET'])
 @login_required
@@ -247,4 +811,5 @@ def get_user():
     return jsonify({'username': current_user.username})
 
 if __name__ == '__main__':
+    # Server di sviluppo; in produzione si usa "python serve.py"
     app.run(debug=True)
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+# Misura il tempo di "import app" in un processo nuovo e lo confronta con il budget.
+# Uso: python bench/cold_start.py [ripetizioni]   (budget in COLD_START_BUDGET_MS)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS', 500))
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import app
+print((time.perf_counter() - start) * 1000)
+"""
+
+def measure(runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', SNIPPET],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return samples
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    wall_start = time.perf_counter()
+    samples = measure(runs)
+    median = statistics.median(samples)
+    print(f"import app: mediana {median:.1f} ms, min {min(samples):.1f} ms, max {max(samples):.1f} ms "
+          f"({runs} processi, {time.perf_counter() - wall_start:.1f} s totali)")
+    if median > BUDGET_MS:
+        print(f"Budget di avvio superato: {median:.1f} ms > {BUDGET_MS:.0f} ms")
+        return 1
+    print(f"Budget di avvio rispettato ({BUDGET_MS:.0f} ms)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
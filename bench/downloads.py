@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+import socket
+import http.client
+
+from http_load import ROOT, RESULTS_DIR, Client, free_port, seed_database, percentile
+
+# Benchmark dei download di file grandi (interi o a intervalli Range) con molti client contemporanei.
+# Con --server gunicorn i file passano da wsgi.file_wrapper e quindi da sendfile.
+#
+#   python bench/downloads.py --concurrency 64 --duration 20
+#   python bench/downloads.py --server gunicorn --workers 4 --range-fraction 0.5
+
+DEFAULT_FILE = 'assets/games/puzzle_image_medium.jpg'
+
+def start_server(args, port):
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+                   '--worker-class', 'gthread', '--threads', str(args.threads), '--log-level', 'warning', 'app:app']
+    else:
+        command = [sys.executable, os.path.join(ROOT, 'bench', 'http_load.py'), '--serve', '--port', str(port)]
+    server = subprocess.Popen(command, cwd=ROOT, env=os.environ.copy())
+    for _ in range(100):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Il server di benchmark non risponde")
+
+def download(connection, path, headers):
+    """Scarica un file leggendo a blocchi; restituisce (stato, byte ricevuti)."""
+    connection.request('GET', path, headers=headers)
+    response = connection.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(256 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+    return response.status, received
+
+def drive(port, args, size):
+    samples = []  # (secondi, byte, stato)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    path = '/' + args.file
+
+    def worker(index):
+        client = Client(port, f'bench{index % args.users}@example.com', [])
+        client.login(retries=50)
+        cookie = '; '.join(f'{k}={v}' for k, v in client.cookies.items())
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local = []
+        while time.perf_counter() < deadline:
+            headers = {'Cookie': cookie}
+            expected = size
+            if random.random() < args.range_fraction:
+                # Ripresa di un download interrotto: dal punto di arrivo fino alla fine
+                start = random.randrange(size)
+                headers['Range'] = f'bytes={start}-'
+                expected = size - start
+            begin = time.perf_counter()
+            try:
+                status, received = download(connection, path, headers)
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                status, received = 599, 0
+            if status in (200, 206) and received != expected:
+                status = 598  # Lunghezza sbagliata
+            local.append((time.perf_counter() - begin, received, status))
+        connection.close()
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds for seconds, _, _ in samples)
+    received = sum(count for _, count, _ in samples)
+    return {
+        'downloads': len(samples),
+        'errors': sum(1 for _, _, status in samples if status not in (200, 206)),
+        'downloads_per_s': round(len(samples) / elapsed, 2),
+        'mb_per_s': round(received / elapsed / 1e6, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei download di file grandi")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--file', default=DEFAULT_FILE, help="percorso del file dentro p/build/web")
+    parser.add_argument('--range-fraction', type=float, default=0.3, help="quota di richieste con Range")
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--output', help="file JSON dei risultati (predefinito: bench/results/)")
+    args = parser.parse_args()
+
+    size = os.path.getsize(os.path.join(ROOT, 'p', 'build', 'web', args.file))
+    workdir = tempfile.mkdtemp(prefix='downloads-')
+    os.environ.update(STORAGE_BACKEND='sqlite', SQLITE_DIR=workdir, DATA_DIR=workdir)
+    os.environ.setdefault('LOGIN_IP_PER_MINUTE', '1000000')
+    os.environ.setdefault('LOGIN_IP_BURST', '1000000')
+    seed_database(args.users)
+
+    port = free_port()
+    server = start_server(args, port)
+    try:
+        stats = drive(port, args, size)
+    finally:
+        server.terminate()
+        server.wait()
+
+    result = {
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'server': args.server,
+            'workers': args.workers if args.server == 'gunicorn' else 1,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'file': args.file,
+            'file_bytes': size,
+            'range_fraction': args.range_fraction,
+            'python': sys.version.split()[0],
+            'cpus': os.cpu_count(),
+        },
+        'stats': stats,
+    }
+    print(f"\n{args.server}: {stats['downloads']} download ({stats['errors']} errori), "
+          f"{stats['downloads_per_s']:.1f}/s, {stats['mb_per_s']:.1f} MB/s, "
+          f"p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"downloads-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"Risultati salvati in {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+import http.client
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Benchmark HTTP di app.py con il backend SQLite locale (nessun server MySQL).
+# Il server gira in un processo separato, i client virtuali in thread con connessioni keep-alive.
+#
+#   python bench/http_load.py --concurrency 16 --duration 30
+#   python bench/http_load.py --compare bench/results/http_load-20261018-120000.json
+
+PASSWORD = 'Password1!'
+DEFAULT_MIX = 'index=4,start_p=1,user=3,asset=10,login=1,register=0.2'
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def seed_database(users):
+    """Crea lo schema e gli utenti di prova (stesso hash per tutti, calcolato una volta)."""
+    from werkzeug.security import generate_password_hash
+    import config
+    import schema
+    import storage
+    from hashing import build_method
+
+    connection = storage.connect(config.DB_NAME)
+    try:
+        schema.migrate(connection)
+        pwhash = generate_password_hash(PASSWORD, build_method(config.PASSWORD_HASH_METHOD, config.PASSWORD_HASH_ITERATIONS))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO user (username, password) VALUES (%s, %s)',
+                [(f'bench{i}@example.com', pwhash) for i in range(users)]
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+def serve(port):
+    """Processo server: app.py con il backend SQLite impostato dall'ambiente."""
+    import logging
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # Niente log per ogni richiesta
+    server = make_server('127.0.0.1', port, app_module.app, threaded=True)
+    print(f"Server di benchmark su http://127.0.0.1:{port}", flush=True)
+    server.serve_forever()
+
+class Client:
+    """Client virtuale con cookie di sessione e connessione keep-alive."""
+    def __init__(self, port, username, assets):
+        self.port = port
+        self.username = username
+        self.assets = assets
+        self.cookies = {}
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        if body is not None:
+            body = urlencode(body)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            return 599
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status
+
+    def login(self, retries=0):
+        """Login; con retries ripete dopo una breve pausa le risposte 429 (carico rifiutato)."""
+        for _ in range(retries + 1):
+            status = self.request('POST', '/login', {'username': self.username, 'password': PASSWORD})
+            if status != 429:
+                break
+            time.sleep(0.05 + random.random() * 0.1)
+        return status
+
+    def run(self, route):
+        if route == 'index':
+            return self.request('GET', '/')
+        if route == 'start_p':
+            return self.request('GET', '/start_p')
+        if route == 'user':
+            return self.request('GET', '/user')
+        if route == 'asset':
+            return self.request('GET', '/assets/games/' + random.choice(self.assets))
+        if route == 'login':
+            return self.login()
+        if route == 'register':
+            username = f'new{random.getrandbits(48):x}@example.com'
+            return self.request('POST', '/register', {
+                'username': username, 'password': PASSWORD, 'confirm_password': PASSWORD
+            })
+        raise ValueError(f"Route sconosciuta: {route}")
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(samples, elapsed):
+    routes = {}
+    for route, values in samples.items():
+        latencies = sorted(latency for latency, _ in values)
+        errors = sum(1 for _, status in values if status >= 400)
+        routes[route] = {
+            'count': len(values),
+            'errors': errors,
+            'rps': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        }
+    total = sum(route['count'] for route in routes.values())
+    return routes, {'count': total, 'rps': round(total / elapsed, 2)}
+
+def drive(port, args, mix, assets):
+    routes, weights = zip(*mix.items())
+    samples = {route: [] for route in routes}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(index):
+        client = Client(port, f'bench{index % args.users}@example.com', assets)
+        client.login(retries=50)
+        local = {route: [] for route in routes}
+        while time.perf_counter() < deadline:
+            route = random.choices(routes, weights)[0]
+            start = time.perf_counter()
+            status = client.run(route)
+            local[route].append((time.perf_counter() - start, status))
+        with lock:
+            for route, values in local.items():
+                samples[route].extend(values)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - start)
+
+def compare(current, previous_path, threshold):
+    """Confronta con un risultato precedente; restituisce il numero di regressioni."""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    regressions = 0
+    print(f"\nConfronto con {previous_path} (soglia {threshold:.0%})")
+    for route, now in current['routes'].items():
+        before = previous.get('routes', {}).get(route)
+        if not before:
+            continue
+        p95_delta = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        rps_delta = (now['rps'] - before['rps']) / before['rps'] if before['rps'] else 0.0
+        flag = ''
+        if p95_delta > threshold or rps_delta < -threshold:
+            flag = '  <-- REGRESSIONE'
+            regressions += 1
+        print(f"  {route:<10} p95 {before['p95_ms']:>9.2f} -> {now['p95_ms']:>9.2f} ms ({p95_delta:+.1%})"
+              f"  rps {before['rps']:>8.1f} -> {now['rps']:>8.1f} ({rps_delta:+.1%}){flag}")
+    return regressions
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        mix[route.strip()] = float(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTTP di app.py con database locale")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--users', type=int, default=100, help="utenti creati nel database di prova")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="pesi delle route, es. index=4,asset=10")
+    parser.add_argument('--output', help="file JSON dei risultati (predefinito: bench/results/)")
+    parser.add_argument('--compare', help="risultato precedente con cui confrontarsi")
+    parser.add_argument('--threshold', type=float, default=0.10, help="variazione oltre cui segnalare una regressione")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return 0
+
+    mix = parse_mix(args.mix)
+    assets = sorted(os.listdir(os.path.join(ROOT, 'p/build/web/assets/games')))
+    # Database usa e getta: il server e questo processo leggono la configurazione dall'ambiente
+    workdir = tempfile.mkdtemp(prefix='http_load-')
+    os.environ.update(STORAGE_BACKEND='sqlite', SQLITE_DIR=workdir, DATA_DIR=workdir)
+    # Tutti i client arrivano da 127.0.0.1: senza limiti alti si misurerebbe solo il throttling
+    os.environ.setdefault('LOGIN_IP_PER_MINUTE', '1000000')
+    os.environ.setdefault('LOGIN_IP_BURST', '1000000')
+    seed_database(args.users)
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+        cwd=ROOT, env=os.environ.copy()
+    )
+    try:
+        for _ in range(100):
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                    break
+            except OSError:
+                time.sleep(0.1)
+        routes, total = drive(port, args, mix, assets)
+    finally:
+        server.terminate()
+        server.wait()
+
+    result = {
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'users': args.users,
+            'mix': mix,
+            'python': sys.version.split()[0],
+            'cpus': os.cpu_count(),
+        },
+        'routes': routes,
+        'total': total,
+    }
+
+    print(f"\n{'route':<10} {'richieste':>9} {'errori':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in sorted(routes.items()):
+        print(f"{route:<10} {stats['count']:>9} {stats['errors']:>7} {stats['rps']:>9.1f} "
+              f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    print(f"{'totale':<10} {total['count']:>9} {'':>7} {total['rps']:>9.1f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"http_load-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nRisultati salvati in {output}")
+
+    if args.compare:
+        return 1 if compare(result, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
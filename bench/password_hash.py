@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hashing import PasswordHasher
+
+# Login al secondo (verifica dell'hash) per ciascun costo, con il pool usato dall'app.
+# Uso: python bench/password_hash.py [secondi_per_metodo] [metodo ...]
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+]
+
+def bench_method(method, seconds, workers):
+    hasher = PasswordHasher(method=method, workers=workers, max_pending=workers * 4)
+    pwhash = hasher.hash('Password1!')
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        count = 0
+        while time.perf_counter() < deadline:
+            hasher.verify(pwhash, 'Password1!')
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    # Il doppio dei client rispetto ai worker tiene la coda sempre piena
+    with ThreadPoolExecutor(max_workers=workers * 2) as clients:
+        done = sum(clients.map(lambda _: client(), range(workers * 2)))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+    return done / elapsed
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    methods = sys.argv[2:] or DEFAULT_METHODS
+    workers = os.cpu_count() or 1
+    print(f"{'metodo':<24} {'login/s':>10} {'login/s per core':>18}  ({workers} core)")
+    for method in methods:
+        rate = bench_method(method, seconds, workers)
+        print(f"{method:<24} {rate:>10.1f} {rate / workers:>18.1f}")
+
+if __name__ == "__main__":
+    main()
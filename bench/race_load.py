@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import resource
+import tempfile
+import subprocess
+import socket
+
+from http_load import ROOT, RESULTS_DIR, free_port, percentile
+from race_protocol import (
+    PROGRESS, FINISH, MOVE, PROGRESS_MESSAGE, FINISH_MESSAGE, OP_BINARY, OP_CLOSE,
+    accept_key, new_key, encode_join, encode_masked_frame, decode, read_frame,
+)
+
+# Benchmark del server delle gare: molte stanze simulate in locale, ogni giocatore è una
+# coroutine che invia mosse a ritmo costante e misura quanto tempo impiega la propria mossa
+# a tornare indietro nel messaggio TICK della stanza.
+#
+#   python bench/race_load.py --rooms 1000 --players 2 --duration 20
+#   python bench/race_load.py --rooms 200 --players 4 --moves-per-second 10
+
+TOKEN = 'bench-token'
+
+def start_server(args, port):
+    env = dict(os.environ, RACE_BIND=f'127.0.0.1:{port}', RACE_TOKEN=TOKEN, RACE_ROOM_SIZE=str(args.players),
+               RACE_TICK_INTERVAL=str(args.tick), RACE_STATS_INTERVAL='5', DATA_DIR=args.workdir)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'race_server.py')], cwd=ROOT, env=env)
+    for _ in range(100):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Il server delle gare non risponde")
+
+async def connect(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 16)
+    key = new_key()
+    writer.write((
+        f'GET /race HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+        f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'
+    ).encode('latin-1'))
+    response = await reader.readuntil(b'\r\n\r\n')
+    if b' 101 ' not in response.split(b'\r\n', 1)[0] or accept_key(key).encode('latin-1') not in response:
+        raise RuntimeError("Handshake rifiutato")
+    return reader, writer
+
+async def player(port, room, index, args, deadline, stats):
+    try:
+        reader, writer = await connect(port)
+    except (OSError, RuntimeError, asyncio.IncompleteReadError):
+        stats['connect_errors'] += 1
+        return
+    writer.write(encode_masked_frame(OP_BINARY, encode_join('puzzle', 'easy', room, TOKEN, f'p{index}')))
+    slot = None
+    sent = {}  # numero di sequenza -> istante di invio
+    latencies = stats['latencies']
+
+    async def receive():
+        nonlocal slot
+        while True:
+            try:
+                opcode, payload = await read_frame(reader, 1 << 16)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                return
+            if opcode != OP_BINARY:
+                return
+            message = decode(payload)
+            stats['frames'] += 1
+            if message[0] == 'start':
+                slot = [s for s, name in message[4] if name == f'p{index}'][0]
+                started.set()
+            elif message[0] == 'tick':
+                now = time.perf_counter()
+                for entry_slot, _, _, _, sequence in message[2]:
+                    stats['entries'] += 1
+                    if entry_slot == slot and sequence in sent:
+                        latencies.append(now - sent.pop(sequence))
+
+    started = asyncio.Event()
+    receiver = asyncio.create_task(receive())
+    try:
+        await asyncio.wait_for(started.wait(), 30)
+        interval = 1.0 / args.moves_per_second
+        sequence = 0
+        await asyncio.sleep(random.random() * interval)  # Le mosse dei giocatori non partono tutte insieme
+        while time.perf_counter() < deadline:
+            sequence = (sequence + 1) & 0xFFFF
+            sent[sequence] = time.perf_counter()
+            writer.write(encode_masked_frame(OP_BINARY, PROGRESS_MESSAGE.pack(PROGRESS, MOVE, 1, 1, sequence)))
+            stats['moves'] += 1
+            await asyncio.sleep(interval)
+        writer.write(encode_masked_frame(OP_BINARY, FINISH_MESSAGE.pack(FINISH, int(args.duration * 1000))))
+        writer.write(encode_masked_frame(OP_CLOSE, (1000).to_bytes(2, 'big')))
+        await writer.drain()
+        stats['finished'] += 1
+    except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+        stats['errors'] += 1
+    finally:
+        receiver.cancel()
+        writer.close()
+
+async def drive(port, args):
+    stats = {'latencies': [], 'moves': 0, 'frames': 0, 'entries': 0, 'finished': 0, 'errors': 0, 'connect_errors': 0}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    tasks = []
+    for room in range(args.rooms):
+        for seat in range(args.players):
+            tasks.append(asyncio.create_task(player(port, f'stanza{room}', room * args.players + seat, args, deadline, stats)))
+        if room % 50 == 49:
+            await asyncio.sleep(0.05)  # Connessioni a ondate, senza saturare il backlog
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    latencies = sorted(stats.pop('latencies'))
+    stats.update({
+        'moves_per_s': round(stats['moves'] / elapsed, 1),
+        'frames_per_s': round(stats['frames'] / elapsed, 1),
+        'echoed': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    })
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del server delle gare")
+    parser.add_argument('--rooms', type=int, default=500)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--moves-per-second', type=float, default=4.0, help="mosse al secondo per giocatore")
+    parser.add_argument('--tick', type=float, default=0.05, help="durata del tick del server (s)")
+    parser.add_argument('--output', help="file JSON dei risultati (predefinito: bench/results/)")
+    args = parser.parse_args()
+    args.workdir = tempfile.mkdtemp(prefix='race-')  # Chiave di firma del server di prova
+
+    # Due socket per giocatore (client e server) nello stesso sistema
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = args.rooms * args.players + 256
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    port = free_port()
+    server = start_server(args, port)
+    try:
+        stats = asyncio.run(drive(port, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    result = {
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'rooms': args.rooms,
+            'players': args.players,
+            'duration': args.duration,
+            'moves_per_second': args.moves_per_second,
+            'tick': args.tick,
+            'python': sys.version.split()[0],
+            'cpus': os.cpu_count(),
+        },
+        'stats': stats,
+    }
+    print(f"\n{args.rooms} stanze x {args.players} giocatori: {stats['moves_per_s']:.0f} mosse/s, "
+          f"{stats['frames_per_s']:.0f} frame/s ricevuti, errori {stats['errors'] + stats['connect_errors']}, "
+          f"eco p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"race_load-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"Risultati salvati in {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
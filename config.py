@@ -0,0 +1,190 @@
+import os
+
+# Configurazione condivisa, letta dalle variabili d'ambiente con valori predefiniti
+
+def env_int(name, default):
+    """Legge una variabile d'ambiente intera."""
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+def env_float(name, default):
+    """Legge una variabile d'ambiente decimale."""
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+# Cartella per i dati locali del server (spill, snapshot, ...)
+DATA_DIR = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance'))
+
+# Backend di archiviazione: 'mysql' (server remoto) oppure 'sqlite' (file locali in SQLITE_DIR)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mysql')
+SQLITE_DIR = os.environ.get('SQLITE_DIR', DATA_DIR)
+
+# Server di produzione (serve.py): processi, thread per processo e ricaricamento automatico
+SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:8000')
+SERVER_WORKERS = env_int('SERVER_WORKERS', (os.cpu_count() or 1) * 2 + 1)
+SERVER_THREADS = env_int('SERVER_THREADS', 4)
+SERVER_TIMEOUT = env_int('SERVER_TIMEOUT', 30)  # Worker bloccato da più di (s) = riavviato
+SERVER_GRACEFUL_TIMEOUT = env_int('SERVER_GRACEFUL_TIMEOUT', 30)  # Attesa per le richieste in corso al riavvio (s)
+SERVER_MAX_REQUESTS = env_int('SERVER_MAX_REQUESTS', 0)  # Riavvio del worker dopo N richieste, 0 = mai
+SERVER_RELOAD_INTERVAL = env_float('SERVER_RELOAD_INTERVAL', 2.0)  # Controllo delle modifiche (s), 0 = spento
+
+# Firma dei cookie: SECRET_KEY dall'ambiente (altrimenti generata una volta in SECRET_KEY_PATH);
+# per ruotarla si mette la vecchia in SECRET_KEY_FALLBACKS (separate da virgole) finché servono
+SECRET_KEY = os.environ.get('SECRET_KEY', '')
+SECRET_KEY_PATH = os.environ.get('SECRET_KEY_PATH', os.path.join(DATA_DIR, 'secret_key'))
+SECRET_KEY_FALLBACKS = [key for key in os.environ.get('SECRET_KEY_FALLBACKS', '').split(',') if key]
+
+# Sessioni: 'cookie' (firmate nel browser) oppure 'server' (SQLite locale con LRU in memoria)
+SESSION_STORE = os.environ.get('SESSION_STORE', 'cookie')
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', os.path.join(DATA_DIR, 'sessions.sqlite3'))
+SESSION_CACHE_SIZE = env_int('SESSION_CACHE_SIZE', 10000)
+SESSION_CACHE_TTL = env_float('SESSION_CACHE_TTL', 5.0)
+
+# Parametri di connessione al database
+DB_HOST = os.environ.get('DB_HOST', 'RobertaMerlo.mysql.pythonanywhere-services.com')
+DB_USER = os.environ.get('DB_USER', 'RobertaMerlo')
+DB_PASSWORD = os.environ.get('DB_PASSWORD', 'Y9puX%40a8')
+DB_NAME = os.environ.get('DB_NAME', 'RobertaMerlo$db')
+DB_PORT = env_int('DB_PORT', 3306)
+PUZZLE_DB_NAME = os.environ.get('PUZZLE_DB_NAME', 'RobertaMerlo$default')  # Database del Puzzle Game
+
+# Timeout delle connessioni al database (s): apertura, lettura e scrittura; con pymysql anche
+# l'handshake iniziale è limitato dal timeout di lettura
+DB_CONNECT_TIMEOUT = env_float('DB_CONNECT_TIMEOUT', 5.0)
+DB_READ_TIMEOUT = env_float('DB_READ_TIMEOUT', 10.0)
+DB_WRITE_TIMEOUT = env_float('DB_WRITE_TIMEOUT', 10.0)
+
+# Nuovi tentativi di connessione: numero massimo, attesa casuale fino a base * 2^tentativo (max s),
+# tempo complessivo (s) e budget per processo (tentativi guadagnati per chiamata, minimo al secondo)
+DB_RETRY_ATTEMPTS = env_int('DB_RETRY_ATTEMPTS', 3)
+DB_RETRY_BASE_DELAY = env_float('DB_RETRY_BASE_DELAY', 0.1)
+DB_RETRY_MAX_DELAY = env_float('DB_RETRY_MAX_DELAY', 2.0)
+DB_RETRY_DEADLINE = env_float('DB_RETRY_DEADLINE', 10.0)
+DB_RETRY_BUDGET_RATIO = env_float('DB_RETRY_BUDGET_RATIO', 0.2)
+DB_RETRY_MIN_PER_SECOND = env_float('DB_RETRY_MIN_PER_SECOND', 1.0)
+
+# Circuit breaker: errori di rete consecutivi che lo aprono e secondi prima di una nuova prova
+DB_BREAKER_THRESHOLD = env_int('DB_BREAKER_THRESHOLD', 5)
+DB_BREAKER_RESET = env_float('DB_BREAKER_RESET', 30.0)
+
+# Database in cui ciascun gioco salva la tabella records
+GAME_DATABASES = {
+    'memory': DB_NAME,
+    'puzzle': PUZZLE_DB_NAME,
+}
+
+# Dimensionamento del pool di connessioni
+DB_POOL_MIN_SIZE = env_int('DB_POOL_MIN_SIZE', 1)
+DB_POOL_MAX_SIZE = env_int('DB_POOL_MAX_SIZE', 10)
+DB_POOL_TIMEOUT = env_float('DB_POOL_TIMEOUT', 5.0)  # Attesa massima per ottenere una connessione (s)
+DB_POOL_RECYCLE = env_float('DB_POOL_RECYCLE', 3600.0)  # Età massima di una connessione (s)
+DB_POOL_PING_INTERVAL = env_float('DB_POOL_PING_INTERVAL', 30.0)  # Ping solo se inattiva da più di (s)
+
+# Cache in memoria degli utenti caricati da Flask-Login
+USER_CACHE_SIZE = env_int('USER_CACHE_SIZE', 4096)
+USER_CACHE_TTL = env_float('USER_CACHE_TTL', 300.0)
+
+# Hash delle password: metodo werkzeug, costo e dimensione del pool di lavoro
+# es. 'scrypt' (predefinito di werkzeug), 'scrypt:16384:8:1' oppure 'pbkdf2:sha256' con le iterazioni
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_HASH_ITERATIONS = env_int('PASSWORD_HASH_ITERATIONS', 0)  # Solo per pbkdf2, 0 = predefinito
+PASSWORD_HASH_WORKERS = env_int('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+PASSWORD_HASH_MAX_PENDING = env_int('PASSWORD_HASH_MAX_PENDING', 64)
+PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')  # 'thread' o 'process'
+
+# Protezione di login e registrazione: token bucket per IP e per username (richieste al minuto
+# e raffica massima) e limite di richieste contemporanee, oltre il quale si risponde 429
+LOGIN_IP_PER_MINUTE = env_float('LOGIN_IP_PER_MINUTE', 20.0)
+LOGIN_IP_BURST = env_int('LOGIN_IP_BURST', 20)
+LOGIN_USER_PER_MINUTE = env_float('LOGIN_USER_PER_MINUTE', 10.0)
+LOGIN_USER_BURST = env_int('LOGIN_USER_BURST', 10)
+AUTH_MAX_CONCURRENCY = env_int('AUTH_MAX_CONCURRENCY', PASSWORD_HASH_WORKERS * 4)
+THROTTLE_STORE_PATH = os.environ.get('THROTTLE_STORE_PATH', '')  # File SQLite condiviso fra i worker, vuoto = in memoria
+PROXY_FIX_HOPS = env_int('PROXY_FIX_HOPS', 0)  # Proxy fidati davanti all'app, per leggere l'IP da X-Forwarded-For
+
+# Invio dei file statici: '' = dal processo Python (con sendfile se il server WSGI lo offre),
+# 'x-accel' = nginx serve il file dalla location interna STATIC_ACCEL_PREFIX dopo il controllo del login
+STATIC_OFFLOAD = os.environ.get('STATIC_OFFLOAD', '')
+STATIC_ACCEL_ROOT = os.environ.get('STATIC_ACCEL_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'p', 'build', 'web'))
+STATIC_ACCEL_PREFIX = os.environ.get('STATIC_ACCEL_PREFIX', '/_protected/')
+
+# Cache dei frammenti dei template e compressione delle pagine HTML
+FRAGMENT_CACHE_SIZE = env_int('FRAGMENT_CACHE_SIZE', 256)  # 0 = disattivata
+FRAGMENT_CACHE_TTL = env_float('FRAGMENT_CACHE_TTL', 3600.0)
+TEMPLATE_CHECK_INTERVAL = env_float('TEMPLATE_CHECK_INTERVAL', 2.0)  # Ogni quanto si controlla se i template sono cambiati (s)
+HTML_COMPRESS_MIN_SIZE = env_int('HTML_COMPRESS_MIN_SIZE', 1024)  # Byte sotto i quali non si comprime
+HTML_COMPRESS_LEVEL = env_int('HTML_COMPRESS_LEVEL', 6)
+
+# Classifiche: numero di posizioni e massima età dei dati serviti (s)
+LEADERBOARD_SIZE = env_int('LEADERBOARD_SIZE', 10)
+LEADERBOARD_MAX_STALENESS = env_float('LEADERBOARD_MAX_STALENESS', 5.0)
+
+# Classifiche in diretta (leaderboard_stream.py, SSE): indirizzo del server asyncio, indirizzo per i
+# client, controllo dei cambiamenti (s), heartbeat (s), validità dei token di /api/leaderboard/stream/token (s)
+# e limiti. Ogni client costa un socket, non un thread: il limite è sui file aperti (ulimit -n)
+LEADERBOARD_STREAM_BIND = os.environ.get('LEADERBOARD_STREAM_BIND', '0.0.0.0:8766')
+LEADERBOARD_STREAM_URL = os.environ.get('LEADERBOARD_STREAM_URL', 'http://127.0.0.1:8766/leaderboard')
+LEADERBOARD_STREAM_INTERVAL = env_float('LEADERBOARD_STREAM_INTERVAL', 1.0)
+LEADERBOARD_STREAM_HEARTBEAT = env_float('LEADERBOARD_STREAM_HEARTBEAT', 15.0)
+LEADERBOARD_STREAM_TOKEN_MAX_AGE = env_int('LEADERBOARD_STREAM_TOKEN_MAX_AGE', 300)
+LEADERBOARD_STREAM_MAX_CLIENTS = env_int('LEADERBOARD_STREAM_MAX_CLIENTS', 10000)
+LEADERBOARD_STREAM_MAX_WRITE_BUFFER = env_int('LEADERBOARD_STREAM_MAX_WRITE_BUFFER', 65536)  # Byte in coda oltre i quali il client viene chiuso
+LEADERBOARD_STREAM_ALLOW_ORIGIN = os.environ.get('LEADERBOARD_STREAM_ALLOW_ORIGIN', '*')  # Access-Control-Allow-Origin
+LEADERBOARD_STREAM_BACKLOG = env_int('LEADERBOARD_STREAM_BACKLOG', 1024)
+LEADERBOARD_STREAM_STATS_INTERVAL = env_float('LEADERBOARD_STREAM_STATS_INTERVAL', 30.0)  # Riepilogo nel log, 0 = spento
+
+# Indice per posizione e percentile: ampiezza dei bucket e tempo massimo distinto (s)
+RANK_RESOLUTION = env_float('RANK_RESOLUTION', 0.1)
+RANK_MAX_TIME = env_float('RANK_MAX_TIME', 3600.0)
+
+# Statistiche dei tempi (media, varianza, mediana, p90): snapshot su file e accuratezza dei quantili
+AGGREGATES_SNAPSHOT_PATH = os.environ.get('AGGREGATES_SNAPSHOT_PATH', os.path.join(DATA_DIR, 'aggregates.json'))
+AGGREGATES_SNAPSHOT_INTERVAL = env_float('AGGREGATES_SNAPSHOT_INTERVAL', 60.0)  # Salvataggio al massimo ogni (s)
+AGGREGATES_ACCURACY = env_float('AGGREGATES_ACCURACY', 0.01)  # Errore relativo massimo di mediana e p90
+
+# Buffer write-behind dei record inviati dai client
+RECORD_BUFFER_MAX_SIZE = env_int('RECORD_BUFFER_MAX_SIZE', 10000)
+RECORD_BUFFER_BATCH_SIZE = env_int('RECORD_BUFFER_BATCH_SIZE', 500)
+RECORD_BUFFER_FLUSH_INTERVAL = env_float('RECORD_BUFFER_FLUSH_INTERVAL', 1.0)
+RECORD_BUFFER_SPILL_PATH = os.environ.get('RECORD_BUFFER_SPILL_PATH', os.path.join(DATA_DIR, 'records_spill.jsonl'))
+RECORD_BUFFER_MAX_ATTEMPTS = env_int('RECORD_BUFFER_MAX_ATTEMPTS', 5)  # Tentativi di un lotto prima dello spill
+RECORD_INGEST_MAX_ITEMS = env_int('RECORD_INGEST_MAX_ITEMS', 1000)  # Risultati per singola richiesta
+
+# Telemetria delle partite: file per colonne divisi per gioco e per ora (server)
+# e invio a lotti dai giochi (client, spento se TELEMETRY_URL è vuoto)
+TELEMETRY_DIR = os.environ.get('TELEMETRY_DIR', os.path.join(DATA_DIR, 'telemetry'))
+TELEMETRY_MAX_EVENTS = env_int('TELEMETRY_MAX_EVENTS', 10000)  # Eventi per singola richiesta
+TELEMETRY_TOKEN = os.environ.get('TELEMETRY_TOKEN', '')  # Token condiviso per i giochi desktop senza sessione
+TELEMETRY_URL = os.environ.get('TELEMETRY_URL', '')  # es. https://example.com
+TELEMETRY_BATCH_SIZE = env_int('TELEMETRY_BATCH_SIZE', 256)
+TELEMETRY_FLUSH_INTERVAL = env_float('TELEMETRY_FLUSH_INTERVAL', 10.0)  # Invio anche di lotti incompleti dopo (s)
+
+# Sfide giornaliere: plance generate una volta al giorno (server), giorni di ritardo ammessi
+# per inviare un tempo, giorni passati ancora serviti e indirizzo dell'app da cui i giochi
+# desktop scaricano la plancia
+DAILY_DIR = os.environ.get('DAILY_DIR', os.path.join(DATA_DIR, 'daily'))
+DAILY_SUBMIT_DAYS = env_int('DAILY_SUBMIT_DAYS', 1)  # 1 = anche la sfida di ieri (partite a cavallo della mezzanotte)
+DAILY_KEEP_DAYS = env_int('DAILY_KEEP_DAYS', 7)  # Giorni passati di cui si servono ancora le plance
+DAILY_URL = os.environ.get('DAILY_URL', '')  # es. https://example.com
+
+# Immagini del puzzle caricate dagli utenti: cartella delle tessere (server e cache dei giochi desktop),
+# processi per l'elaborazione, limiti e indirizzo dell'app da cui i giochi scaricano le tessere
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', os.path.join(DATA_DIR, 'uploads'))
+UPLOAD_WORKERS = env_int('UPLOAD_WORKERS', os.cpu_count() or 1)
+UPLOAD_MAX_PENDING = env_int('UPLOAD_MAX_PENDING', 16)  # Immagini in coda per processo dell'app
+UPLOAD_MAX_BYTES = env_int('UPLOAD_MAX_BYTES', 10 * 1024 * 1024)
+UPLOAD_MAX_PIXELS = env_int('UPLOAD_MAX_PIXELS', 40_000_000)  # Oltre si rifiuta (immagini "bomba")
+UPLOAD_URL = os.environ.get('UPLOAD_URL', '')  # es. https://example.com
+
+# Gare in tempo reale (race_server.py): indirizzo del server asyncio, indirizzo per i client,
+# giocatori per stanza, durata del tick (s) e limiti per client
+RACE_BIND = os.environ.get('RACE_BIND', '0.0.0.0:8765')
+RACE_URL = os.environ.get('RACE_URL', 'ws://127.0.0.1:8765/race')
+RACE_TOKEN = os.environ.get('RACE_TOKEN', '')  # Token condiviso per i giochi desktop senza sessione
+RACE_TOKEN_MAX_AGE = env_int('RACE_TOKEN_MAX_AGE', 300)  # Validità dei token firmati di /api/race/token (s)
+RACE_ROOM_SIZE = env_int('RACE_ROOM_SIZE', 2)
+RACE_TICK_INTERVAL = env_float('RACE_TICK_INTERVAL', 0.05)
+RACE_EVENTS_PER_TICK = env_int('RACE_EVENTS_PER_TICK', 8)  # Avanzamenti per giocatore in un tick, gli altri si scartano
+RACE_MAX_WRITE_BUFFER = env_int('RACE_MAX_WRITE_BUFFER', 65536)  # Byte in coda oltre i quali il client viene chiuso
+RACE_BACKLOG = env_int('RACE_BACKLOG', 1024)
+RACE_STATS_INTERVAL = env_float('RACE_STATS_INTERVAL', 30.0)  # Riepilogo nel log, 0 = spento
@@ -0,0 +1,302 @@
+import os
+import sys
+import hmac
+import time
+import random
+import struct
+import hashlib
+import datetime
+import threading
+import urllib.request
+import urllib.error
+import pymysql
+import config
+import record_store
+from leaderboard import Leaderboard, DIFFICULTIES
+
+# Sfide giornaliere: per ogni giorno (UTC), gioco e difficoltà una sola plancia uguale per tutti.
+# Il server la genera una volta, con un seme derivato dalla chiave segreta, e la salva come blob
+# di pochi byte in DAILY_DIR/<AAAA-MM-GG>/<gioco>-<difficoltà>.bin; l'app la serve con cache
+# lunga (la plancia di un giorno non cambia più) e tiene una classifica separata per sfida.
+#   python daily.py generate [AAAA-MM-GG]
+#   python daily.py show AAAA-MM-GG gioco difficoltà
+
+GAMES = ('memory', 'puzzle')
+GRID_SIZES = {'easy': (3, 3), 'medium': (4, 4), 'hard': (5, 5)}  # Puzzle: righe e colonne
+MEMORY_PAIRS = {'easy': 8, 'medium': 12, 'hard': 16}  # Memory: coppie di carte
+MEMORY_IMAGES = 16  # Immagini disponibili (assets/games/casella1..16.png)
+
+# Blob: intestazione e un byte per valore (posizione della tessera o immagine della carta)
+BLOB_HEADER = struct.Struct('<4sBBIB')  # magic, gioco, difficoltà, giorno (ordinale), numero di valori
+BLOB_MAGIC = b'DLY1'
+
+def today():
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+def parse_day(text):
+    """Giorno in formato AAAA-MM-GG, oppure None."""
+    try:
+        return datetime.date.fromisoformat(text)
+    except (TypeError, ValueError):
+        return None
+
+def challenge_seed(secret, day, game, difficulty):
+    """Seme della sfida: non si può calcolare in anticipo senza la chiave segreta."""
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    message = f'{day.isoformat()}:{game}:{difficulty}'.encode('utf-8')
+    return int.from_bytes(hmac.new(secret, message, hashlib.sha256).digest()[:8], 'big')
+
+# --- Generazione delle plance -------------------------------------------------
+
+def is_solvable(positions, rows, cols, empty_pos):
+    """positions: posizione (x, y) di ogni tessera, nell'ordine delle posizioni corrette."""
+    order = [y * cols + x for x, y in positions]
+    inversions = 0
+    for i in range(len(order)):
+        for j in range(i + 1, len(order)):
+            if order[i] > order[j]:
+                inversions += 1
+    if cols % 2 == 1:
+        return inversions % 2 == 0
+    return (inversions + rows - empty_pos[1]) % 2 == 1
+
+def puzzle_layout(rows, cols, rng=None, max_attempts=1000):
+    """Posizioni iniziali delle tessere (casella vuota in basso a destra), sempre risolvibili."""
+    rng = rng or random
+    empty_pos = (cols - 1, rows - 1)
+    positions = [(col, row) for row in range(rows) for col in range(cols) if (col, row) != empty_pos]
+    for _ in range(max_attempts):
+        rng.shuffle(positions)
+        if is_solvable(positions, rows, cols, empty_pos):
+            return positions
+    raise RuntimeError("Impossibile generare un puzzle risolvibile dopo molti tentativi.")
+
+def memory_deck(difficulty, rng=None, image_count=MEMORY_IMAGES):
+    """Indici delle immagini delle carte, in ordine di griglia (ogni immagine compare due volte)."""
+    rng = rng or random
+    deck = rng.sample(range(image_count), MEMORY_PAIRS[difficulty]) * 2
+    rng.shuffle(deck)
+    return deck
+
+def generate_board(secret, day, game, difficulty):
+    """Valori della plancia del giorno, gli stessi per chiunque abbia la stessa chiave."""
+    rng = random.Random(challenge_seed(secret, day, game, difficulty))
+    if game == 'puzzle':
+        rows, cols = GRID_SIZES[difficulty]
+        return [y * cols + x for x, y in puzzle_layout(rows, cols, rng)]
+    return memory_deck(difficulty, rng)
+
+def encode_board(day, game, difficulty, values):
+    return BLOB_HEADER.pack(BLOB_MAGIC, GAMES.index(game), DIFFICULTIES.index(difficulty),
+                            day.toordinal(), len(values)) + bytes(values)
+
+def decode_board(data):
+    """Restituisce (giorno, gioco, difficoltà, valori); ValueError se il blob non è valido."""
+    try:
+        magic, game, difficulty, ordinal, count = BLOB_HEADER.unpack_from(data)
+        values = list(data[BLOB_HEADER.size:BLOB_HEADER.size + count])
+        if magic != BLOB_MAGIC or len(values) != count:
+            raise ValueError("Blob troncato o di un altro formato")
+        return datetime.date.fromordinal(ordinal), GAMES[game], DIFFICULTIES[difficulty], values
+    except (struct.error, IndexError, OverflowError) as e:
+        raise ValueError(f"Plancia giornaliera non valida: {e}")
+
+def puzzle_positions(values, difficulty):
+    """Dal blob alle posizioni (x, y) delle tessere, per PuzzleGame."""
+    cols = GRID_SIZES[difficulty][1]
+    return [(value % cols, value // cols) for value in values]
+
+class DailyBoards:
+    """Blob delle plance: in memoria, poi su file, generati solo se mancano (una volta al giorno)."""
+    def __init__(self, directory, secret, keep_days=7):
+        self.directory = directory
+        self.secret = secret
+        self.keep_days = keep_days
+        self._cache = {}  # (giorno, gioco, difficoltà) -> (blob, etag)
+        self._lock = threading.Lock()
+        self.generated = 0
+        self.loaded = 0
+
+    def path(self, day, game, difficulty):
+        return os.path.join(self.directory, day.isoformat(), f'{game}-{difficulty}.bin')
+
+    def in_window(self, day):
+        """Solo oggi e gli ultimi keep_days giorni: non si generano file per date arbitrarie."""
+        return 0 <= (today() - day).days <= self.keep_days
+
+    def get(self, day, game, difficulty):
+        """Restituisce (blob, etag) della sfida; None per giochi, difficoltà o giorni fuori finestra."""
+        if game not in GAMES or difficulty not in DIFFICULTIES or not self.in_window(day):
+            return None
+        key = (day, game, difficulty)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                cached = self._load(day, game, difficulty)
+                self._cache[key] = cached
+                self._prune()
+        return cached
+
+    def _load(self, day, game, difficulty):
+        path = self.path(day, game, difficulty)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            self.loaded += 1
+        except FileNotFoundError:
+            blob = encode_board(day, game, difficulty, generate_board(self.secret, day, game, difficulty))
+            # Scrittura atomica: gli altri processi leggono il file completo o generano lo stesso blob
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f'{path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(blob)
+            os.replace(temporary, path)
+            self.generated += 1
+        return blob, hashlib.sha1(blob).hexdigest()[:20]
+
+    def _prune(self):
+        oldest = today() - datetime.timedelta(days=self.keep_days)
+        for key in [key for key in self._cache if key[0] < oldest]:
+            del self._cache[key]
+
+    def stats(self):
+        return {'cached': len(self._cache), 'generated': self.generated, 'loaded': self.loaded}
+
+# --- Classifiche per sfida ----------------------------------------------------
+
+class DailyLeaderboards:
+    """Top N di ogni sfida, riletta dal database (una query sull'indice) al massimo ogni max_staleness."""
+    def __init__(self, connect, size=10, max_staleness=5.0, keep_days=2):
+        self.connect = connect  # Funzione gioco -> connessione (o None)
+        self.size = size
+        self.max_staleness = max_staleness
+        self.keep_days = keep_days
+        self.boards = {}  # (giorno, gioco, difficoltà) -> (Leaderboard, istante del caricamento)
+        self._lock = threading.Lock()
+
+    def submit(self, day, game, difficulty, user, record_time):
+        """Salva il tempo (solo se migliora quello dell'utente); False se il database non risponde."""
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        connection = self.connect(game)
+        if connection is None:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                record_store.save_daily_record(cursor, day.isoformat(), difficulty, user, record_time, date)
+            connection.commit()
+        except pymysql.MySQLError as e:
+            print(f"Errore nel salvataggio della sfida giornaliera: {e}")
+            return False
+        finally:
+            connection.close()
+        with self._lock:
+            entry = self.boards.get((day, game, difficulty))
+            if entry is not None:
+                entry[0].offer(user, record_time, date)  # Visibile subito in questo processo
+        return True
+
+    def get(self, day, game, difficulty):
+        """Restituisce (json, etag) della classifica della sfida, oppure None se il database non risponde."""
+        key = (day, game, difficulty)
+        entry = self.boards.get(key)
+        if entry is None or time.monotonic() - entry[1] >= self.max_staleness:
+            board = self._load(day, game, difficulty)
+            if board is None:
+                if entry is None:
+                    return None
+                board = entry[0]  # Database non raggiungibile: si serve la copia precedente
+            with self._lock:
+                self.boards[key] = entry = (board, time.monotonic())
+                oldest = today() - datetime.timedelta(days=self.keep_days)
+                for old in [old for old in self.boards if old[0] < oldest]:
+                    del self.boards[old]
+        with self._lock:
+            return entry[0].render(game, difficulty)
+
+    def _load(self, day, game, difficulty):
+        connection = self.connect(game)
+        if connection is None:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT user, time, date FROM daily_records WHERE day = %s AND difficulty = %s '
+                    'ORDER BY time LIMIT %s',
+                    (day.isoformat(), difficulty, self.size)
+                )
+                rows = cursor.fetchall()
+        except pymysql.MySQLError as e:
+            print(f"Errore nel caricamento della classifica giornaliera: {e}")
+            return None
+        finally:
+            connection.close()
+        board = Leaderboard(self.size)
+        for row in rows:
+            board.offer(row['user'], row['time'], row['date'])
+        return board
+
+# --- Client per i giochi desktop ----------------------------------------------
+
+def fetch_board(game, difficulty, url=None, day=None):
+    """Scarica la plancia del giorno dall'app (DAILY_URL); restituisce (giorno, valori) oppure None."""
+    url = (config.DAILY_URL if url is None else url).rstrip('/')
+    if not url:
+        print("Sfida giornaliera non disponibile: DAILY_URL non configurato")
+        return None
+    day = day or today()
+    try:
+        with urllib.request.urlopen(f'{url}/api/daily/{day.isoformat()}/{game}/{difficulty}', timeout=10) as response:
+            blob_day, _, _, values = decode_board(response.read())
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        print(f"Impossibile scaricare la sfida giornaliera: {e}")
+        return None
+    return blob_day, values
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ('generate', 'show'):
+        print("Uso: python daily.py generate [AAAA-MM-GG] | show AAAA-MM-GG gioco difficoltà")
+        return 1
+
+    from sessions import load_secret_key
+    boards = DailyBoards(config.DAILY_DIR, load_secret_key(config.SECRET_KEY, config.SECRET_KEY_PATH),
+                         keep_days=max(config.DAILY_KEEP_DAYS, config.DAILY_SUBMIT_DAYS))
+    if argv[1] == 'generate':
+        # Da eseguire poco dopo la mezzanotte UTC: le richieste trovano già i file pronti
+        day = parse_day(argv[2]) if len(argv) > 2 else today()
+        if day is None:
+            print(f"Giorno non valido: {argv[2]}")
+            return 1
+        if not boards.in_window(day):
+            print(f"Si generano solo le sfide degli ultimi {boards.keep_days} giorni: {day}")
+            return 1
+        for game in GAMES:
+            for difficulty in DIFFICULTIES:
+                boards.get(day, game, difficulty)
+        print(f"Sfide del {day}: {boards.generated} generate, {boards.loaded} già presenti in {config.DAILY_DIR}")
+        return 0
+
+    if len(argv) != 5 or parse_day(argv[2]) is None:
+        print("Uso: python daily.py show AAAA-MM-GG gioco difficoltà")
+        return 1
+    result = boards.get(parse_day(argv[2]), argv[3], argv[4])
+    if result is None:
+        print("Sfida non trovata")
+        return 1
+    day, game, difficulty, values = decode_board(result[0])
+    if game == 'puzzle':
+        # Numero della tessera in ogni casella (. = casella vuota)
+        rows, cols = GRID_SIZES[difficulty]
+        cells = {value: piece + 1 for piece, value in enumerate(values)}
+        for row in range(rows):
+            print(' '.join(f'{cells[row * cols + col]:2d}' if row * cols + col in cells else ' .'
+                           for col in range(cols)))
+    else:
+        print(values)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
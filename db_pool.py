@@ -0,0 +1,261 @@
+import threading
+import time
+from collections import deque
+
+# Pool di connessioni limitato e thread-safe per il database
+
+class PoolTimeout(Exception):
+    """Nessuna connessione disponibile entro il tempo di attesa."""
+
+class TimedCursor:
+    """Cursore che misura la durata di ogni istruzione SQL e ne riporta l'esito al circuit breaker."""
+    def __init__(self, cursor, observe, breaker=None):
+        self._cursor = cursor
+        self._observe = observe
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+    def execute(self, query, args=None):
+        return self._run(self._cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._run(self._cursor.executemany, query, args)
+
+    def _run(self, method, query, args):
+        start = time.perf_counter()
+        try:
+            result = method(query, args)
+        except Exception as e:
+            if self._breaker is not None:
+                self._breaker.failure(e)
+            raise
+        finally:
+            if self._observe is not None:
+                self._observe(query, time.perf_counter() - start)
+        if self._breaker is not None:
+            self._breaker.success()
+        return result
+
+class PooledConnection:
+    """Connessione presa dal pool: close() la restituisce invece di chiuderla."""
+    def __init__(self, pool, conn, created):
+        self._pool = pool
+        self._conn = conn
+        self._created = created
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        if self._pool.query_observer is not None or self._pool.breaker is not None:
+            return TimedCursor(cursor, self._pool.query_observer, self._pool.breaker)
+        return cursor
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn, self._created)
+
+    def discard(self):
+        """Chiude davvero la connessione (es. dopo un errore di rete)."""
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn, self._created, discard=True)
+
+class ConnectionPool:
+    def __init__(self, factory, min_size=1, max_size=10, timeout=5.0, recycle=3600.0, ping_interval=30.0,
+                 acquire_observer=None, query_observer=None, breaker=None):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Dimensioni del pool non valide.")
+        self.factory = factory
+        self.acquire_observer = acquire_observer  # Chiamata con i secondi di attesa di ogni acquisizione
+        self.query_observer = query_observer  # Chiamata con (istruzione, secondi) per ogni query
+        self.breaker = breaker  # Circuit breaker (resilience.py): con il database giù acquire fallisce subito
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._idle = deque()  # Elementi (connessione, creata_il, ultimo_uso)
+        self._cond = threading.Condition()
+        self._size = 0  # Connessioni aperte, libere o in uso
+        self._waiting = 0
+        self._closed = False
+        # Statistiche
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _open(self):
+        conn = self.factory()
+        with self._cond:
+            self._created += 1
+        return conn, time.monotonic()
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, created, last_used):
+        """Scarta le connessioni troppo vecchie e verifica con un ping quelle inattive."""
+        now = time.monotonic()
+        if self.recycle and now - created > self.recycle:
+            return False
+        if now - last_used > self.ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, timeout=None):
+        """Prende una connessione dal pool, aprendone una nuova se c'è spazio."""
+        if self.breaker is not None:
+            self.breaker.allow()  # Anche le connessioni libere sarebbero inutilizzabili
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+        entry = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Il pool è stato chiuso.")
+                if self._idle:
+                    entry = self._idle.pop()  # LIFO: riusa le connessioni più calde
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"Nessuna connessione libera dopo {time.monotonic() - start:.2f} s")
+                self._waiting += 1
+                self._cond.wait(remaining)
+                self._waiting -= 1
+
+        try:
+            if entry is not None:
+                conn, created, last_used = entry
+                if not self._is_usable(conn, created, last_used):
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._recycled += 1
+                    conn, created = self._open()
+            else:
+                conn, created = self._open()
+        except Exception:
+            # La connessione non è stata aperta: libera il posto nel pool
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        if self.acquire_observer is not None:
+            self.acquire_observer(waited)
+        return PooledConnection(self, conn, created)
+
+    def release(self, conn, created, discard=False):
+        """Restituisce una connessione al pool annullando eventuali transazioni aperte."""
+        if not discard:
+            try:
+                if getattr(conn, 'open', True) and self._in_transaction(conn):
+                    conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or self._closed or not getattr(conn, 'open', True):
+                self._size -= 1
+                self._cond.notify()
+                to_close = conn
+            else:
+                self._idle.append((conn, created, time.monotonic()))
+                self._cond.notify()
+                to_close = None
+        if to_close is not None:
+            self._close_quietly(to_close)
+
+    @staticmethod
+    def _in_transaction(conn):
+        # Con pymysql lo stato della transazione è noto localmente, senza round trip
+        server_status = getattr(conn, 'server_status', None)
+        if server_status is None:
+            return True
+        return bool(server_status & 1)  # SERVER_STATUS_IN_TRANS
+
+    def warm(self):
+        """Apre subito le connessioni minime previste; con il circuit breaker aperto fallisce subito."""
+        while True:
+            if self.breaker is not None:
+                self.breaker.allow()
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn, created = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, created, time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        """Chiude tutte le connessioni libere e rifiuta le nuove richieste."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Statistiche utili per dimensionare il pool."""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'size': self._size,
+                'in_use': self._size - idle,
+                'idle': idle,
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'recycled': self._recycled,
+                'wait_time_avg_ms': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_max * 1000, 3),
+            }
@@ -0,0 +1,61 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Hash delle password su un pool limitato, fuori dal thread della richiesta.
+# pbkdf2 e scrypt di hashlib rilasciano il GIL, quindi bastano i thread;
+# il pool di processi resta disponibile per le piattaforme in cui non è così.
+
+class HashQueueFull(Exception):
+    """Troppe richieste di hash in attesa: il chiamante deve rispondere subito con un errore."""
+
+def build_method(method, iterations=None):
+    """Compone il metodo per werkzeug, es. ('pbkdf2:sha256', 600000) -> 'pbkdf2:sha256:600000'."""
+    if method.startswith('pbkdf2') and iterations:
+        if method.count(':') == 0:
+            method += ':sha256'
+        return f"{method}:{iterations}"
+    return method
+
+class PasswordHasher:
+    def __init__(self, method='pbkdf2:sha256:600000', workers=None, max_pending=64, executor='thread'):
+        self.method = method
+        self.workers = workers or os.cpu_count() or 1
+        executor_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        if executor_class is ThreadPoolExecutor:
+            self._executor = executor_class(max_workers=self.workers, thread_name_prefix='password-hash')
+        else:
+            self._executor = executor_class(max_workers=self.workers)
+        # Richieste in esecuzione o in coda; oltre il limite si rifiuta senza attendere
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._method_prefix = None
+        self.rejected = 0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashQueueFull("Coda degli hash piena.")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Vero se l'hash è stato creato con parametri diversi da quelli configurati."""
+        if self._method_prefix is None:
+            # werkzeug normalizza il metodo (es. 'scrypt' -> 'scrypt:32768:8:1'): lo si ricava una volta
+            self._method_prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._method_prefix
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
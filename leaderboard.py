@@ -0,0 +1,184 @@
+import json
+import bisect
+import hashlib
+import threading
+import time
+import pymysql
+
+# Classifiche in memoria dei migliori tempi per utente: al primo accesso si caricano
+# da best_records, poi si aggiornano in modo incrementale leggendo solo le righe
+# dello storico (records) con id maggiore dell'ultimo già visto.
+# Più processi scrivono nello storico (buffer dei worker, giochi desktop) e gli id possono
+# diventare visibili fuori ordine: gli id saltati si ricontrollano per GAP_TIMEOUT secondi.
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+GAP_TIMEOUT = 60.0  # Una transazione ancora aperta dopo (s) si considera annullata
+GAP_LIMIT = 10000  # Id mancanti ricontrollati al massimo per gioco
+GAP_BATCH = 500  # Id per ogni query di controllo
+
+class IdGaps:
+    """Id dello storico saltati durante la lettura: possono ancora comparire finché la transazione non termina."""
+    def __init__(self, timeout=GAP_TIMEOUT, limit=GAP_LIMIT):
+        self.timeout = timeout
+        self.limit = limit
+        self.pending = {}  # id -> istante in cui è risultato mancante
+
+    def skip(self, last_id, record_id):
+        """Registra gli id tra last_id e record_id (esclusi) che la lettura ha saltato."""
+        now = time.monotonic()
+        for missing in range(max(last_id + 1, record_id - self.limit), record_id):
+            self.pending[missing] = now
+        if len(self.pending) > self.limit:
+            for missing in sorted(self.pending)[:len(self.pending) - self.limit]:
+                del self.pending[missing]
+
+    def fill(self, record_id):
+        """True se l'id era mancante (la riga va contata ora), False se era già stato letto."""
+        return self.pending.pop(record_id, None) is not None
+
+    def fetch(self, connection, columns):
+        """Righe comparse nel frattempo tra gli id mancanti; quelli troppo vecchi si abbandonano."""
+        oldest = time.monotonic() - self.timeout
+        for missing in [missing for missing, seen in self.pending.items() if seen < oldest]:
+            del self.pending[missing]
+        ids = sorted(self.pending)
+        rows = []
+        for start in range(0, len(ids), GAP_BATCH):
+            batch = ids[start:start + GAP_BATCH]
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT {columns} FROM records WHERE id IN ({", ".join(["%s"] * len(batch))}) ORDER BY id',
+                               batch)
+                rows += cursor.fetchall()
+        return rows
+
+class Leaderboard:
+    """Migliori tempi per utente di un gioco e una difficoltà, con la top N già ordinata."""
+    def __init__(self, size):
+        self.size = size
+        self.best = {}  # utente -> (tempo, data)
+        self.top = []   # [(tempo, utente, data)] ordinata per tempo
+        self.body = None
+        self.etag = None
+
+    def offer(self, user, time, date):
+        """Registra un tempo; restituisce True se la top N è cambiata."""
+        current = self.best.get(user)
+        if current is not None and time >= current[0]:
+            return False
+        self.best[user] = (time, date)
+
+        in_top = current is not None and any(entry[1] == user for entry in self.top)
+        if not in_top and len(self.top) >= self.size and time >= self.top[-1][0]:
+            return False  # Migliora il proprio tempo ma resta fuori dalla top N
+        if in_top:
+            self.top = [entry for entry in self.top if entry[1] != user]
+        bisect.insort(self.top, (time, user, date))
+        del self.top[self.size:]
+        self.body = None  # Il JSON verrà ricalcolato alla prossima lettura
+        return True
+
+    def render(self, game, difficulty):
+        """JSON della classifica ed ETag, ricalcolati solo quando la top N cambia."""
+        if self.body is None:
+            entries = [
+                {
+                    'rank': rank,
+                    'user': user,
+                    'time': record_time,
+                    'date': date.isoformat() if hasattr(date, 'isoformat') else date,
+                }
+                for rank, (record_time, user, date) in enumerate(self.top, start=1)
+            ]
+            self.body = json.dumps({'game': game, 'difficulty': difficulty, 'entries': entries}).encode('utf-8')
+            self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        return self.body, self.etag
+
+class LeaderboardCache:
+    def __init__(self, connect, games, size=10, max_staleness=5.0, batch_size=5000):
+        self.connect = connect  # Funzione gioco -> connessione (o None)
+        self.games = tuple(games)
+        self.size = size
+        self.max_staleness = max_staleness
+        self.batch_size = batch_size
+        self.boards = {(game, difficulty): Leaderboard(size) for game in self.games for difficulty in DIFFICULTIES}
+        self.last_id = {game: 0 for game in self.games}
+        self.gaps = {game: IdGaps() for game in self.games}
+        self.loaded = {game: False for game in self.games}
+        self.refreshed_at = {game: 0.0 for game in self.games}
+        self._refresh_locks = {game: threading.Lock() for game in self.games}
+        self._lock = threading.Lock()
+        self.listeners = []  # Chiamate con (gioco, difficoltà, utente, tempo, data) a ogni miglioramento
+
+    def record(self, game, user, difficulty, record_time, date):
+        """Aggiorna subito la classifica con un nuovo risultato."""
+        board = self.boards.get((game, difficulty))
+        if board is None:
+            return False
+        with self._lock:
+            current = board.best.get(user)
+            if current is not None and record_time >= current[0]:
+                return False
+            changed = board.offer(user, record_time, date)
+        for listener in self.listeners:
+            listener(game, difficulty, user, record_time, date)
+        return changed
+
+    def refresh(self, game, force=False):
+        """Legge i record nuovi se la classifica è più vecchia del limite di staleness."""
+        if not force and time.monotonic() - self.refreshed_at[game] < self.max_staleness:
+            return
+        lock = self._refresh_locks[game]
+        if not lock.acquire(blocking=False):
+            return  # Un altro thread sta già aggiornando: si servono i dati attuali
+        try:
+            connection = self.connect(game)
+            if connection is None:
+                return
+            try:
+                if not self.loaded[game]:
+                    self._load_best(game, connection)
+                gaps = self.gaps[game]
+                for row in gaps.fetch(connection, 'id, time, date, user, difficulty'):
+                    if gaps.fill(row['id']):
+                        self.record(game, row['user'], row['difficulty'], row['time'], row['date'])
+                while True:
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            'SELECT id, time, date, user, difficulty FROM records WHERE id > %s ORDER BY id LIMIT %s',
+                            (self.last_id[game], self.batch_size)
+                        )
+                        rows = cursor.fetchall()
+                    for row in rows:
+                        gaps.skip(self.last_id[game], row['id'])
+                        self.last_id[game] = row['id']
+                        self.record(game, row['user'], row['difficulty'], row['time'], row['date'])
+                    if len(rows) < self.batch_size:
+                        break
+            finally:
+                connection.close()
+            self.refreshed_at[game] = time.monotonic()
+        except pymysql.MySQLError as e:
+            print(f"Errore nell'aggiornamento della classifica di {game}: {e}")
+        finally:
+            lock.release()
+
+    def _load_best(self, game, connection):
+        """Primo caricamento dai migliori tempi, molto più piccoli dello storico."""
+        with connection.cursor() as cursor:
+            # L'id massimo va letto prima: i record successivi arrivano dallo storico
+            cursor.execute('SELECT COALESCE(MAX(id), 0) AS last_id FROM records')
+            last_id = cursor.fetchone()['last_id']
+            cursor.execute('SELECT time, date, user, difficulty FROM best_records')
+            for row in cursor:
+                self.record(game, row['user'], row['difficulty'], row['time'], row['date'])
+        self.last_id[game] = max(self.last_id[game], last_id)
+        self.loaded[game] = True
+
+    def get(self, game, difficulty):
+        """Restituisce (json, etag) della classifica, oppure None se non esiste."""
+        board = self.boards.get((game, difficulty))
+        if board is None:
+            return None
+        self.refresh(game)
+        with self._lock:
+            return board.render(game, difficulty)
@@ -0,0 +1,251 @@
+import os
+import sys
+import asyncio
+from urllib.parse import urlsplit, parse_qs, unquote
+import pymysql
+import config
+import resilience
+from db_pool import ConnectionPool, PoolTimeout
+from leaderboard import LeaderboardCache
+from race_server import token_verifier
+from sessions import load_secret_key
+
+try:
+    import uvloop  # Opzionale: ciclo di eventi più veloce
+except ImportError:
+    uvloop = None
+
+# Classifiche in diretta con Server-Sent Events, servite da un processo asyncio come le gare
+# (race_server.py): un client collegato costa un socket e una coroutine ferma in lettura,
+# non un thread dell'app. Un solo task legge i record nuovi dallo storico (LeaderboardCache,
+# con le query in un thread), codifica l'evento una volta e scrive lo stesso oggetto bytes
+# a tutti i client della classifica; lo stesso per l'heartbeat. Il buffer di scrittura di
+# ogni client è limitato: chi non legge viene chiuso e il browser si ricollega da solo.
+# Il token si chiede all'app con la sessione (/api/leaderboard/stream/token):
+#   const { token, url } = await (await fetch('/api/leaderboard/stream/token')).json();
+#   new EventSource(`${url}/memory/easy?token=${token}`)
+#
+#   python leaderboard_stream.py
+#   LEADERBOARD_STREAM_BIND=127.0.0.1:8766 python leaderboard_stream.py
+# Con molti client serve un limite di file aperti adeguato (ulimit -n).
+
+TOKEN_SALT = 'leaderboard-stream'
+PING = b': ping\n\n'
+RETRY = b'retry: 3000\n\n'
+
+def encode_event(etag, body):
+    # Il JSON della classifica è su una sola riga: basta un campo data
+    return b'id: ' + etag.encode('ascii') + b'\nevent: leaderboard\ndata: ' + body + b'\n\n'
+
+def http_response(status, headers=(), body=b''):
+    lines = [f'HTTP/1.1 {status}', *headers]
+    if body or not status.startswith('200'):
+        lines += [f'Content-Length: {len(body)}', 'Connection: close']
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+class Channel:
+    """Client collegati alla classifica di un gioco e una difficoltà, con l'ultimo evento inviato."""
+    def __init__(self):
+        self.writers = set()
+        self.etag = None
+        self.frame = None
+
+class LeaderboardStreamServer:
+    def __init__(self, leaderboards, verify, interval=1.0, heartbeat=15.0, max_clients=10000,
+                 max_write_buffer=64 * 1024, allow_origin='*', request_timeout=10.0):
+        self.leaderboards = leaderboards
+        self.verify = verify
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_clients = max_clients
+        self.max_write_buffer = max_write_buffer  # Client più lenti di così vengono chiusi
+        self.allow_origin = allow_origin
+        self.request_timeout = request_timeout
+        self.channels = {key: Channel() for key in leaderboards.boards}
+        self.clients = 0
+        # Statistiche
+        self.connections = 0
+        self.broadcasts = 0
+        self.frames_out = 0
+        self.slow_clients = 0
+        self.rejected = 0
+
+    async def read_request(self, reader):
+        """(metodo, percorso, query, header) della richiesta HTTP."""
+        request = await reader.readuntil(b'\r\n\r\n')
+        lines = request.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        return method, unquote(url.path), parse_qs(url.query), headers
+
+    def open_stream(self, method, path, query, headers, writer):
+        """Risponde alla richiesta; restituisce il canale se il client resta collegato."""
+        if method != 'GET':
+            writer.write(http_response('405 Method Not Allowed', ['Allow: GET']))
+            return None
+        parts = path.strip('/').split('/')
+        channel = self.channels.get(tuple(parts[1:])) if len(parts) == 3 and parts[0] == 'leaderboard' else None
+        if channel is None:
+            writer.write(http_response('404 Not Found'))
+            return None
+        if self.verify(query.get('token', [''])[0], None) is None:
+            writer.write(http_response('403 Forbidden'))
+            return None
+        if self.clients >= self.max_clients:
+            self.rejected += 1
+            writer.write(http_response('503 Service Unavailable', ['Retry-After: 5']))
+            return None
+        writer.write(http_response('200 OK', [
+            'Content-Type: text/event-stream',
+            'Cache-Control: no-cache',
+            'X-Accel-Buffering: no',  # nginx: inoltra ogni evento senza bufferizzare
+            f'Access-Control-Allow-Origin: {self.allow_origin}',
+        ]) + RETRY)
+        # Dopo una riconnessione (Last-Event-ID) si invia la classifica solo se è cambiata
+        if channel.frame is not None and channel.etag != headers.get('last-event-id'):
+            writer.write(channel.frame)
+        channel.writers.add(writer)
+        self.clients += 1
+        return channel
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        channel = None
+        try:
+            request = await asyncio.wait_for(self.read_request(reader), self.request_timeout)
+            channel = self.open_stream(*request, writer)
+            # Il client non invia altro: la lettura termina quando chiude la connessione
+            while channel is not None and await reader.read(1024):
+                pass
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            if channel is not None:
+                channel.writers.discard(writer)
+                self.clients -= 1
+            self.connections -= 1
+            writer.close()
+
+    def broadcast(self, writers, frame):
+        """Scrive lo stesso frame a tutti i client, senza attendere i socket."""
+        for writer in list(writers):
+            transport = writer.transport
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > self.max_write_buffer:
+                # Client che non legge: chiuderlo libera la memoria; EventSource si ricollega
+                self.slow_clients += 1
+                transport.abort()
+                continue
+            writer.write(frame)
+            self.frames_out += 1
+
+    def snapshots(self, keys):
+        """Eseguita in un thread: aggiorna dallo storico e restituisce (json, etag) delle classifiche."""
+        return {key: self.leaderboards.get(*key) for key in keys}
+
+    async def poller(self):
+        """Un solo task per tutte le classifiche: ogni cambiamento si codifica e si invia una volta."""
+        loop = asyncio.get_running_loop()
+        while True:
+            keys = [key for key, channel in self.channels.items() if channel.writers]
+            try:
+                results = await loop.run_in_executor(None, self.snapshots, keys) if keys else {}
+            except Exception as e:
+                print(f"Errore nella lettura delle classifiche: {e}")
+                results = {}
+            for key, result in results.items():
+                channel = self.channels[key]
+                if result is None or result[1] == channel.etag:
+                    continue
+                body, etag = result
+                channel.etag, channel.frame = etag, encode_event(etag, body)
+                self.broadcasts += 1
+                self.broadcast(channel.writers, channel.frame)
+            await asyncio.sleep(self.interval)
+
+    async def pinger(self):
+        """Commento SSE a tutti ogni heartbeat: tiene aperti i proxy e rileva i client spariti."""
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            for channel in self.channels.values():
+                self.broadcast(channel.writers, PING)
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'clients': self.clients,
+            'broadcasts': self.broadcasts,
+            'frames_out': self.frames_out,
+            'slow_clients': self.slow_clients,
+            'rejected': self.rejected,
+        }
+
+    async def report(self, interval):
+        last = self.stats()
+        while True:
+            await asyncio.sleep(interval)
+            current = self.stats()
+            if current != last:
+                print(f"Classifiche in diretta: {current['clients']} client, {current['broadcasts']} aggiornamenti, "
+                      f"{current['frames_out'] - last['frames_out']} eventi inviati, {current['slow_clients']} client lenti chiusi")
+            last = current
+
+async def serve(host, port, server):
+    listener = await asyncio.start_server(server.handle, host, port, backlog=config.LEADERBOARD_STREAM_BACKLOG)
+    print(f"Server delle classifiche in diretta in ascolto su {host}:{port}")
+    tasks = [asyncio.create_task(server.poller()), asyncio.create_task(server.pinger())]
+    if config.LEADERBOARD_STREAM_STATS_INTERVAL > 0:
+        tasks.append(asyncio.create_task(server.report(config.LEADERBOARD_STREAM_STATS_INTERVAL)))
+    async with listener:
+        await listener.serve_forever()
+
+def create_server():
+    # Una connessione per database, usata solo dal task che legge lo storico
+    pools = {}
+    for game, database in config.GAME_DATABASES.items():
+        if database not in pools:
+            pools[database] = ConnectionPool(lambda database=database: resilience.connect(database, check=False),
+                                             min_size=0, max_size=1, timeout=config.DB_POOL_TIMEOUT,
+                                             breaker=resilience.breaker_for(database))
+
+    def connect(game):
+        try:
+            return pools[config.GAME_DATABASES[game]].acquire()
+        except (PoolTimeout, pymysql.MySQLError) as e:
+            print(f"Errore nella connessione al database di {game}: {e}")
+            return None
+
+    leaderboards = LeaderboardCache(connect, config.GAME_DATABASES, size=config.LEADERBOARD_SIZE,
+                                    max_staleness=config.LEADERBOARD_STREAM_INTERVAL)
+    secret_key = load_secret_key(config.SECRET_KEY, config.SECRET_KEY_PATH)
+    # Nessun token condiviso: la classifica in diretta richiede la sessione del sito
+    verify = token_verifier(config.SECRET_KEY_FALLBACKS + [secret_key], '', config.LEADERBOARD_STREAM_TOKEN_MAX_AGE,
+                            salt=TOKEN_SALT)
+    return LeaderboardStreamServer(
+        leaderboards,
+        verify,
+        interval=config.LEADERBOARD_STREAM_INTERVAL,
+        heartbeat=config.LEADERBOARD_STREAM_HEARTBEAT,
+        max_clients=config.LEADERBOARD_STREAM_MAX_CLIENTS,
+        max_write_buffer=config.LEADERBOARD_STREAM_MAX_WRITE_BUFFER,
+        allow_origin=config.LEADERBOARD_STREAM_ALLOW_ORIGIN,
+    )
+
+def main():
+    host, _, port = config.LEADERBOARD_STREAM_BIND.rpartition(':')
+    if uvloop is not None:
+        uvloop.install()
+    try:
+        asyncio.run(serve(host or '0.0.0.0', int(port), create_server()))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
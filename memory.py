@@ -4,6 +4,15 @@ import sys
 import random
 import pymysql
 import os
+import config
+import schema
+import resilience
+from db_pool import TimedCursor
+import record_store
+import telemetry
+import race_protocol
+import daily
+from race_client import RaceClient
 from button import Button
 
 # Costanti per le dimensioni e le risorse
@@ -17,72 +26,62 @@ VICTORY_IMAGE = 'assets/games/victory.png'  # Immagine da mostrare alla vittoria
 VICTORY_IMAGE_SIZE = (500, 400)  # Dimensioni dell'immagine di vittoria
 BACKGROUND_IMAGE = 'assets/games/background.png'  # Immagine di sfondo
 
-# Mappa delle difficoltà
-DIFFICULTY_MAP = {
-    'easy': 8,
-    'medium': 12,
-    'hard': 16
-}
+# Mappa delle difficoltà (coppie di carte), condivisa con le sfide giornaliere
+DIFFICULTY_MAP = daily.MEMORY_PAIRS
 
 # Classe per gestire la connessione al database
 class Database:
     def __init__(self):
+        # La connessione si apre al primo uso, con timeout, nuovi tentativi e circuit breaker
+        # (resilience.py): se il database non risponde si gioca lo stesso, senza record
+        self.conn = None
+        self.cursor = None
+
+    def _connect(self):
+        if self.conn is None or not self.conn.open:
+            self.conn = resilience.connect(config.DB_NAME)
+            # Gli esiti delle query arrivano al circuit breaker, come nel pool dell'app
+            self.cursor = TimedCursor(self.conn.cursor(pymysql.cursors.DictCursor), None, resilience.breaker_for(config.DB_NAME))
+            schema.check_schema(self.conn)  # Le tabelle si creano con "python schema.py migrate"
+        return self.cursor
+
+    def _failed(self, action, error):
+        print(f"Database non disponibile, {action}: {error}")
+        self.close()
+
+    def save_record(self, new_time, user, difficulty):
+        # Salva la partita nello storico e aggiorna il miglior tempo con un solo upsert condizionale
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         try:
-            # Leggi le variabili d'ambiente
-            db_host = 'RobertaMerlo.mysql.pythonanywhere-services.com'
-            db_user = 'RobertaMerlo'
-            db_password = 'Y9puX%40a8'  
-            db_name = 'RobertaMerlo$db'
-            # Crea la connessione
-            self.conn = pymysql.connect(
-                host=db_host,
-                user=db_user,
-                password=db_password,
-                database=db_name,
-                #port=db_port
-            )
-            self.cursor = self.conn.cursor(pymysql.cursors.DictCursor)
-            self.create_table()  # Creazione della tabella se non esiste
+            improved = record_store.save_records(self._connect(), [(new_time, current_time, user, difficulty)])
+            self.conn.commit()
         except pymysql.MySQLError as e:
-            print(f"Errore nella connessione al database: {e}")
-            sys.exit()
+            self._failed("record non salvato", e)
+            return False
+        return improved > 0
 
-    def create_table(self):
+    def load_best_record(self, user, difficulty):
         try:
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS records (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    time FLOAT,
-                    date DATETIME,
-                    user VARCHAR(255),
-                    difficulty VARCHAR(255)
-                )
-            ''')
-            self.conn.commit()
+            return record_store.load_best_record(self._connect(), user, difficulty)
         except pymysql.MySQLError as e:
-            print(f"Errore nella creazione della tabella: {e}")
-            sys.exit()
+            self._failed("miglior tempo non disponibile", e)
+            return None
 
-    def save_record(self, new_time, user, difficulty):
-        # Salva il record solo se il nuovo tempo è migliore
-        best_record = self.load_best_record(user, difficulty)
-        if not best_record or new_time < best_record['time']:
-            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.cursor.execute(
-                "INSERT INTO records (time, date, user, difficulty) VALUES (%s, %s, %s, %s)",
-                (new_time, current_time, user, difficulty)
-            )
+    def save_daily_record(self, day, new_time, user, difficulty):
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            record_store.save_daily_record(self._connect(), day.isoformat(), difficulty, user, new_time, current_time)
             self.conn.commit()
-
-    def load_best_record(self, user, difficulty):
-        self.cursor.execute(
-            "SELECT time, date, user, difficulty FROM records WHERE user = %s AND difficulty = %s ORDER BY time ASC LIMIT 1",
-            (user, difficulty)
-        )
-        return self.cursor.fetchone()
+        except pymysql.MySQLError as e:
+            self._failed("tempo della sfida non salvato", e)
 
     def close(self):
-        self.conn.close()
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except pymysql.MySQLError:
+                pass
+            self.conn = None
 
     # Funzione per aggiornare il miglior tempo e record dinamicamente
     def update_best_time_text(db, user, difficulty, elapsed_time):
@@ -158,7 +157,7 @@ def load_images():
     return images, cover_image, victory_image, background_image
 
 # Funzione per creare la griglia di gioco basata sulla difficoltà scelta
-def create_grid(difficulty, images):
+def create_grid(difficulty, images, rng=None, deck=None):
     if difficulty not in DIFFICULTY_MAP:
         raise ValueError("Difficoltà non valida. Deve essere 'easy', 'medium' o 'hard'.")
 
@@ -166,9 +165,15 @@ def create_grid(difficulty, images):
     if num_pairs > len(images):
         raise ValueError("Non ci sono abbastanza immagini per il livello scelto.")
     
-    selected_images = random.sample([img for img in images if img is not None], num_pairs)
-    card_list = selected_images * 2  
-    random.shuffle(card_list)
+    if deck is not None:
+        # Sfida giornaliera: indici delle immagini già nell'ordine della griglia
+        card_list = [images[index] for index in deck]
+    else:
+        # Con un generatore dallo stesso seme (gare) tutti i giocatori ottengono lo stesso mazzo
+        rng = rng or random
+        selected_images = rng.sample([img for img in images if img is not None], num_pairs)
+        card_list = selected_images * 2  
+        rng.shuffle(card_list)
 
     num_cards = num_pairs * 2
     num_rows = 4
@@ -187,9 +192,10 @@ def create_grid(difficulty, images):
 
 # Classe per gestire una carta nel gioco
 class Card:
-    def __init__(self, image, rect):
+    def __init__(self, image, rect, position=(0, 0)):
         self.image = image
         self.rect = rect
+        self.position = position  # Colonna e riga nella griglia
         self.covered = True
 
     def draw(self, screen, cover_image):
@@ -206,25 +212,74 @@ def draw_text(screen, text, position, font, color=(255, 255, 255)):
     text_surface = font.render(text, True, color)
     screen.blit(text_surface, position)
 
+# Attesa degli avversari: restituisce (seme, giocatori) oppure None se la gara non parte
+def wait_for_race(screen, race, background_image, font):
+    clock = pygame.time.Clock()
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return None
+        for message in race.poll():
+            if message[0] == 'start':
+                _, seed, _, _, players = message
+                return seed, {slot: [name, 0, None] for slot, name in players}
+            if message[0] in ('error', 'closed'):
+                print(f"Gara non disponibile: {message[1] if len(message) > 1 else 'connessione chiusa'}")
+                return None
+        screen.blit(background_image, (0, 0))
+        draw_text(screen, "In attesa degli avversari...", (10, 10), font)
+        pygame.display.flip()
+        clock.tick(60)
+
+# Aggiorna l'avanzamento dei giocatori con i messaggi arrivati dal server della gara
+def update_race(race, players):
+    for message in race.poll():
+        if message[0] == 'tick':
+            for slot, _, _, _, found in message[2]:
+                if slot in players:
+                    players[slot][1] = found
+        elif message[0] == 'result':
+            _, slot, _, place = message
+            if slot in players:
+                players[slot][2] = place
+        elif message[0] == 'leave':
+            players.pop(message[1], None)
+        elif message[0] == 'error':
+            print(f"Errore nella gara: {message[1]}")
+
 # Funzione principale per iniziare il gioco di memoria
-def start_memory_game(user, difficulty):
+def start_memory_game(user, difficulty, race=None, challenge=None):
+    # Inizializzazione di Pygame e creazione della finestra di gioco, prima di contattare il database
+    screen = pygame.display.set_mode(WINDOW_SIZE)
+    pygame.display.set_caption('Memory Game')
+
     db = Database()  # Connessione al database
-    
+
     # Caricamento del miglior record per l'utente e la difficoltà scelta
     best_record = db.load_best_record(user, difficulty)
     best_time = best_record['time'] if best_record else None
+    events = telemetry.TelemetryClient('memory', user, difficulty)  # Telemetria della partita
     #user = best_record['user'] if best_record else None
 
-    # Inizializzazione di Pygame e creazione della finestra di gioco
-    screen = pygame.display.set_mode(WINDOW_SIZE)
-    pygame.display.set_caption('Memory Game')
-
     # Caricamento delle immagini e dei suoni
     images, cover_image, victory_image, background_image = load_images()
     click_sound, win_sound = load_sounds()
 
-    # Creazione della griglia di gioco
-    grid, num_cols = create_grid(difficulty, images)
+    font = pygame.font.Font(None, 36)
+
+    # In gara il mazzo si costruisce con il seme ricevuto dal server, uguale per tutti
+    rng = None
+    players = {}  # Giocatori della gara: posto -> [nome, coppie trovate, posizione d'arrivo]
+    if race:
+        started = wait_for_race(screen, race, background_image, font)
+        if started is None:
+            db.close()
+            return 'selection'
+        seed, players = started
+        rng = random.Random(seed)
+
+    # Creazione della griglia di gioco (nella sfida giornaliera il mazzo arriva dal server)
+    grid, num_cols = create_grid(difficulty, images, rng, deck=challenge[1] if challenge else None)
     cards = []
     card_width, card_height = CARD_SIZE
     spacing = CARD_SPACING
@@ -244,7 +299,7 @@ def start_memory_game(user, difficulty):
                     card_width,
                     card_height
                 )
-                cards.append(Card(image, rect))
+                cards.append(Card(image, rect, (c, r)))
 
     first_card = None
     second_card = None
@@ -256,7 +311,6 @@ def start_memory_game(user, difficulty):
     consecutive_matches = 0
     reveal_delay = 1000  # Ritardo per mostrare le carte
 
-    font = pygame.font.Font(None, 36)
     showing_cards = False
     show_start_time = 0
 
@@ -277,9 +331,11 @@ def start_memory_game(user, difficulty):
             if event.type == pygame.MOUSEBUTTONDOWN:
                 pos = pygame.mouse.get_pos()
                 if back_button.click(event):
+                    events.close()
                     db.close()
                     return 'selection'
                 if start_button.click(event):
+                    events.close()
                     return 'game'
                 if exit_button.click(event):
                     db.close()
@@ -291,6 +347,9 @@ def start_memory_game(user, difficulty):
                         if click_sound:
                             click_sound.play()
                         card.flip()
+                        events.record(telemetry.FLIP, *card.position)
+                        if race:
+                            race.progress(race_protocol.FLIP, *card.position, matches)
 
                         if first_card is None:
                             first_card = card
@@ -304,6 +363,9 @@ def start_memory_game(user, difficulty):
                 cards = [card for card in cards if card != first_card and card != second_card]
                 matches += 1
                 consecutive_matches += 1
+                events.record(telemetry.MATCH, *first_card.position, consecutive_matches)
+                if race:
+                    race.progress(race_protocol.MATCH, *first_card.position, matches)
                 points = 20 * consecutive_matches
                 score += points
                 if matches == num_pairs:
@@ -312,9 +374,15 @@ def start_memory_game(user, difficulty):
                     if win_sound:
                         win_sound.play()
                     elapsed_time = (end_time - start_time) // 1000
-                    if best_time is None or elapsed_time < best_time:
-                        db.save_record(elapsed_time, user, difficulty)
+                    if race:
+                        race.finish(end_time - start_time)
+                    if challenge:
+                        db.save_daily_record(challenge[0], elapsed_time, user, difficulty)
+                    elif db.save_record(elapsed_time, user, difficulty):
+                        # Ogni partita va nello storico; l'upsert di best_records decide se è un nuovo record
+                        best_time = elapsed_time
             else:
+                events.record(telemetry.MISMATCH, *first_card.position, consecutive_matches)
                 first_card.flip()
                 second_card.flip()
                 consecutive_matches = 0
@@ -333,6 +401,12 @@ def start_memory_game(user, difficulty):
 
         if best_time is None:
             draw_text(screen, f"Nessun Record.", (10, 90), font)
+
+        if race:
+            update_race(race, players)
+            for index, (name, found, place) in enumerate(players.values()):
+                status = f"arrivato {place}°" if place else f"{found}/{num_pairs} coppie"
+                draw_text(screen, f"{name}: {status}", (10, 130 + index * 30), font)
         
         # Disegnare i pulsanti
         back_button.draw(screen)
@@ -342,6 +416,8 @@ def start_memory_game(user, difficulty):
         pygame.display.flip()
         clock.tick(60)
 
+    events.close()  # Partita finita: invio degli ultimi eventi
+
     # Mostrare l'immagine di vittoria
     while game_over:
         for event in pygame.event.get():
@@ -462,10 +538,22 @@ def start_memory(user):
 
 # Funzione principale per l'esecuzione dello script
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Uso: python memory.py <username>")
+    # Gara: python memory.py <username> --race <difficoltà> [stanza]
+    # Sfida giornaliera: python memory.py <username> --daily <difficoltà>
+    if len(sys.argv) == 2:
+        start_memory(sys.argv[1])
+    elif len(sys.argv) in (4, 5) and sys.argv[2] == '--race' and sys.argv[3] in DIFFICULTY_MAP:
+        room = sys.argv[4] if len(sys.argv) == 5 else ''
+        race = RaceClient('memory', sys.argv[3], sys.argv[1], room).start()
+        pygame.init()
+        start_memory_game(sys.argv[1], sys.argv[3], race=race)
+        race.close()
+    elif len(sys.argv) == 4 and sys.argv[2] == '--daily' and sys.argv[3] in DIFFICULTY_MAP:
+        board = daily.fetch_board('memory', sys.argv[3])
+        if board is None:
+            sys.exit(1)
+        pygame.init()
+        start_memory_game(sys.argv[1], sys.argv[3], challenge=board)
+    else:
+        print("Uso: python memory.py <username> [--race easy|medium|hard [stanza] | --daily easy|medium|hard]")
         sys.exit(1)
-
-    user = sys.argv[1]
-   # print(f"Username provided: {user}")
-    start_memory(user)
@@ -0,0 +1,171 @@
+import bisect
+import threading
+import time
+from flask import g, request, got_request_exception
+
+# Metriche minime in formato testo Prometheus (contatori, gauge, istogrammi).
+# Ogni aggiornamento costa un lock e, per gli istogrammi, una ricerca binaria.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, (), value) for labels, value in self._values.items()]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+class CallbackGauge:
+    """Gauge letto solo al momento dello scrape da una funzione che restituisce [(etichette, valore)]."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        return [(self.name, tuple(labels), (), value) for labels, value in self.callback()]
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # etichette -> [conteggi per bucket..., somma, totale]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        samples = []
+        for labels, series in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels, (('le', format_value(float(bound))),), cumulative))
+            samples.append((self.name + '_bucket', labels, (('le', '+Inf'),), series[-1]))
+            samples.append((self.name + '_sum', labels, (), series[-2]))
+            samples.append((self.name + '_count', labels, (), series[-1]))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def callback_gauge(self, name, documentation, labelnames, callback):
+        return self.register(CallbackGauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Tutte le metriche nel formato di esposizione testuale di Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, extra, value in metric.samples():
+                lines.append(f'{name}{format_labels(metric.labelnames, labels, extra)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+def statement_verb(query):
+    """Prima parola dell'istruzione SQL (SELECT, INSERT, ...), usata come etichetta."""
+    parts = query.split(None, 1)
+    return parts[0].upper() if parts else ''
+
+def instrument_app(app, registry):
+    """Registra latenza, stato e richieste in corso per ogni route."""
+    latency = registry.histogram('http_request_duration_seconds', 'Durata delle richieste HTTP', ('route', 'method'))
+    responses = registry.counter('http_responses_total', 'Risposte HTTP per route e stato', ('route', 'method', 'status'))
+    in_flight = registry.gauge('http_requests_in_flight', 'Richieste HTTP in corso')
+    in_flight.set(value=0)
+    exceptions = registry.counter('http_exceptions_total', 'Eccezioni non gestite durante le richieste', ('route',))
+
+    def route_label():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_in_flight = True
+        in_flight.inc()
+
+    @app.after_request
+    def record_response(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = route_label()
+            latency.observe(time.perf_counter() - start, route, request.method)
+            responses.inc(route, request.method, str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def stop_timer(exc):
+        if g.pop('metrics_in_flight', False):
+            in_flight.dec()
+
+    def count_exception(sender, exception, **extra):
+        exceptions.inc(route_label())
+
+    got_request_exception.connect(count_exception, app, weak=False)
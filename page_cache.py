@@ -0,0 +1,105 @@
+import os
+import gzip
+import hashlib
+import time
+from flask import request
+from jinja2 import nodes
+from jinja2.ext import Extension
+from user_cache import TTLCache
+
+try:
+    import brotli  # Opzionale: abilita la compressione br
+except ImportError:
+    brotli = None
+
+# Cache dei frammenti di template e compressione delle risposte HTML.
+# Un frammento si marca nel template con {% cache 'nome' %} ... {% endcache %}:
+# l'HTML generato viene riusato finché non cambiano lo stato di autenticazione
+# (o le altre parti della chiave) oppure la data di modifica dei template.
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        # Impostati dall'app: cache (get/put) e funzione che restituisce la parte variabile della chiave
+        environment.extend(fragment_cache=None, fragment_cache_key=lambda: ())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        # Il frammento dipende anche dal template foglia: i blocchi possono essere ridefiniti con extends
+        args = [nodes.ContextReference(), nodes.Const((parser.name, lineno)), nodes.List(parts)]
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, context, location, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = (context.name, location, tuple(parts), self.environment.fragment_cache_key())
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.put(key, fragment)
+        return fragment
+
+class TemplateVersion:
+    """Data di modifica più recente dei template, ricontrollata al massimo ogni `interval` secondi."""
+    def __init__(self, directory, interval=2.0):
+        self.directory = directory
+        self.interval = interval
+        self._value = 0.0
+        self._checked = None
+
+    def __call__(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.interval:
+            self._checked = now
+            latest = 0.0
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    try:
+                        latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+                    except OSError:
+                        pass
+            self._value = latest
+        return self._value
+
+def compress_responses(app, min_size=1024, level=6, mimetypes=('text/html',), cache_size=256):
+    """Comprime con br o gzip le risposte testuali più grandi di `min_size` byte."""
+    # Le pagine uguali (es. la home per gli anonimi) si comprimono una volta sola
+    compressed = TTLCache(max_size=cache_size, ttl=3600.0)
+
+    @app.after_request
+    def compress(response):
+        if (response.mimetype not in mimetypes or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if brotli is not None and request.accept_encodings['br']:
+            encoding = 'br'
+        elif request.accept_encodings['gzip']:
+            encoding = 'gzip'
+        else:
+            return response
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+
+        key = (hashlib.sha1(body).digest(), encoding)
+        data = compressed.get(key)
+        if data is None:
+            if encoding == 'br':
+                data = brotli.compress(body, quality=min(level, 11))
+            else:
+                data = gzip.compress(body, compresslevel=min(level, 9))
+            compressed.put(key, data)
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    return compressed
@@ -5,59 +5,72 @@ import datetime
 import sys
 import pymysql
 import os
+import config
+import schema
+import resilience
+from db_pool import TimedCursor
+import record_store
+import telemetry
+import race_protocol
+import daily
+import uploads
+from race_client import RaceClient
+from daily import GRID_SIZES  # Righe e colonne del puzzle per difficoltà
 from button import Button  
 
 # Classe per gestire la connessione al database
 class Database:
     def __init__(self):
-        # Leggi le variabili d'ambiente
-        db_host = 'RobertaMerlo.mysql.pythonanywhere-services.com'
-        db_user = 'RobertaMerlo'
-        db_password = 'Y9puX%40a8'  # Inserisci qui la password del database
-        db_name = 'RobertaMerlo$default'
-        # Crea la connessione
-        self.conn = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            #port=db_port
-        )
-        self.cursor = self.conn.cursor()
-        self.create_table()
-
-    def create_table(self):
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS records (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                time FLOAT,
-                date DATETIME,
-                user VARCHAR(255),
-                difficulty VARCHAR(255)
-            )
-        ''')
-        self.conn.commit()
+        # La connessione si apre al primo uso, con timeout, nuovi tentativi e circuit breaker
+        # (resilience.py): se il database non risponde si gioca lo stesso, senza record
+        self.conn = None
+        self.cursor = None
+
+    def _connect(self):
+        if self.conn is None or not self.conn.open:
+            self.conn = resilience.connect(config.PUZZLE_DB_NAME)
+            # Gli esiti delle query arrivano al circuit breaker, come nel pool dell'app
+            self.cursor = TimedCursor(self.conn.cursor(), None, resilience.breaker_for(config.PUZZLE_DB_NAME))
+            schema.check_schema(self.conn)  # Le tabelle si creano con "python schema.py migrate"
+        return self.cursor
+
+    def _failed(self, action, error):
+        print(f"Database non disponibile, {action}: {error}")
+        self.close()
 
     def save_record(self, new_time, user, difficulty):
-        # Salva il record solo se il nuovo tempo è migliore
-        best_record = self.load_best_record(user, difficulty)
-        if not best_record or new_time < best_record['time']:
-            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.cursor.execute(
-                "INSERT INTO records (time, date, user, difficulty) VALUES (%s, %s, %s, %s)",
-                (new_time, current_time, user, difficulty)
-            )
+        # Salva la partita nello storico e aggiorna il miglior tempo con un solo upsert condizionale
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            improved = record_store.save_records(self._connect(), [(new_time, current_time, user, difficulty)])
             self.conn.commit()
+        except pymysql.MySQLError as e:
+            self._failed("record non salvato", e)
+            return False
+        return improved > 0
 
     def load_best_record(self, user, difficulty):
-        self.cursor.execute(
-            "SELECT time, date, user, difficulty FROM records WHERE user = %s AND difficulty = %s ORDER BY time ASC LIMIT 1",
-            (user, difficulty)
-        )
-        return self.cursor.fetchone()
+        try:
+            return record_store.load_best_record(self._connect(), user, difficulty)
+        except pymysql.MySQLError as e:
+            self._failed("miglior tempo non disponibile", e)
+            return None
+
+    def save_daily_record(self, day, new_time, user, difficulty):
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            record_store.save_daily_record(self._connect(), day.isoformat(), difficulty, user, new_time, current_time)
+            self.conn.commit()
+        except pymysql.MySQLError as e:
+            self._failed("tempo della sfida non salvato", e)
 
     def close(self):
-        self.conn.close()
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except pymysql.MySQLError:
+                pass
+            self.conn = None
 
 # Funzione per caricare un'immagine
 def load_image(path):
@@ -69,7 +82,7 @@ def load_image(path):
 
 # Classe per gestire il gioco del puzzle
 class PuzzleGame:
-    def __init__(self, image, rows, cols, offset_x=150, offset_y=104, click_sound=None, win_sound=None):
+    def __init__(self, image, rows, cols, offset_x=150, offset_y=104, click_sound=None, win_sound=None, telemetry=None, rng=None, layout=None, tiles=None):
         self.image = image
         self.rows = rows
         self.cols = cols
@@ -79,8 +92,13 @@ class PuzzleGame:
         self.empty_pos = (cols - 1, rows - 1)
         self.click_sound = click_sound
         self.win_sound = win_sound
+        self.telemetry = telemetry  # Client della telemetria (opzionale)
+        self.tiles = tiles  # Tessere già tagliate (immagini caricate dagli utenti), in ordine di riga
         self.create_pieces()
-        self.shuffle_pieces()
+        if layout:
+            self.set_layout(layout)  # Plancia già pronta (sfida giornaliera)
+        else:
+            self.shuffle_pieces(rng=rng)
 
     def create_pieces(self):
         piece_width = self.image.get_width() // self.cols
@@ -88,28 +106,25 @@ class PuzzleGame:
         for row in range(self.rows):
             for col in range(self.cols):
                 if (row, col) != self.empty_pos:
-                    rect = pygame.Rect(col * piece_width, row * piece_height, piece_width, piece_height)
-                    piece_image = self.image.subsurface(rect)
+                    if self.tiles:
+                        piece_image = self.tiles[row * self.cols + col]
+                    else:
+                        rect = pygame.Rect(col * piece_width, row * piece_height, piece_width, piece_height)
+                        piece_image = self.image.subsurface(rect)
                     self.pieces.append({
                         'image': piece_image,
                         'current_pos': (col, row),
                         'correct_pos': (col, row)
                     })
 
-    def shuffle_pieces(self, max_attempts=1000):
-        attempts = 0
-        while attempts < max_attempts:
-            piece_positions = [piece['current_pos'] for piece in self.pieces]
-            random.shuffle(piece_positions)
-            for i, piece in enumerate(self.pieces):
-                piece['current_pos'] = piece_positions[i]
+    def shuffle_pieces(self, max_attempts=1000, rng=None):
+        # Con un generatore dallo stesso seme (gare) tutti i giocatori ottengono la stessa plancia
+        self.set_layout(daily.puzzle_layout(self.rows, self.cols, rng, max_attempts))
 
-            if self.is_solvable():
-                break
-
-            attempts += 1
-        else:
-            raise RuntimeError("Impossibile generare un puzzle risolvibile dopo molti tentativi.")
+    def set_layout(self, positions):
+        # Posizioni delle tessere nell'ordine delle posizioni corrette
+        for piece, position in zip(self.pieces, positions):
+            piece['current_pos'] = tuple(position)
 
     def draw(self, screen):
         piece_width = self.image.get_width() // self.cols
@@ -125,10 +140,10 @@ class PuzzleGame:
         y = (position[1] - self.offset_y) // piece_height
 
         if x < 0 or x >= self.cols or y < 0 or y >= self.rows:
-            return
+            return None
 
         if (x, y) == self.empty_pos:
-            return
+            return None
 
         if self.is_adjacent((x, y), self.empty_pos):
             for piece in self.pieces:
@@ -136,10 +151,14 @@ class PuzzleGame:
                     piece['current_pos'], self.empty_pos = self.empty_pos, piece['current_pos']
                     if self.click_sound:
                         self.click_sound.play()
-                    if self.check_win():
+                    solved = self.check_win()
+                    if self.telemetry:
+                        self.telemetry.record(telemetry.MOVE, x, y, int(solved))
+                    if solved:
                         if self.win_sound:
                             self.win_sound.play()
-                    break
+                    return (x, y)  # Posizione della tessera spostata
+        return None
 
     def is_adjacent(self, pos1, pos2):
         return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1]) == 1
@@ -147,32 +166,16 @@ class PuzzleGame:
     def check_win(self):
         return all(piece['current_pos'] == piece['correct_pos'] for piece in self.pieces)
 
-    def is_solvable(self):
-        inversions = 0
-        one_d_pieces = []
+    def correct_count(self):
+        return sum(piece['current_pos'] == piece['correct_pos'] for piece in self.pieces)
 
-        for row in range(self.rows):
-            for col in range(self.cols):
-                if (col, row) != self.empty_pos:
-                    one_d_pieces.append(
-                        self.pieces[row * self.cols + col]['current_pos'][1] * self.cols +
-                        self.pieces[row * self.cols + col]['current_pos'][0]
-                    )
-
-        for i in range(len(one_d_pieces)):
-            for j in range(i + 1, len(one_d_pieces)):
-                if one_d_pieces[i] > one_d_pieces[j]:
-                    inversions += 1
-
-        if self.cols % 2 == 1:
-            return inversions % 2 == 0
-        else:
-            empty_row_from_bottom = self.rows - self.empty_pos[1]
-            return (inversions + empty_row_from_bottom) % 2 == 1
+    def is_solvable(self):
+        positions = [piece['current_pos'] for piece in self.pieces]
+        return daily.is_solvable(positions, self.rows, self.cols, self.empty_pos)
 
 # Classe principale per gestire la logica del puzzle e l'interfaccia utente
 class Puzzle:
-    def __init__(self, screen, font, clock, user):
+    def __init__(self, screen, font, clock, user, race=None, challenge=None, image_dir=None):
         self.screen = screen
         self.font = font
         self.clock = clock
@@ -186,7 +189,18 @@ class Puzzle:
         self.elapsed_time = 0
         self.start_time = None
         self.db = Database()
+        self.telemetry = None
+        self.race = race  # Client della gara (opzionale): la partita parte quando arriva il seme
+        self.opponents = {}  # Giocatori della gara: posto -> [nome, tessere al posto giusto, posizione d'arrivo]
+        self.challenge = challenge  # Sfida giornaliera (opzionale): (giorno, difficoltà, posizioni delle tessere)
+        self.image_dir = image_dir  # Cartella delle tessere di un'immagine caricata (opzionale)
+        self.tiles = {}  # Difficoltà -> tessere già tagliate
         self.load_assets()
+        if challenge:
+            _, self.difficulty, positions = challenge
+            rows, cols = GRID_SIZES[self.difficulty]
+            self.initialize_puzzle(self.difficulty, rows, cols, layout=positions)
+            self.game_started = True
 
     def load_assets(self):
         self.background_image = pygame.transform.scale(load_image("assets/games/background.jpg"), (700, 700))
@@ -195,6 +209,8 @@ class Puzzle:
             "medium": pygame.transform.scale(load_image("assets/games/puzzle_image_medium.jpg"), (400, 400)),
             "hard": pygame.transform.scale(load_image("assets/games/puzzle_image_hard.jpg"), (400, 400))
         }
+        if self.image_dir:
+            self.load_uploaded_image()
         self.click_sound = pygame.mixer.Sound("assets/games/click_sound.wav")
         self.win_sounds = {
             "easy": pygame.mixer.Sound("assets/games/win_sound_easy.wav"),
@@ -210,18 +226,33 @@ class Puzzle:
         self.exit_button = Button(pygame.transform.scale(load_image("assets/games/exit_button.png"), (60, 35)), (510, 570))
         self.back_button = Button(pygame.transform.scale(load_image("assets/games/back_button.png"), (50, 40)), (130, 570))
 
-    def update_best_time_text(self):
+    def load_uploaded_image(self):
+        # Immagine e tessere già alla risoluzione finale: si caricano e si disegnano senza scalare
+        manifest = uploads.read_manifest(self.image_dir)
+        image = load_image(os.path.join(self.image_dir, manifest['image'])).convert()
+        for difficulty, grid in manifest['grids'].items():
+            self.puzzle_images[difficulty] = image
+            self.tiles[difficulty] = [load_image(os.path.join(self.image_dir, *name.split('/'))).convert()
+                                      for name in grid['tiles']]
+
+    def update_best_time_text(self, reload=True):
         if self.difficulty:
-            self.best_time = self.db.load_best_record(self.user, self.difficulty)
+            if reload:
+                # Il database si interroga solo al cambio di difficoltà e dopo una vittoria, mai a ogni frame
+                self.best_time = self.db.load_best_record(self.user, self.difficulty)
             if self.best_time:
                 self.best_time_text = f"Tempo: {self.elapsed_time} s Miglior record: {self.best_time['time']} s Utente: {self.best_time['user']}"
             else:
                 self.best_time_text = f"Tempo: {self.elapsed_time} s Nessun record precedente"
 
-    def initialize_puzzle(self, difficulty, rows, cols):
+    def initialize_puzzle(self, difficulty, rows, cols, rng=None, layout=None):
         print(f"Inizializzazione del puzzle con difficoltà: {difficulty}")
         image = self.puzzle_images[difficulty]
-        self.puzzle = PuzzleGame(image, rows, cols, click_sound=self.click_sound, win_sound=self.win_sounds[difficulty])
+        if self.telemetry:
+            self.telemetry.close()
+        self.telemetry = telemetry.TelemetryClient('puzzle', self.user, difficulty)  # Una sessione per partita
+        self.puzzle = PuzzleGame(image, rows, cols, click_sound=self.click_sound, win_sound=self.win_sounds[difficulty],
+                                 telemetry=self.telemetry, rng=rng, layout=layout, tiles=self.tiles.get(difficulty))
         self.start_time = time.time()  # Registra il tempo di inizio del gioco
         self.elapsed_time = 0  # Tempo trascorso
         self.update_best_time_text()  # Aggiorna il miglior record per la nuova difficoltà
@@ -256,8 +287,13 @@ class Puzzle:
                     self.win_sounds[self.difficulty].play()
                     self.win_animation = True
                     self.game_started = False
-                    self.db.save_record(self.elapsed_time, self.user, self.difficulty)
+                    if self.challenge:
+                        self.db.save_daily_record(self.challenge[0], self.elapsed_time, self.user, self.difficulty)
+                    else:
+                        self.db.save_record(self.elapsed_time, self.user, self.difficulty)
                     self.update_best_time_text()  # Aggiorna il miglior record al termine del gioco
+                    if self.race:
+                        self.race.finish((time.time() - self.start_time) * 1000)
 
             # Mostra i pulsanti "Start", "Back" ed "Exit" quando il gioco è finito
             self.start_button.draw(self.screen)
@@ -278,8 +314,44 @@ class Puzzle:
                 self.medium_button.draw(self.screen)
                 self.hard_button.draw(self.screen)
 
+        if self.race:
+            self.draw_race_status()
+
         pygame.display.flip()  # Aggiorna il display
 
+    def draw_race_status(self):
+        # Avanzamento dei giocatori della gara (compreso il proprio) sotto il miglior record
+        lines = [] if self.opponents else ["In attesa degli avversari..."]
+        total = len(self.puzzle.pieces) if self.game_started or self.win_animation else 0
+        for name, correct, place in self.opponents.values():
+            status = f"arrivato {place}°" if place else f"{correct}/{total} tessere"
+            lines.append(f"{name}: {status}")
+        for index, line in enumerate(lines):
+            self.screen.blit(self.font.render(line, True, (255, 255, 255)), (10, 45 + index * 20))
+
+    def handle_race_events(self):
+        # Messaggi arrivati dal server della gara dall'ultimo frame (non blocca mai)
+        for event in self.race.poll():
+            if event[0] == 'start':
+                _, seed, _, difficulty, players = event
+                self.difficulty = difficulty
+                rows, cols = GRID_SIZES[difficulty]
+                self.initialize_puzzle(difficulty, rows, cols, rng=random.Random(seed))
+                self.game_started = True
+                self.opponents = {slot: [name, 0, None] for slot, name in players}
+            elif event[0] == 'tick':
+                for slot, _, _, _, correct in event[2]:
+                    if slot in self.opponents:
+                        self.opponents[slot][1] = correct
+            elif event[0] == 'result':
+                _, slot, _, place = event
+                if slot in self.opponents:
+                    self.opponents[slot][2] = place
+            elif event[0] == 'leave':
+                self.opponents.pop(event[1], None)
+            elif event[0] == 'error':
+                print(f"Errore nella gara: {event[1]}")
+
     def run(self):
         # Ciclo principale del gioco
         running = True
@@ -289,9 +361,18 @@ class Puzzle:
                     running = False
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     print(f"Click del mouse alla posizione {event.pos}")
+                    if self.race or self.challenge:
+                        # In gara e nella sfida la plancia arriva dal server: resta solo il pulsante Exit
+                        if self.exit_button.click(event):
+                            running = False
+                        elif self.game_started:
+                            moved = self.puzzle.handle_click(event.pos)
+                            if moved and self.race:
+                                self.race.progress(race_protocol.MOVE, *moved, self.puzzle.correct_count())
+                        continue
                     if self.start_button.click(event):
                         if self.difficulty:
-                            rows, cols = (3, 3) if self.difficulty == "easy" else (4, 4) if self.difficulty == "medium" else (5, 5)
+                            rows, cols = GRID_SIZES[self.difficulty]
                             self.initialize_puzzle(self.difficulty, rows, cols)
                             self.game_started = True
                         else:
@@ -319,17 +400,23 @@ class Puzzle:
                     if self.game_started:
                         self.puzzle.handle_click(event.pos)
 
+            if self.race:
+                self.handle_race_events()
             if self.game_started:
                 self.elapsed_time = int(time.time() - self.start_time)  # Aggiorna il tempo trascorso
-                self.update_best_time_text()  # Aggiorna il testo del miglior tempo
+                self.update_best_time_text(reload=False)  # Aggiorna il testo con il miglior tempo già letto
             self.draw_game_screen()
 
             self.clock.tick(60)  # Limita il frame rate a 60 FPS
         pygame.quit()  # Chiude Pygame
+        if self.telemetry:
+            self.telemetry.close()  # Invia gli ultimi eventi
+        if self.race:
+            self.race.close()
         self.db.close()  # Chiude la connessione al database
 
 # Funzione principale per avviare il gioco
-def start_game(user):
+def start_game(user, race=None, challenge=None, image_dir=None):
     pygame.init()  # Inizializza Pygame
     screen_width, screen_height = 700, 700
     screen = pygame.display.set_mode((screen_width, screen_height))  # Imposta le dimensioni della finestra
@@ -338,13 +425,29 @@ def start_game(user):
     font = pygame.font.Font(None, 24)  # Crea un oggetto Font
     clock = pygame.time.Clock()  # Crea un oggetto Clock
 
-    game = Puzzle(screen, font, clock, user)  # Crea un'istanza della classe Puzzle
+    game = Puzzle(screen, font, clock, user, race=race, challenge=challenge, image_dir=image_dir)  # Crea un'istanza della classe Puzzle
     game.run()  # Avvia il ciclo principale del gioco
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Uso: python puzzle.py <username>")
+    # Gara: python puzzle.py <username> --race <difficoltà> [stanza]
+    # Sfida giornaliera: python puzzle.py <username> --daily <difficoltà>
+    # Immagine caricata: python puzzle.py <username> --image <id>
+    if len(sys.argv) == 2:
+        start_game(sys.argv[1])
+    elif len(sys.argv) == 4 and sys.argv[2] == '--image' and uploads.is_image_id(sys.argv[3]):
+        image_dir = uploads.fetch_tiles(sys.argv[3])
+        if image_dir is None:
+            sys.exit(1)
+        start_game(sys.argv[1], image_dir=image_dir)
+    elif len(sys.argv) in (4, 5) and sys.argv[2] == '--race' and sys.argv[3] in GRID_SIZES:
+        room = sys.argv[4] if len(sys.argv) == 5 else ''
+        start_game(sys.argv[1], race=RaceClient('puzzle', sys.argv[3], sys.argv[1], room).start())
+    elif len(sys.argv) == 4 and sys.argv[2] == '--daily' and sys.argv[3] in GRID_SIZES:
+        board = daily.fetch_board('puzzle', sys.argv[3])
+        if board is None:
+            sys.exit(1)
+        day, values = board
+        start_game(sys.argv[1], challenge=(day, sys.argv[3], daily.puzzle_positions(values, sys.argv[3])))
+    else:
+        print("Uso: python puzzle.py <username> [--race easy|medium|hard [stanza] | --daily easy|medium|hard | --image id]")
         sys.exit(1)
-
-    user = sys.argv[1]
-    start_game(user)  # Avvia il gioco con il nome utente specificato
@@ -0,0 +1,130 @@
+import ssl
+import queue
+import socket
+import threading
+import urllib.parse
+import config
+from race_protocol import (
+    PROGRESS, FINISH, PROGRESS_MESSAGE, FINISH_MESSAGE, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG,
+    ProtocolError, accept_key, new_key, encode_join, encode_masked_frame, decode, read_frame_blocking,
+)
+
+# Client delle gare per i giochi desktop. La rete gira in due thread (lettura e scrittura):
+# il ciclo di gioco a 60 FPS non aspetta mai il socket, accoda i propri avanzamenti
+# e a ogni frame raccoglie con poll() i messaggi arrivati nel frattempo.
+
+HEARTBEAT_INTERVAL = 30.0  # Ping se non si è inviato nulla per (s)
+
+class RaceClient:
+    def __init__(self, game, difficulty, user, room='', url=None, token=None):
+        self.game = game
+        self.difficulty = difficulty
+        self.user = user
+        self.room = room
+        self.url = url or config.RACE_URL
+        self.token = config.RACE_TOKEN if token is None else token
+        self.incoming = queue.SimpleQueue()  # Eventi già decodificati per il ciclo di gioco
+        self.outgoing = queue.SimpleQueue()  # Frame pronti da inviare
+        self.sock = None
+        self.closed = False
+        self._reader = None
+        self._writer = None
+
+    def start(self):
+        self._reader = threading.Thread(target=self._run, name='race-reader', daemon=True)
+        self._reader.start()
+        return self
+
+    def _connect(self):
+        parts = urllib.parse.urlsplit(self.url)
+        secure = parts.scheme == 'wss'
+        port = parts.port or (443 if secure else 80)
+        sock = socket.create_connection((parts.hostname, port), timeout=10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Messaggi piccoli: niente attesa di Nagle
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+        key = new_key()
+        sock.sendall((
+            f'GET {parts.path or "/"} HTTP/1.1\r\n'
+            f'Host: {parts.netloc}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'
+        ).encode('latin-1'))
+        stream = sock.makefile('rb')
+        status = stream.readline()
+        headers = {}
+        while True:
+            line = stream.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if b' 101 ' not in status or headers.get('sec-websocket-accept') != accept_key(key):
+            raise ProtocolError(f"Handshake WebSocket rifiutato: {status.decode('latin-1').strip()}")
+        sock.settimeout(None)
+        return sock, stream
+
+    def _run(self):
+        try:
+            self.sock, stream = self._connect()
+            self.sock.sendall(encode_masked_frame(OP_BINARY, encode_join(self.game, self.difficulty, self.room,
+                                                                         self.token, self.user)))
+            self._writer = threading.Thread(target=self._send_loop, name='race-writer', daemon=True)
+            self._writer.start()
+            while True:
+                opcode, payload = read_frame_blocking(stream, 1 << 16)
+                if opcode == OP_BINARY:
+                    self.incoming.put(decode(payload))
+                elif opcode == OP_PING:
+                    self.outgoing.put(encode_masked_frame(OP_PONG, payload))
+                elif opcode == OP_CLOSE:
+                    break
+        except (OSError, EOFError, ProtocolError, ValueError) as e:
+            if not self.closed:
+                self.incoming.put(('error', str(e)))
+        finally:
+            self.incoming.put(('closed',))
+            self.outgoing.put(None)
+
+    def _send_loop(self):
+        while True:
+            try:
+                frame = self.outgoing.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                frame = encode_masked_frame(OP_PING, b'')  # Il server chiude le connessioni inattive
+            if frame is None:
+                return
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                return
+
+    def poll(self):
+        """Tutti i messaggi arrivati dall'ultima chiamata, senza bloccare."""
+        events = []
+        while True:
+            try:
+                events.append(self.incoming.get_nowait())
+            except queue.Empty:
+                return events
+
+    def progress(self, kind, x, y, value):
+        self.outgoing.put(encode_masked_frame(OP_BINARY, PROGRESS_MESSAGE.pack(PROGRESS, kind, x, y, min(value, 0xFFFF))))
+
+    def finish(self, elapsed_ms):
+        self.outgoing.put(encode_masked_frame(OP_BINARY, FINISH_MESSAGE.pack(FINISH, int(elapsed_ms))))
+
+    def close(self):
+        self.closed = True
+        self.outgoing.put(encode_masked_frame(OP_CLOSE, (1000).to_bytes(2, 'big')))
+        self.outgoing.put(None)
+        if self._writer is not None:
+            self._writer.join(1.0)
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
@@ -0,0 +1,191 @@
+import os
+import base64
+import struct
+import hashlib
+
+# Protocollo delle gare in tempo reale: messaggi binari di dimensione fissa dentro
+# frame WebSocket (RFC 6455, solo frame binari). Usato dal server (race_server.py),
+# dal client dei giochi desktop (race_client.py) e dal benchmark (bench/race_load.py).
+
+GAMES = ('memory', 'puzzle')
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+# Client -> server
+JOIN = 1      # gioco, difficoltà, stanza, token, utente
+PROGRESS = 2  # tipo, x, y, avanzamento (tessere al posto giusto o coppie trovate)
+FINISH = 3    # tempo in ms
+# Server -> client
+START = 10    # seme del mescolamento e giocatori
+TICK = 11     # avanzamenti di tutti i giocatori raccolti in un tick
+RESULT = 12   # arrivo di un giocatore: posizione e tempo
+LEAVE = 13    # un giocatore ha lasciato la stanza
+ERROR = 14    # messaggio d'errore, poi la connessione si chiude
+
+# Tipi di avanzamento
+MOVE = 1
+FLIP = 2
+MATCH = 3
+
+JOIN_HEADER = struct.Struct('<BBBBH')  # tipo, gioco, difficoltà, lunghezza stanza, lunghezza token
+PROGRESS_MESSAGE = struct.Struct('<BBBBH')  # tipo, tipo di avanzamento, x, y, avanzamento
+FINISH_MESSAGE = struct.Struct('<BI')
+START_HEADER = struct.Struct('<BIBBB')  # tipo, seme, gioco, difficoltà, numero di giocatori
+TICK_HEADER = struct.Struct('<BHB')  # tipo, numero del tick, numero di voci
+TICK_ENTRY = struct.Struct('<BBBBH')  # posto, tipo di avanzamento, x, y, avanzamento
+RESULT_MESSAGE = struct.Struct('<BBIB')  # tipo, posto, tempo in ms, posizione d'arrivo
+LEAVE_MESSAGE = struct.Struct('<BB')
+
+def pack_name(name, limit=255):
+    data = name.encode('utf-8')[:limit]
+    return bytes((len(data),)) + data
+
+def unpack_name(data, offset):
+    length = data[offset]
+    return bytes(data[offset + 1:offset + 1 + length]).decode('utf-8', 'replace'), offset + 1 + length
+
+def encode_join(game, difficulty, room, token, user):
+    room_data = room.encode('utf-8')[:255]
+    token_data = token.encode('utf-8')
+    return b''.join((JOIN_HEADER.pack(JOIN, GAMES.index(game), DIFFICULTIES.index(difficulty), len(room_data),
+                                      len(token_data)), room_data, token_data, pack_name(user)))
+
+def decode_join(data):
+    """Restituisce (gioco, difficoltà, stanza, token, utente); ValueError se malformato."""
+    try:
+        _, game, difficulty, room_length, token_length = JOIN_HEADER.unpack_from(data)
+        offset = JOIN_HEADER.size
+        room = bytes(data[offset:offset + room_length]).decode('utf-8')
+        offset += room_length
+        token = bytes(data[offset:offset + token_length]).decode('utf-8')
+        offset += token_length
+        user, offset = unpack_name(data, offset)
+        if offset > len(data):
+            raise ValueError("Messaggio troncato")
+        return GAMES[game], DIFFICULTIES[difficulty], room, token, user
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Messaggio JOIN non valido: {e}")
+
+def encode_start(seed, game, difficulty, players):
+    """players: lista di (posto, nome)."""
+    parts = [START_HEADER.pack(START, seed, GAMES.index(game), DIFFICULTIES.index(difficulty), len(players))]
+    for slot, name in players:
+        parts += [bytes((slot,)), pack_name(name)]
+    return b''.join(parts)
+
+def encode_error(message):
+    return bytes((ERROR,)) + message.encode('utf-8')
+
+def decode(data):
+    """Decodifica un messaggio del server in una tupla (nome, ...)."""
+    kind = data[0]
+    if kind == TICK:
+        _, tick, count = TICK_HEADER.unpack_from(data)
+        entries = [TICK_ENTRY.unpack_from(data, TICK_HEADER.size + i * TICK_ENTRY.size) for i in range(count)]
+        return ('tick', tick, entries)
+    if kind == START:
+        _, seed, game, difficulty, count = START_HEADER.unpack_from(data)
+        offset = START_HEADER.size
+        players = []
+        for _ in range(count):
+            slot = data[offset]
+            name, offset = unpack_name(data, offset + 1)
+            players.append((slot, name))
+        return ('start', seed, GAMES[game], DIFFICULTIES[difficulty], players)
+    if kind == RESULT:
+        _, slot, ms, place = RESULT_MESSAGE.unpack_from(data)
+        return ('result', slot, ms, place)
+    if kind == LEAVE:
+        return ('leave', data[1])
+    if kind == ERROR:
+        return ('error', bytes(data[1:]).decode('utf-8', 'replace'))
+    return ('unknown', kind)
+
+# --- WebSocket ---------------------------------------------------------------
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+class ProtocolError(Exception):
+    """Frame WebSocket non valido o troppo grande."""
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + WEBSOCKET_GUID).digest()).decode('ascii')
+
+def new_key():
+    return base64.b64encode(os.urandom(16)).decode('ascii')
+
+def frame_header(opcode, length, masked=False):
+    first = 0x80 | opcode  # FIN: i messaggi non vengono mai frammentati
+    mask_bit = 0x80 if masked else 0
+    if length < 126:
+        return struct.pack('!BB', first, mask_bit | length)
+    if length < 65536:
+        return struct.pack('!BBH', first, mask_bit | 126, length)
+    return struct.pack('!BBQ', first, mask_bit | 127, length)
+
+def encode_frame(opcode, payload):
+    """Frame del server (i frame del server non sono mascherati)."""
+    return frame_header(opcode, len(payload)) + payload
+
+def unmask(payload, mask):
+    """XOR con la chiave di 4 byte (mascherare e smascherare sono la stessa operazione)."""
+    length = len(payload)
+    if not length:
+        return b''
+    # Tutto il payload in un'unica operazione sugli interi invece che byte per byte
+    key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+    return (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+
+def encode_masked_frame(opcode, payload):
+    """Frame del client: il payload va mascherato con una chiave casuale."""
+    mask = os.urandom(4)
+    return frame_header(opcode, len(payload), masked=True) + mask + unmask(payload, mask)
+
+def parse_frame_header(first, second):
+    """Restituisce (fin, opcode, mascherato, lunghezza o 126/127 se estesa)."""
+    return bool(first & 0x80), first & 0x0F, bool(second & 0x80), second & 0x7F
+
+async def read_frame(reader, max_size):
+    """Legge un frame da uno StreamReader asyncio: (opcode, payload)."""
+    first, second = await reader.readexactly(2)
+    fin, opcode, masked, length = parse_frame_header(first, second)
+    if not fin or opcode == OP_CONTINUATION:
+        raise ProtocolError("Messaggi frammentati non supportati")
+    if length < 126:
+        # Caso comune (messaggi di pochi byte): chiave e payload con una sola lettura
+        if not masked:
+            return opcode, await reader.readexactly(length)
+        data = await reader.readexactly(4 + length)
+        return opcode, unmask(data[4:], data[:4])
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    else:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > max_size:
+        raise ProtocolError(f"Frame di {length} byte oltre il limite di {max_size}")
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    return opcode, unmask(payload, mask) if masked else payload
+
+def read_frame_blocking(stream, max_size):
+    """Come read_frame ma da un file di socket bloccante (client desktop)."""
+    header = stream.read(2)
+    if len(header) < 2:
+        raise EOFError("Connessione chiusa")
+    fin, opcode, masked, length = parse_frame_header(header[0], header[1])
+    if length == 126:
+        length = struct.unpack('!H', stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', stream.read(8))[0]
+    if length > max_size:
+        raise ProtocolError(f"Frame di {length} byte oltre il limite di {max_size}")
+    mask = stream.read(4) if masked else None
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise EOFError("Connessione chiusa")
+    return opcode, unmask(payload, mask) if masked else payload
@@ -0,0 +1,307 @@
+import os
+import sys
+import hmac
+import random
+import asyncio
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+import config
+from sessions import load_secret_key
+from race_protocol import (
+    JOIN, PROGRESS, FINISH, TICK, RESULT, LEAVE, PROGRESS_MESSAGE, FINISH_MESSAGE, TICK_HEADER, TICK_ENTRY,
+    RESULT_MESSAGE, LEAVE_MESSAGE, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG, ProtocolError,
+    accept_key, decode_join, encode_start, encode_error, encode_frame, frame_header, read_frame,
+)
+
+try:
+    import uvloop  # Opzionale: ciclo di eventi più veloce
+except ImportError:
+    uvloop = None
+
+# Server delle gare in tempo reale: più giocatori sulla stessa plancia (stesso seme per
+# PuzzleGame.shuffle_pieces o memory.create_grid) vedono l'avanzamento degli avversari.
+# Un solo processo asyncio regge migliaia di stanze: gli avanzamenti ricevuti durante un
+# tick vengono scritti in un buffer preallocato della stanza e inviati a tutti con un solo
+# frame per stanza e per tick, lo stesso oggetto bytes per ogni destinatario.
+#
+#   python race_server.py
+#   RACE_BIND=127.0.0.1:8765 RACE_ROOM_SIZE=4 python race_server.py
+
+TOKEN_SALT = 'race'
+CLOSE_FRAME = encode_frame(OP_CLOSE, (1000).to_bytes(2, 'big'))
+
+class Player:
+    __slots__ = ('slot', 'name', 'writer', 'events', 'finished', 'seen')
+
+    def __init__(self, slot, name, writer, seen):
+        self.slot = slot
+        self.name = name
+        self.writer = writer
+        self.events = 0  # Avanzamenti nel tick corrente
+        self.finished = False
+        self.seen = seen  # Ultimo messaggio ricevuto (orologio del ciclo di eventi)
+
+class Room:
+    def __init__(self, game, difficulty, name, size, events_per_tick):
+        self.game = game
+        self.difficulty = difficulty
+        self.name = name
+        self.size = size
+        self.events_per_tick = events_per_tick
+        self.players = {}  # posto -> Player
+        self.started = False
+        self.places = 0
+        self.tick = 0
+        self.count = 0
+        # Buffer del messaggio TICK, allocato una volta per la stanza
+        self.buffer = bytearray(TICK_HEADER.size + size * events_per_tick * TICK_ENTRY.size)
+
+    def free_slot(self):
+        return next(slot for slot in range(self.size) if slot not in self.players)
+
+    def add(self, player, kind, x, y, progress):
+        """Accoda un avanzamento; False se il giocatore ha superato il limite del tick."""
+        if player.events >= self.events_per_tick:
+            return False
+        player.events += 1
+        TICK_ENTRY.pack_into(self.buffer, TICK_HEADER.size + self.count * TICK_ENTRY.size, player.slot, kind, x, y, progress)
+        self.count += 1
+        return True
+
+    def take_frame(self):
+        """Frame WebSocket con gli avanzamenti del tick; il buffer torna vuoto."""
+        self.tick = (self.tick + 1) & 0xFFFF
+        TICK_HEADER.pack_into(self.buffer, 0, TICK, self.tick, self.count)
+        length = TICK_HEADER.size + self.count * TICK_ENTRY.size
+        frame = frame_header(OP_BINARY, length) + memoryview(self.buffer)[:length]
+        self.count = 0
+        for player in self.players.values():
+            player.events = 0
+        return frame
+
+def token_verifier(secret_keys, shared_token, max_age, salt=TOKEN_SALT):
+    """Funzione (token, utente dichiarato) -> utente oppure None.
+
+    Il token firmato viene da /api/race/token (sessione del sito); il token condiviso
+    serve ai giochi desktop, che dichiarano da soli il nome utente.
+    """
+    serializer = URLSafeTimedSerializer(secret_keys, salt=salt)
+
+    def verify(token, claimed):
+        if shared_token and hmac.compare_digest(token, shared_token):
+            return claimed or None
+        try:
+            return serializer.loads(token, max_age=max_age)['user']
+        except (BadSignature, KeyError, TypeError):
+            return None
+    return verify
+
+class RaceServer:
+    def __init__(self, verify, room_size=2, tick_interval=0.05, events_per_tick=8, max_frame=1024,
+                 max_write_buffer=64 * 1024, join_timeout=10.0, idle_timeout=120.0):
+        self.verify = verify
+        self.room_size = room_size
+        self.tick_interval = tick_interval
+        self.events_per_tick = events_per_tick
+        self.max_frame = max_frame
+        self.max_write_buffer = max_write_buffer  # Client più lenti di così vengono disconnessi
+        self.join_timeout = join_timeout
+        self.idle_timeout = idle_timeout
+        self.waiting = {}  # (gioco, difficoltà, stanza) -> Room in attesa di giocatori
+        self.rooms = set()  # Stanze con la gara in corso
+        self.dirty = set()  # Stanze con avanzamenti da inviare al prossimo tick
+        # Statistiche
+        self.connections = 0
+        self.messages_in = 0
+        self.frames_out = 0
+        self.dropped = 0
+        self.slow_clients = 0
+
+    async def handshake(self, reader, writer):
+        """Upgrade HTTP -> WebSocket; restituisce False (dopo aver risposto) se la richiesta non va bene."""
+        request = await reader.readuntil(b'\r\n\r\n')
+        lines = request.decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if not lines[0].startswith('GET ') or headers.get('upgrade', '').lower() != 'websocket' or not key:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        writer.write((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n'
+        ).encode('latin-1'))
+        return True
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        room = player = None
+        try:
+            if not await asyncio.wait_for(self.handshake(reader, writer), self.join_timeout):
+                return
+            opcode, payload = await asyncio.wait_for(read_frame(reader, self.max_frame), self.join_timeout)
+            if opcode != OP_BINARY or not payload or payload[0] != JOIN:
+                raise ProtocolError("Il primo messaggio deve essere JOIN")
+            game, difficulty, room_name, token, claimed = decode_join(payload)
+            user = self.verify(token, claimed)
+            if user is None:
+                writer.write(encode_frame(OP_BINARY, encode_error("Token non valido")) + CLOSE_FRAME)
+                return
+            room, player = self.join(game, difficulty, room_name, user, writer)
+
+            # Nessun timeout per messaggio (costerebbe un timer a lettura): i client inattivi
+            # li chiude sweep_idle() controllando player.seen
+            loop = asyncio.get_running_loop()
+            while True:
+                opcode, payload = await read_frame(reader, self.max_frame)
+                player.seen = loop.time()
+                self.messages_in += 1
+                if opcode == OP_BINARY and payload:
+                    kind = payload[0]
+                    if kind == PROGRESS and room.started and len(payload) == PROGRESS_MESSAGE.size:
+                        _, progress_kind, x, y, progress = PROGRESS_MESSAGE.unpack(payload)
+                        if room.add(player, progress_kind, x, y, progress):
+                            self.dirty.add(room)
+                        else:
+                            self.dropped += 1
+                    elif kind == FINISH and room.started and not player.finished and len(payload) == FINISH_MESSAGE.size:
+                        _, elapsed = FINISH_MESSAGE.unpack(payload)
+                        player.finished = True
+                        room.places += 1
+                        self.broadcast(room, encode_frame(OP_BINARY, RESULT_MESSAGE.pack(RESULT, player.slot, elapsed, room.places)))
+                elif opcode == OP_PING:
+                    writer.write(encode_frame(OP_PONG, payload))
+                elif opcode == OP_CLOSE:
+                    writer.write(CLOSE_FRAME)
+                    return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError,
+                ProtocolError, ValueError):
+            pass  # Connessione chiusa o client non conforme: si esce dalla stanza
+        finally:
+            if player is not None:
+                self.leave(room, player)
+            self.connections -= 1
+            writer.close()
+
+    def join(self, game, difficulty, room_name, user, writer):
+        key = (game, difficulty, room_name)
+        room = self.waiting.get(key)
+        if room is None:
+            room = self.waiting[key] = Room(game, difficulty, room_name, self.room_size, self.events_per_tick)
+        player = Player(room.free_slot(), user, writer, asyncio.get_running_loop().time())
+        room.players[player.slot] = player
+        if len(room.players) == room.size:
+            # Stanza completa: tutti ricevono lo stesso seme e costruiscono la stessa plancia
+            del self.waiting[key]
+            room.started = True
+            self.rooms.add(room)
+            players = [(slot, p.name) for slot, p in sorted(room.players.items())]
+            self.broadcast(room, encode_frame(OP_BINARY, encode_start(random.getrandbits(32), game, difficulty, players)))
+        return room, player
+
+    def leave(self, room, player):
+        room.players.pop(player.slot, None)
+        if not room.started:
+            if not room.players:
+                self.waiting.pop((room.game, room.difficulty, room.name), None)
+            return
+        if room.players:
+            self.broadcast(room, encode_frame(OP_BINARY, LEAVE_MESSAGE.pack(LEAVE, player.slot)))
+        else:
+            self.rooms.discard(room)
+            self.dirty.discard(room)
+
+    def broadcast(self, room, frame):
+        """Invia lo stesso frame a tutti i giocatori della stanza, senza attendere i socket."""
+        for player in list(room.players.values()):
+            transport = player.writer.transport
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > self.max_write_buffer:
+                # Client che non legge: chiuderlo libera la memoria e sblocca gli altri
+                self.slow_clients += 1
+                transport.abort()
+                continue
+            player.writer.write(frame)
+            self.frames_out += 1
+
+    async def ticker(self):
+        """Un solo task per tutte le stanze: a ogni tick invia gli avanzamenti raccolti."""
+        loop = asyncio.get_running_loop()
+        next_sweep = loop.time() + 1.0
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            dirty, self.dirty = self.dirty, set()
+            for room in dirty:
+                if room.count and room.players:
+                    self.broadcast(room, room.take_frame())
+            if loop.time() >= next_sweep:
+                next_sweep = loop.time() + 1.0
+                self.sweep_idle(loop.time() - self.idle_timeout)
+
+    def sweep_idle(self, limit):
+        """Chiude i client che non inviano nulla da più di idle_timeout secondi."""
+        for room in [*self.rooms, *self.waiting.values()]:
+            for player in list(room.players.values()):
+                if player.seen < limit:
+                    player.writer.transport.abort()  # Il ciclo di lettura termina e libera il posto
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'rooms': len(self.rooms),
+            'waiting_rooms': len(self.waiting),
+            'messages_in': self.messages_in,
+            'frames_out': self.frames_out,
+            'dropped': self.dropped,
+            'slow_clients': self.slow_clients,
+        }
+
+    async def report(self, interval):
+        last = dict(self.stats())
+        while True:
+            await asyncio.sleep(interval)
+            current = self.stats()
+            if current != last:
+                rate = (current['messages_in'] - last['messages_in']) / interval
+                print(f"Gare: {current['connections']} connessioni, {current['rooms']} stanze in corso, "
+                      f"{current['waiting_rooms']} in attesa, {rate:.0f} messaggi/s ricevuti")
+            last = current
+
+async def serve(host, port, server):
+    listener = await asyncio.start_server(server.handle, host, port, backlog=config.RACE_BACKLOG)
+    print(f"Server delle gare in ascolto su {host}:{port}")
+    tasks = [asyncio.create_task(server.ticker())]
+    if config.RACE_STATS_INTERVAL > 0:
+        tasks.append(asyncio.create_task(server.report(config.RACE_STATS_INTERVAL)))
+    async with listener:
+        await listener.serve_forever()
+
+def create_server():
+    secret_key = load_secret_key(config.SECRET_KEY, config.SECRET_KEY_PATH)
+    # itsdangerous vuole le chiavi dalla più vecchia alla più recente
+    verify = token_verifier(config.SECRET_KEY_FALLBACKS + [secret_key], config.RACE_TOKEN, config.RACE_TOKEN_MAX_AGE)
+    return RaceServer(
+        verify,
+        room_size=config.RACE_ROOM_SIZE,
+        tick_interval=config.RACE_TICK_INTERVAL,
+        events_per_tick=config.RACE_EVENTS_PER_TICK,
+        max_write_buffer=config.RACE_MAX_WRITE_BUFFER,
+    )
+
+def main():
+    host, _, port = config.RACE_BIND.rpartition(':')
+    if uvloop is not None:
+        uvloop.install()
+    try:
+        asyncio.run(serve(host or '0.0.0.0', int(port), create_server()))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import bisect
+import threading
+
+# Posizione, percentile e "giocatori vicini" in tempo logaritmico.
+# I migliori tempi sono raggruppati in bucket di ampiezza fissa; un albero di Fenwick
+# conta i giocatori per bucket e, dentro ogni bucket, una lista ordinata risolve l'ordine esatto.
+
+class FenwickTree:
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, index, delta):
+        index += 1
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix(self, index):
+        """Somma dei conteggi dei bucket 0..index compresi."""
+        total = 0
+        index += 1
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def find(self, k):
+        """Primo bucket in cui la somma cumulata raggiunge k (k parte da 1)."""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            following = position + step
+            if following <= self.size and self.tree[following] < k:
+                position = following
+                k -= self.tree[following]
+            step >>= 1
+        return position  # Indice del bucket (base 0)
+
+class RankIndex:
+    """Indice d'ordine dei migliori tempi per un gioco e una difficoltà."""
+    def __init__(self, resolution=0.1, max_time=3600.0):
+        self.resolution = resolution
+        self.buckets = int(max_time / resolution) + 1
+        self.tree = FenwickTree(self.buckets)
+        self.members = {}  # bucket -> [(tempo, utente)] ordinata
+        self.best = {}  # utente -> tempo
+
+    def _bucket(self, record_time):
+        return min(max(int(record_time / self.resolution), 0), self.buckets - 1)
+
+    def update(self, user, record_time):
+        """Registra un tempo; viene ignorato se non migliora quello dell'utente."""
+        current = self.best.get(user)
+        if current is not None:
+            if record_time >= current:
+                return False
+            bucket = self._bucket(current)
+            entries = self.members[bucket]
+            del entries[bisect.bisect_left(entries, (current, user))]
+            self.tree.add(bucket, -1)
+        bucket = self._bucket(record_time)
+        bisect.insort(self.members.setdefault(bucket, []), (record_time, user))
+        self.tree.add(bucket, 1)
+        self.best[user] = record_time
+        return True
+
+    def rank_of_time(self, record_time):
+        """1 + numero di giocatori con un tempo strettamente migliore."""
+        bucket = self._bucket(record_time)
+        better = self.tree.prefix(bucket - 1) if bucket > 0 else 0
+        better += bisect.bisect_left(self.members.get(bucket, ()), (record_time, ''))
+        return better + 1
+
+    def nth(self, k):
+        """k-esimo giocatore in classifica (k parte da 1): (tempo, utente)."""
+        bucket = self.tree.find(k)
+        before = self.tree.prefix(bucket - 1) if bucket > 0 else 0
+        return self.members[bucket][k - before - 1]
+
+    def position(self, user, radius=5):
+        """Posizione, totale, percentile e giocatori vicini, oppure None se l'utente non ha record."""
+        record_time = self.best.get(user)
+        if record_time is None:
+            return None
+        total = len(self.best)
+        bucket = self._bucket(record_time)
+        entries = self.members[bucket]
+        before = self.tree.prefix(bucket - 1) if bucket > 0 else 0
+        rank = before + bisect.bisect_left(entries, (record_time, '')) + 1
+        order = before + bisect.bisect_left(entries, (record_time, user)) + 1  # Posizione senza pari merito
+        around = []
+        for k in range(max(1, order - radius), min(total, order + radius) + 1):
+            other_time, other = self.nth(k)
+            around.append({'rank': self.rank_of_time(other_time), 'user': other, 'time': other_time})
+        return {
+            'user': user,
+            'time': record_time,
+            'rank': rank,
+            'total': total,
+            'percentile': round(100.0 * (total - rank + 1) / total, 2),
+            'around': around,
+        }
+
+class RankService:
+    """Indici per gioco e difficoltà, aggiornati dagli stessi eventi delle classifiche."""
+    def __init__(self, leaderboards, resolution=0.1, max_time=3600.0):
+        self.leaderboards = leaderboards
+        self.indexes = {key: RankIndex(resolution, max_time) for key in leaderboards.boards}
+        self._lock = threading.Lock()
+        leaderboards.listeners.append(self.on_improvement)
+
+    def on_improvement(self, game, difficulty, user, record_time, date):
+        index = self.indexes.get((game, difficulty))
+        if index is not None:
+            with self._lock:
+                index.update(user, record_time)
+
+    def position(self, game, difficulty, user, radius=5):
+        index = self.indexes.get((game, difficulty))
+        if index is None:
+            raise KeyError((game, difficulty))
+        self.leaderboards.refresh(game)
+        with self._lock:
+            return index.position(user, radius)
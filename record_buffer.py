@@ -0,0 +1,225 @@
+import os
+import json
+import threading
+import time
+from collections import deque
+import record_store
+
+# Buffer write-behind per i risultati delle partite: le richieste accodano i record
+# e un thread li scrive con INSERT multi-riga al raggiungimento di una soglia
+# di dimensione o di tempo. In chiusura il buffer viene svuotato; quello che non
+# si riesce a scrivere finisce in un file JSONL che viene riletto al riavvio; lo stesso
+# vale per un lotto che fallisce max_attempts volte di seguito, così non blocca gli altri.
+# Le righe illeggibili del file (es. troncate da un crash) si spostano in <file>.bad.
+
+class BufferFull(Exception):
+    """Il buffer è pieno: il client deve riprovare più tardi."""
+
+class WriteBehindBuffer:
+    def __init__(self, connect, max_size=10000, batch_size=500, flush_interval=1.0, spill_path=None, on_flush=None,
+                 max_attempts=5):
+        self.connect = connect  # Funzione gioco -> connessione (o None)
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.on_flush = on_flush  # Chiamata con (gioco, righe) dopo ogni scrittura riuscita
+        self.max_attempts = max_attempts  # Tentativi di un lotto prima di spostarlo nel file di spill
+        self._pending = deque()  # Elementi (gioco, (tempo, data, utente, difficoltà))
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        # Statistiche
+        self.flushed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failures = 0
+        self.spilled = 0
+
+    def start(self):
+        """Avvia il thread di scrittura (dopo l'eventuale fork) e rilegge i record salvati su file."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='record-buffer', daemon=True)
+            self._thread.start()
+        self._replay_spill()
+
+    def add(self, records):
+        """Accoda una lista di (gioco, riga): tutti o nessuno, BufferFull se non c'è spazio."""
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            if len(self._pending) + len(records) > self.max_size:
+                self.rejected += len(records)
+                raise BufferFull(f"Buffer pieno ({len(self._pending)} record in attesa).")
+            self._pending.extend(records)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _take_batch(self):
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            batch.append(self._pending.popleft())
+        return batch
+
+    def _run(self):
+        attempts = 0  # Tentativi falliti di seguito per il lotto in testa
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+                batch = self._take_batch()
+            if not batch or self._write(batch):
+                attempts = 0
+                continue
+            attempts += 1
+            if attempts >= self.max_attempts:
+                # Il lotto continua a fallire: va nel file di spill (riletto al riavvio)
+                print(f"Lotto di {len(batch)} record non scritto dopo {attempts} tentativi: spostato nel file di spill")
+                self._spill(batch)
+                attempts = 0
+                continue
+            # Scrittura fallita: i record tornano in testa e si riprova al prossimo giro
+            with self._cond:
+                self._pending.extendleft(reversed(batch))
+            time.sleep(self.flush_interval)
+
+    def _write(self, batch):
+        """Scrive un lotto raggruppando per gioco; restituisce False se qualcosa è fallito."""
+        by_game = {}
+        for game, row in batch:
+            by_game.setdefault(game, []).append(row)
+        failed = []
+        for game, rows in by_game.items():
+            connection = self.connect(game)
+            if connection is None:
+                failed.append(game)
+                continue
+            try:
+                with connection.cursor() as cursor:
+                    # pymysql trasforma executemany su INSERT ... VALUES in un'unica INSERT multi-riga
+                    record_store.save_records(cursor, rows)
+                connection.commit()
+            except Exception as e:  # Il thread di scrittura non deve mai morire
+                print(f"Errore nella scrittura dei record di {game}: {e}")
+                failed.append(game)
+                continue
+            finally:
+                connection.close()
+            self.flushed += len(rows)
+            self.batches += 1
+            if self.on_flush is not None:
+                try:
+                    self.on_flush(game, rows)
+                except Exception as e:  # I record sono già scritti: l'errore di chi ascolta non li deve ritentare
+                    print(f"Errore nell'aggiornamento dopo la scrittura dei record di {game}: {e}")
+        if failed:
+            self.failures += 1
+            # Solo i giochi non scritti vanno ritentati
+            batch[:] = [(game, row) for game, row in batch if game in failed]
+            return False
+        return True
+
+    def close(self):
+        """Ferma il thread e scrive tutto ciò che resta; il resto va nel file di spill."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        with self._cond:
+            remaining = list(self._pending)
+            self._pending.clear()
+            self._thread = None
+        while remaining:
+            batch = remaining[:self.batch_size]
+            del remaining[:self.batch_size]
+            if not self._write(batch):
+                self._spill(batch + remaining)
+                break
+
+    def _spill(self, records):
+        if not self.spill_path:
+            print(f"Persi {len(records)} record: nessun file di spill configurato")
+            return
+        try:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for game, row in records:
+                    f.write(json.dumps([game, list(row)], default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"Persi {len(records)} record: impossibile scrivere {self.spill_path}: {e}")
+            return
+        self.spilled += len(records)
+
+    def _replay_spill(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        replay_path = f"{self.spill_path}.{os.getpid()}.replay"
+        try:
+            os.replace(self.spill_path, replay_path)  # Un solo processo riprende il file
+        except FileNotFoundError:
+            return
+        records, bad = [], []
+        try:
+            with open(replay_path, 'rb') as f:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        game, row = json.loads(line.decode('utf-8'))
+                        records.append((game, tuple(row)))
+                    except (ValueError, TypeError) as e:
+                        # Riga troncata o corrotta (es. crash durante la scrittura): le altre si riprendono
+                        print(f"Riga {number} di {self.spill_path} non valida: {e}")
+                        bad.append(line if line.endswith(b'\n') else line + b'\n')
+        except OSError as e:
+            print(f"Impossibile rileggere {replay_path}: {e}")
+            self._restore_replay(replay_path)
+            return
+        if bad:
+            try:
+                with open(f"{self.spill_path}.bad", 'ab') as f:
+                    f.writelines(bad)
+            except OSError as e:
+                print(f"Impossibile salvare le righe non valide in {self.spill_path}.bad: {e}")
+                self._restore_replay(replay_path)
+                return
+        with self._cond:
+            self._pending.extend(records)
+            self._cond.notify()
+        os.remove(replay_path)
+
+    def _restore_replay(self, replay_path):
+        """Rimette il file da riprendere al posto dello spill, se nel frattempo non ne è nato un altro."""
+        try:
+            if not os.path.exists(self.spill_path):
+                os.replace(replay_path, self.spill_path)
+                return
+        except OSError:
+            pass
+        print(f"Record da riprendere rimasti in {replay_path}")
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'max_size': self.max_size,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'rejected': self.rejected,
+            'failures': self.failures,
+            'spilled': self.spilled,
+        }
@@ -0,0 +1,68 @@
+import config
+
+# Istruzioni SQL condivise per i risultati delle partite:
+#  - records è lo storico, in sola aggiunta (una riga per partita)
+#  - best_records ha una riga per (utente, difficoltà) con il miglior tempo,
+#    aggiornata da un unico upsert condizionale, senza SELECT preliminare
+# Le righe hanno sempre l'ordine (tempo, data, utente, difficoltà).
+
+HISTORY_INSERT_SQL = 'INSERT INTO records (time, date, user, difficulty) VALUES (%s, %s, %s, %s)'
+
+# In MySQL gli assegnamenti sono valutati da sinistra: la data va aggiornata prima del tempo
+BEST_UPSERT_SQL = {
+    'mysql': (
+        'INSERT INTO best_records (time, date, user, difficulty) VALUES (%s, %s, %s, %s) '
+        'ON DUPLICATE KEY UPDATE date = IF(VALUES(time) < time, VALUES(date), date), '
+        'time = LEAST(time, VALUES(time))'
+    ),
+    'sqlite': (
+        'INSERT INTO best_records (time, date, user, difficulty) VALUES (%s, %s, %s, %s) '
+        'ON CONFLICT (user, difficulty) DO UPDATE SET time = excluded.time, date = excluded.date '
+        'WHERE excluded.time < best_records.time'
+    ),
+}
+
+# Sfide giornaliere (daily.py): una riga per (giorno, difficoltà, utente) con il miglior tempo
+DAILY_UPSERT_SQL = {
+    'mysql': (
+        'INSERT INTO daily_records (day, difficulty, user, time, date) VALUES (%s, %s, %s, %s, %s) '
+        'ON DUPLICATE KEY UPDATE date = IF(VALUES(time) < time, VALUES(date), date), '
+        'time = LEAST(time, VALUES(time))'
+    ),
+    'sqlite': (
+        'INSERT INTO daily_records (day, difficulty, user, time, date) VALUES (%s, %s, %s, %s, %s) '
+        'ON CONFLICT (day, difficulty, user) DO UPDATE SET time = excluded.time, date = excluded.date '
+        'WHERE excluded.time < daily_records.time'
+    ),
+}
+
+BEST_SELECT_SQL = 'SELECT time, date, user, difficulty FROM best_records WHERE user = %s AND difficulty = %s'
+
+def best_upsert_sql():
+    return BEST_UPSERT_SQL['sqlite' if config.STORAGE_BACKEND == 'sqlite' else 'mysql']
+
+def daily_upsert_sql():
+    return DAILY_UPSERT_SQL['sqlite' if config.STORAGE_BACKEND == 'sqlite' else 'mysql']
+
+def best_rows(rows):
+    """Riduce un lotto al solo miglior tempo per (utente, difficoltà)."""
+    best = {}
+    for row in rows:
+        key = (row[2], row[3])
+        if key not in best or row[0] < best[key][0]:
+            best[key] = row
+    return list(best.values())
+
+def save_records(cursor, rows):
+    """Aggiunge le righe allo storico e aggiorna i migliori tempi; restituisce le righe best modificate."""
+    cursor.executemany(HISTORY_INSERT_SQL, rows)
+    return cursor.executemany(best_upsert_sql(), best_rows(rows))
+
+def load_best_record(cursor, user, difficulty):
+    """Miglior tempo di un utente per una difficoltà (lettura sulla chiave primaria)."""
+    cursor.execute(BEST_SELECT_SQL, (user, difficulty))
+    return cursor.fetchone()
+
+def save_daily_record(cursor, day, difficulty, user, record_time, date):
+    """Miglior tempo di un utente nella sfida del giorno; restituisce 0 se non è migliorato."""
+    return cursor.execute(daily_upsert_sql(), (day, difficulty, user, record_time, date))
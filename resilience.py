@@ -0,0 +1,165 @@
+import time
+import random
+import threading
+import pymysql
+import config
+import storage
+
+# Accesso al database che resiste a un server lento o irraggiungibile:
+#  - timeout di connessione, lettura e scrittura (in storage.connect)
+#  - nuovi tentativi di connessione con attesa esponenziale casuale ("full jitter"), entro un
+#    budget per processo: quando il database è giù i tentativi non moltiplicano il carico
+#  - un circuit breaker per database: dopo DB_BREAKER_THRESHOLD errori di rete consecutivi
+#    ogni accesso fallisce subito con CircuitOpen per DB_BREAKER_RESET secondi, poi una sola
+#    richiesta di prova decide se richiudere il circuito.
+# CircuitOpen è un OperationalError di pymysql: il codice che già gestisce pymysql.MySQLError
+# (pagine 503, record in coda, giochi senza classifica) degrada senza modifiche.
+# Le istruzioni non si ripetono automaticamente: gli inserimenti nello storico non sono idempotenti.
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+STATE_NAMES = {CLOSED: 'closed', HALF_OPEN: 'half_open', OPEN: 'open'}
+
+# Errori di configurazione (accesso negato, database inesistente): ripetere non serve
+PERMANENT_ERRORS = {1044, 1045, 1049}
+
+class CircuitOpen(pymysql.err.OperationalError):
+    """Database considerato irraggiungibile: la richiesta fallisce senza tentare."""
+
+def is_transient(error):
+    """Errore di rete o di timeout che può risolversi da solo."""
+    if isinstance(error, CircuitOpen) or not isinstance(error, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+        return False
+    code = error.args[0] if error.args else 0
+    return code not in PERMANENT_ERRORS
+
+class CircuitBreaker:
+    def __init__(self, name, threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0  # Errori consecutivi
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+        self._lock = threading.Lock()
+        # Statistiche
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Solleva CircuitOpen se il circuito è aperto; a scadenza lascia passare una sola prova."""
+        if self.state == CLOSED:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probe_at = now
+                return
+            # Una prova senza esito (connessione mai usata) non blocca il circuito per sempre
+            if self.state == HALF_OPEN and now - self.probe_at >= self.reset_timeout:
+                self.probe_at = now
+                return
+            if self.state == CLOSED:
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_timeout - (now - self.opened_at))
+        raise CircuitOpen(0, f"Database {self.name} non disponibile, nuovo tentativo tra {retry_in:.0f} s")
+
+    def success(self):
+        if self.state == CLOSED and not self.failures:
+            return  # Caso comune senza lock
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self, error):
+        """Conta un errore; solo quelli di rete o di timeout aprono il circuito."""
+        if not is_transient(error):
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                if self.state == CLOSED:
+                    print(f"Circuit breaker aperto per {self.name}: {error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+
+    def stats(self):
+        return {'state': self.state, 'failures': self.failures, 'opened': self.opened, 'rejected': self.rejected}
+
+class RetryBudget:
+    """Token bucket dei nuovi tentativi: ogni chiamata ne aggiunge ratio, ogni ripetizione ne spende uno."""
+    def __init__(self, ratio=0.2, min_per_second=1.0, window=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = max(1.0, min_per_second * window)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        # Statistiche
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        now = time.monotonic()
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.min_per_second)
+            self.updated = now
+            if self.tokens < 1.0:
+                self.exhausted += 1
+                return False
+            self.tokens -= 1.0
+            self.retries += 1
+            return True
+
+    def stats(self):
+        return {'retries': self.retries, 'exhausted': self.exhausted, 'tokens': round(self.tokens, 2)}
+
+# Un breaker per database e un budget per processo, condivisi da app, pool e giochi
+breakers = {}
+_breakers_lock = threading.Lock()
+retry_budget = RetryBudget(ratio=config.DB_RETRY_BUDGET_RATIO, min_per_second=config.DB_RETRY_MIN_PER_SECOND)
+
+def breaker_for(database=None):
+    database = database or config.DB_NAME
+    with _breakers_lock:
+        if database not in breakers:
+            breakers[database] = CircuitBreaker(database, threshold=config.DB_BREAKER_THRESHOLD,
+                                                reset_timeout=config.DB_BREAKER_RESET)
+        return breakers[database]
+
+def call(operation, breaker, budget=retry_budget, attempts=None, base_delay=None, max_delay=None, deadline=None, check=True):
+    """Esegue operation ripetendola sugli errori di rete, con attesa casuale ed entro deadline secondi."""
+    attempts = attempts or config.DB_RETRY_ATTEMPTS
+    base_delay = config.DB_RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = config.DB_RETRY_MAX_DELAY if max_delay is None else max_delay
+    stop = time.monotonic() + (config.DB_RETRY_DEADLINE if deadline is None else deadline)
+    budget.deposit()
+    attempt = 1
+    while True:
+        if check:
+            breaker.allow()
+        try:
+            result = operation()
+        except pymysql.MySQLError as e:
+            breaker.failure(e)
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if (not is_transient(e) or attempt >= attempts or breaker.state != CLOSED
+                    or time.monotonic() + delay > stop or not budget.withdraw()):
+                raise
+            attempt += 1
+            time.sleep(delay)
+            continue
+        breaker.success()
+        return result
+
+def connect(database=None, dict_rows=True, check=True):
+    """storage.connect con nuovi tentativi e circuit breaker del database."""
+    database = database or config.DB_NAME
+    return call(lambda: storage.connect(database, dict_rows=dict_rows), breaker_for(database), check=check)
@@ -0,0 +1,186 @@
+import sys
+import datetime
+import pymysql
+import config
+import storage
+
+# Migrazioni dello schema, applicate in ordine una sola volta con "python schema.py migrate".
+# L'app e i giochi all'avvio controllano solo la versione (una query sull'indice primario).
+# Ogni istruzione si può rieseguire: con MySQL le DDL fanno commit da sole, quindi una migrazione
+# interrotta a metà si riapplica da capo sopra le tabelle e gli indici già creati.
+
+def index(name, table, columns):
+    """CREATE INDEX che salta gli indici già presenti (MySQL non ha CREATE INDEX IF NOT EXISTS)."""
+    def create(cursor):
+        if config.STORAGE_BACKEND == 'sqlite':
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+            return
+        cursor.execute(
+            'SELECT 1 FROM information_schema.statistics '
+            'WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1',
+            (table, name)
+        )
+        if cursor.fetchone() is None:
+            cursor.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+    return create
+
+MIGRATIONS = [
+    (1, "Tabella degli utenti", [
+        '''
+        CREATE TABLE IF NOT EXISTS user (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) NOT NULL UNIQUE,
+            password VARCHAR(510) NOT NULL
+        )
+        ''',
+    ]),
+    (2, "Tabella dei record delle partite", [
+        '''
+        CREATE TABLE IF NOT EXISTS records (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            time FLOAT,
+            date DATETIME,
+            user VARCHAR(255),
+            difficulty VARCHAR(255)
+        )
+        ''',
+    ]),
+    (3, "Migliori tempi in best_records, records diventa lo storico; indici composti", [
+        '''
+        CREATE TABLE IF NOT EXISTS best_records (
+            user VARCHAR(255) NOT NULL,
+            difficulty VARCHAR(32) NOT NULL,
+            time FLOAT NOT NULL,
+            date DATETIME,
+            PRIMARY KEY (user, difficulty)
+        )
+        ''',
+        index('best_records_difficulty_time', 'best_records', 'difficulty, time'),
+        index('records_user_difficulty_time', 'records', 'user, difficulty, time'),
+        # Copia il miglior tempo già presente nello storico (a parità di tempo, la data più vecchia)
+        '''
+        INSERT INTO best_records (time, date, user, difficulty)
+        SELECT r.time, MIN(r.date), r.user, r.difficulty
+        FROM records r
+        JOIN (
+            SELECT user, difficulty, MIN(time) AS best
+            FROM records
+            WHERE user IS NOT NULL AND difficulty IS NOT NULL AND time IS NOT NULL
+            GROUP BY user, difficulty
+        ) b ON r.user = b.user AND r.difficulty = b.difficulty AND r.time = b.best
+        GROUP BY r.user, r.difficulty, r.time
+        ''',
+    ]),
+    (4, "Migliori tempi delle sfide giornaliere", [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_records (
+            day DATE NOT NULL,
+            difficulty VARCHAR(32) NOT NULL,
+            user VARCHAR(255) NOT NULL,
+            time FLOAT NOT NULL,
+            date DATETIME,
+            PRIMARY KEY (day, difficulty, user)
+        )
+        ''',
+        index('daily_records_day_difficulty_time', 'daily_records', 'day, difficulty, time'),
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def current_version(connection):
+    """Restituisce la versione dello schema applicata (0 se mai migrato)."""
+    try:
+        with connection.cursor(pymysql.cursors.Cursor) as cursor:
+            cursor.execute('SELECT MAX(version) FROM schema_version')
+            row = cursor.fetchone()
+            return (row[0] or 0) if row else 0
+    except pymysql.MySQLError:
+        return 0
+
+def check_schema(connection, required=SCHEMA_VERSION):
+    """Controllo rapido da eseguire all'avvio: avvisa se mancano migrazioni."""
+    version = current_version(connection)
+    if version < required:
+        print(f"Schema del database alla versione {version}, richiesta {required}: esegui 'python schema.py migrate'")
+        return False
+    return True
+
+def migrate(connection):
+    """Applica le migrazioni mancanti e registra ciascuna in schema_version."""
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at DATETIME
+            )
+        ''')
+        connection.commit()
+
+    applied = []
+    version = current_version(connection)
+    for number, description, statements in MIGRATIONS:
+        if number <= version:
+            continue
+        with connection.cursor() as cursor:
+            for statement in statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)',
+                (number, description, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+        connection.commit()
+        applied.append(number)
+        print(f"Migrazione {number} applicata: {description}")
+    return applied
+
+def create_database(name):
+    """Crea il database, se non esiste (con SQLite il file si crea alla prima connessione)."""
+    if config.STORAGE_BACKEND == 'sqlite':
+        return
+    connection = storage.connect_server()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+        connection.commit()
+    finally:
+        connection.close()
+
+def connect(name):
+    # Le migrazioni su tabelle grandi possono durare più di DB_READ_TIMEOUT
+    return storage.connect(name, dict_rows=False, read_timeout=None)
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ('migrate', 'status'):
+        print("Uso: python schema.py migrate|status [--create-database] [nome_database ...]")
+        return 1
+
+    command = argv[1]
+    create = '--create-database' in argv
+    names = [arg for arg in argv[2:] if not arg.startswith('--')] or [config.DB_NAME, config.PUZZLE_DB_NAME]
+
+    for name in dict.fromkeys(names):
+        try:
+            if create and command == 'migrate':
+                create_database(name)
+            connection = connect(name)
+        except pymysql.MySQLError as e:
+            print(f"Errore nella connessione al database {name}: {e}")
+            return 1
+        try:
+            if command == 'migrate':
+                migrate(connection)
+            print(f"{name}: schema alla versione {current_version(connection)} (richiesta {SCHEMA_VERSION})")
+        except pymysql.MySQLError as e:
+            print(f"Errore durante la migrazione di {name}: {e}")
+            return 1
+        finally:
+            connection.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
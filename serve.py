@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import signal
+import threading
+import multiprocessing
+from gunicorn.app.base import BaseApplication
+import config
+
+# Server di produzione: gunicorn con più processi e thread, app caricata una volta
+# nel master prima del fork e preparata in ogni worker.
+# Ricaricamento senza interruzioni quando cambiano i file:
+#  - codice Python: USR2 avvia un nuovo master con il codice aggiornato; quando tutti i suoi
+#    worker sono pronti, il nuovo master chiude con TERM (che attende le richieste in corso) quello vecchio;
+#    se non lo sono entro SERVER_TIMEOUT il vecchio resta attivo
+#  - template e build WASM: HUP riavvia i worker uno alla volta con lo stesso codice
+#
+#   python serve.py
+#   SERVER_WORKERS=4 SERVER_THREADS=8 SERVER_BIND=127.0.0.1:8000 python serve.py
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIRS = (os.path.join(ROOT, 'templates'), os.path.join(ROOT, 'p', 'build', 'web'))
+
+# Worker che hanno completato la preparazione: memoria condivisa creata dal master prima dei fork
+ready_workers = None
+
+def python_files():
+    """Moduli dell'applicazione (solo la cartella principale: bench e giochi non servono all'app)."""
+    return [os.path.join(ROOT, name) for name in os.listdir(ROOT) if name.endswith('.py')]
+
+def other_files():
+    for directory in TEMPLATE_DIRS:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                yield os.path.join(root, name)
+
+def snapshot(paths):
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            pass
+    return mtimes
+
+def watch(arbiter, interval):
+    """Thread del master: invia USR2 (codice) o HUP (template e build) quando qualcosa cambia."""
+    code = snapshot(python_files())
+    assets = snapshot(other_files())
+    while True:
+        time.sleep(interval)
+        current_code = snapshot(python_files())
+        if current_code != code:
+            # Se il nuovo master non parte (es. errore di sintassi) questo continua a servire
+            code = current_code
+            arbiter.log.info("Codice modificato: avvio di un nuovo master (USR2)")
+            os.kill(os.getpid(), signal.SIGUSR2)
+            continue
+        current_assets = snapshot(other_files())
+        if current_assets != assets:
+            assets = current_assets
+            arbiter.log.info("Template o build modificati: riavvio graduale dei worker (HUP)")
+            os.kill(os.getpid(), signal.SIGHUP)
+
+def retire_previous_master(arbiter, pid):
+    """Chiude il master precedente solo quando tutti i nuovi worker sono pronti entro il timeout."""
+    deadline = time.monotonic() + config.SERVER_TIMEOUT
+    while ready_workers.value < arbiter.num_workers and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if ready_workers.value < arbiter.num_workers:
+        # Nuovi worker senza database o cache: il vecchio master continua a servire le richieste
+        arbiter.log.warning(f"Solo {ready_workers.value} worker su {arbiter.num_workers} pronti: il master "
+                            f"precedente {pid} resta attivo (chiuderlo con kill -TERM {pid})")
+        return
+    arbiter.log.info(f"Chiusura graduale del master precedente {pid}")
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+def when_ready(arbiter):
+    global ready_workers
+    ready_workers = multiprocessing.Value('i', 0)
+    # Se questo master nasce da un USR2, il vecchio resta attivo finché i nuovi worker non sono pronti
+    if arbiter.master_pid and arbiter.master_pid != os.getpid():
+        threading.Thread(target=retire_previous_master, args=(arbiter, arbiter.master_pid), name='retire-master',
+                         daemon=True).start()
+    if config.SERVER_RELOAD_INTERVAL > 0:
+        threading.Thread(target=watch, args=(arbiter, config.SERVER_RELOAD_INTERVAL), name='reload-watcher',
+                         daemon=True).start()
+
+def post_fork(arbiter, worker):
+    # Ogni worker apre le proprie connessioni e avvia i propri thread prima di accettare richieste
+    import app
+    if not app.warm_up():
+        worker.log.warning("Worker avviato senza preparazione completa: /ready risponderà 503")
+        return
+    with ready_workers.get_lock():
+        ready_workers.value += 1
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import app
+        return app.app
+
+def options():
+    return {
+        'bind': config.SERVER_BIND,
+        'workers': config.SERVER_WORKERS,
+        'threads': config.SERVER_THREADS,
+        'worker_class': 'gthread',
+        'timeout': config.SERVER_TIMEOUT,
+        'graceful_timeout': config.SERVER_GRACEFUL_TIMEOUT,
+        'max_requests': config.SERVER_MAX_REQUESTS,
+        'max_requests_jitter': config.SERVER_MAX_REQUESTS // 10,
+        'preload_app': True,
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+    }
+
+if __name__ == "__main__":
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    Server(options()).run()
@@ -0,0 +1,150 @@
+import os
+import time
+import base64
+import secrets
+import sqlite3
+import threading
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from user_cache import TTLCache
+
+# Chiave di firma stabile e sessioni lato server.
+# La chiave viene dalla configurazione oppure da un file generato una volta sola, così
+# riavvii e worker diversi accettano gli stessi cookie. Con lo store lato server il cookie
+# contiene solo un identificativo casuale; i dati stanno in SQLite con una LRU davanti.
+
+def load_secret_key(configured, path):
+    """Chiave configurata, oppure quella salvata in `path` (creata al primo avvio)."""
+    if configured:
+        return configured
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    key = base64.urlsafe_b64encode(os.urandom(32)).decode('utf-8')
+    # La chiave si scrive in un file temporaneo e si pubblica con os.link, che fallisce se il file
+    # esiste già: se più worker partono insieme vince il primo e gli altri leggono la sua chiave,
+    # sempre completa (con O_EXCL sul file finale potevano leggerlo ancora vuoto)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(key)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.link(temporary, path)
+    except FileExistsError:
+        with open(path, encoding='utf-8') as f:
+            key = f.read().strip()
+    finally:
+        os.remove(temporary)
+    return key
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.user_id = self.get('_user_id')  # Utente all'apertura: se cambia si rigenera l'id
+
+class SessionStore:
+    """Sessioni in SQLite locale, con una LRU (dati serializzati) per evitare la lettura dal file."""
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, path, cache_size=10000, cache_ttl=5.0):
+        self.path = path
+        # TTL breve: un altro worker può aver modificato o chiuso la stessa sessione
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        # Una connessione per thread, riaperta dopo un fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT, expires REAL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sid):
+        """Dati serializzati della sessione, oppure None se non esiste o è scaduta."""
+        data = self.cache.get(sid)
+        if data is not None:
+            return data
+        row = self._connection().execute('SELECT data, expires FROM sessions WHERE id = ?', (sid,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        self.cache.put(sid, row[0])
+        return row[0]
+
+    def save(self, sid, data, lifetime):
+        now = time.time()
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)', (sid, data, now + lifetime))
+        self.cache.put(sid, data)
+        self._writes += 1
+        if self._writes % self.CLEANUP_EVERY == 0:
+            conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+        self.cache.invalidate(sid)
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()  # Lo stesso formato dei cookie di sessione di Flask
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSession(self.serializer.loads(data), sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add('Cookie')
+            return
+
+        if not session.modified:
+            return
+        if not session.new and session.get('_user_id') != session.user_id:
+            # Login o cambio di utente: nuovo identificativo contro la session fixation
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add('Cookie')
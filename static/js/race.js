@@ -0,0 +1,127 @@
+// Client delle gare per la versione web (stesso protocollo binario di race_protocol.py).
+// Il WebSocket del browser non blocca mai: i messaggi arrivano in una coda che il ciclo
+// di gioco (pygbag, tramite platform.window.raceClient) svuota a ogni frame con poll().
+//
+//   const race = await RaceClient.connect('puzzle', 'easy', '');
+//   race.progress(RaceClient.MOVE, x, y, correct);
+//   for (const message of race.poll()) { ... }
+
+class RaceClient {
+    static GAMES = ['memory', 'puzzle'];
+    static DIFFICULTIES = ['easy', 'medium', 'hard'];
+    static MOVE = 1;
+    static FLIP = 2;
+    static MATCH = 3;
+
+    constructor(socket) {
+        this.socket = socket;
+        this.queue = [];
+        socket.binaryType = 'arraybuffer';
+        socket.onmessage = (event) => this.queue.push(RaceClient.decode(new DataView(event.data)));
+        socket.onclose = () => {
+            clearInterval(this.heartbeat);
+            this.queue.push(['closed']);
+        };
+        // Il server chiude le connessioni inattive: un messaggio vuoto ogni 30 secondi
+        this.heartbeat = setInterval(() => socket.send(new Uint8Array(0)), 30000);
+    }
+
+    // Chiede un token a /api/race/token (serve la sessione del sito) e apre la connessione
+    static async connect(game, difficulty, room) {
+        const response = await fetch('/api/race/token', { credentials: 'same-origin' });
+        if (!response.ok) {
+            throw new Error('Token della gara non disponibile');
+        }
+        const { token, url } = await response.json();
+        const socket = new WebSocket(url);
+        await new Promise((resolve, reject) => {
+            socket.onopen = resolve;
+            socket.onerror = reject;
+        });
+        const client = new RaceClient(socket);
+        socket.send(RaceClient.encodeJoin(game, difficulty, room || '', token));
+        return client;
+    }
+
+    static encodeJoin(game, difficulty, room, token) {
+        const encoder = new TextEncoder();
+        const roomBytes = encoder.encode(room).slice(0, 255);
+        const tokenBytes = encoder.encode(token);
+        const data = new Uint8Array(6 + roomBytes.length + tokenBytes.length + 1);
+        const view = new DataView(data.buffer);
+        view.setUint8(0, 1);
+        view.setUint8(1, RaceClient.GAMES.indexOf(game));
+        view.setUint8(2, RaceClient.DIFFICULTIES.indexOf(difficulty));
+        view.setUint8(3, roomBytes.length);
+        view.setUint16(4, tokenBytes.length, true);
+        data.set(roomBytes, 6);
+        data.set(tokenBytes, 6 + roomBytes.length);
+        // Nome utente vuoto: con il token firmato vale quello della sessione
+        return data;
+    }
+
+    static decode(view) {
+        const decoder = new TextDecoder();
+        const kind = view.getUint8(0);
+        if (kind === 11) {
+            const count = view.getUint8(3);
+            const entries = [];
+            for (let i = 0, offset = 4; i < count; i++, offset += 6) {
+                entries.push([view.getUint8(offset), view.getUint8(offset + 1), view.getUint8(offset + 2),
+                              view.getUint8(offset + 3), view.getUint16(offset + 4, true)]);
+            }
+            return ['tick', view.getUint16(1, true), entries];
+        }
+        if (kind === 10) {
+            const players = [];
+            let offset = 8;
+            for (let i = 0; i < view.getUint8(7); i++) {
+                const slot = view.getUint8(offset);
+                const length = view.getUint8(offset + 1);
+                players.push([slot, decoder.decode(new Uint8Array(view.buffer, offset + 2, length))]);
+                offset += 2 + length;
+            }
+            return ['start', view.getUint32(1, true), RaceClient.GAMES[view.getUint8(5)],
+                    RaceClient.DIFFICULTIES[view.getUint8(6)], players];
+        }
+        if (kind === 12) {
+            return ['result', view.getUint8(1), view.getUint32(2, true), view.getUint8(6)];
+        }
+        if (kind === 13) {
+            return ['leave', view.getUint8(1)];
+        }
+        if (kind === 14) {
+            return ['error', decoder.decode(new Uint8Array(view.buffer, 1))];
+        }
+        return ['unknown', kind];
+    }
+
+    poll() {
+        const messages = this.queue;
+        this.queue = [];
+        return messages;
+    }
+
+    progress(kind, x, y, value) {
+        const view = new DataView(new ArrayBuffer(6));
+        view.setUint8(0, 2);
+        view.setUint8(1, kind);
+        view.setUint8(2, x);
+        view.setUint8(3, y);
+        view.setUint16(4, Math.min(value, 0xFFFF), true);
+        this.socket.send(view.buffer);
+    }
+
+    finish(elapsedMs) {
+        const view = new DataView(new ArrayBuffer(5));
+        view.setUint8(0, 3);
+        view.setUint32(1, Math.round(elapsedMs), true);
+        this.socket.send(view.buffer);
+    }
+
+    close() {
+        this.socket.close(1000);
+    }
+}
+
+window.RaceClient = RaceClient;
@@ -0,0 +1,174 @@
+import os
+import re
+import sys
+import gzip
+import mimetypes
+from functools import wraps
+from urllib.parse import quote
+from flask import request, session, send_file, current_app, abort
+from flask_login.config import EXEMPT_METHODS
+from werkzeug.security import safe_join
+import config
+
+try:
+    import brotli  # Opzionale: abilita le varianti .br
+except ImportError:
+    brotli = None
+
+# Servizio veloce dei file statici della build WASM (p/build/web): ETag e 304, varianti
+# precompresse, richieste Range/If-Range e invio senza copie (sendfile o X-Accel-Redirect)
+
+# Nomi che contengono un hash del contenuto (es. p/build/web-cache di pygbag)
+VERSIONED_NAME = re.compile(r'[0-9a-f]{16,}')
+# Varianti precompresse, in ordine di preferenza
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Estensioni già compresse che non vale la pena ricomprimere
+COMPRESSED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.ogg', '.apk', '.zip', '.gz', '.br', '.woff2'}
+IMMUTABLE_MAX_AGE = 31536000  # Un anno
+
+def session_login_required(view):
+    """Come login_required, ma controlla solo la sessione firmata senza caricare l'utente dal database."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in EXEMPT_METHODS or current_app.config.get('LOGIN_DISABLED'):
+            return view(*args, **kwargs)
+        if '_user_id' not in session:
+            return current_app.login_manager.unauthorized()
+        return view(*args, **kwargs)
+    return wrapper
+
+def is_versioned(filename):
+    """Un file è versionato se il nome contiene un hash o la richiesta porta ?v=..."""
+    return bool(VERSIONED_NAME.search(os.path.basename(filename))) or 'v' in request.args
+
+def find_precompressed(path):
+    """Sceglie la variante .br/.gz accettata dal client, se esiste ed è aggiornata."""
+    source_mtime = None
+    available = False
+    for encoding, suffix in ENCODINGS:
+        try:
+            sibling_mtime = os.stat(path + suffix).st_mtime
+        except OSError:
+            continue
+        if source_mtime is None:
+            source_mtime = os.stat(path).st_mtime
+        if sibling_mtime < source_mtime:
+            continue  # Variante più vecchia del file originale: ignorala
+        available = True
+        if request.accept_encodings[encoding]:
+            return path + suffix, encoding, True
+    return path, None, available
+
+class FileSlice:
+    """Porzione di un file aperto: read() si ferma alla fine dell'intervallo, fileno() permette sendfile."""
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+def sendfile_range(response, path):
+    """Sostituisce il corpo di una risposta 206 con un file wrapper posizionato sull'intervallo.
+
+    Werkzeug copierebbe l'intervallo in Python; i server che implementano wsgi.file_wrapper
+    con sendfile (es. gunicorn) partono dalla posizione corrente e inviano Content-Length byte.
+    """
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    content_range = response.content_range
+    if file_wrapper is None or content_range is None or content_range.start is None:
+        return
+    length = content_range.stop - content_range.start
+    file = open(path, 'rb')
+    file.seek(content_range.start)
+    previous = response.response
+    response.response = file_wrapper(FileSlice(file, length), 64 * 1024)
+    if hasattr(previous, 'close'):
+        previous.close()
+
+def accel_redirect(path, mimetype):
+    """Risposta vuota che delega a nginx l'invio del file (Range e 304 compresi), o None se fuori radice."""
+    root = os.path.abspath(config.STATIC_ACCEL_ROOT)
+    relative = os.path.relpath(path, root)
+    if relative.startswith(os.pardir):
+        return None
+    response = current_app.response_class(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = config.STATIC_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+    # nginx sceglie le varianti .gz/.br con gzip_static/brotli_static nella location interna
+    response.vary.add('Accept-Encoding')
+    return response
+
+def send_static(directory, filename):
+    """Invia un file con ETag/Last-Modified, risposte 304, Range e varianti precompresse."""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = accel_redirect(path, mimetype) if config.STATIC_OFFLOAD == 'x-accel' else None
+    if response is None:
+        serve_path, encoding, has_variants = find_precompressed(path)
+
+        # send_file calcola ETag e Last-Modified, risponde 304 alle richieste condizionali
+        # e 206 alle richieste Range (con If-Range controllato sull'ETag)
+        response = send_file(serve_path, mimetype=mimetype, conditional=True, etag=True, max_age=None)
+        if response.status_code == 206:
+            sendfile_range(response, serve_path)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if has_variants:
+            response.vary.add('Accept-Encoding')
+
+    if is_versioned(filename):
+        response.cache_control.private = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Il client tiene la copia ma la rivalida: con l'ETag la risposta è un 304 senza corpo
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+def precompress(directory, min_size=1024):
+    """Crea le varianti .gz (e .br se disponibile) accanto ai file comprimibili."""
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            ext = os.path.splitext(name)[1].lower()
+            if ext in COMPRESSED_EXTENSIONS or os.path.getsize(path) < min_size:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            variants = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', lambda d: brotli.compress(d, quality=11)))
+            for suffix, compress in variants:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                compressed = compress(data)
+                if len(compressed) > len(data) * 0.9:
+                    continue  # Guadagno trascurabile
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Uso: python static_files.py <cartella_build>")
+        sys.exit(1)
+
+    count = precompress(sys.argv[1])
+    print(f"Varianti precompresse create: {count}")
@@ -0,0 +1,162 @@
+import os
+import re
+import sqlite3
+from functools import lru_cache
+import pymysql
+import pymysql.cursors
+import config
+
+# Backend di archiviazione scelto da configurazione (STORAGE_BACKEND):
+#  - 'mysql': server MySQL remoto tramite pymysql
+#  - 'sqlite': file SQLite locale in modalità WAL, per installazioni su un solo nodo
+# Entrambi espongono l'interfaccia di pymysql usata dal codice (cursor() come context
+# manager, parametri %s, righe come dict) e sollevano le eccezioni di pymysql.
+
+@lru_cache(maxsize=512)
+def to_sqlite(sql):
+    """Traduce un'istruzione MySQL in SQLite; il risultato è in cache, come lo statement compilato."""
+    sql = sql.replace('%s', '?')
+    return re.sub(r'\bINT AUTO_INCREMENT PRIMARY KEY\b', 'INTEGER PRIMARY KEY AUTOINCREMENT', sql)
+
+def translate_error(error):
+    """Converte un errore di sqlite3 nell'eccezione pymysql equivalente."""
+    if isinstance(error, sqlite3.IntegrityError):
+        return pymysql.err.IntegrityError(0, str(error))
+    if isinstance(error, sqlite3.OperationalError):
+        return pymysql.err.OperationalError(0, str(error))
+    if isinstance(error, sqlite3.ProgrammingError):
+        return pymysql.err.ProgrammingError(0, str(error))
+    return pymysql.err.DatabaseError(0, str(error))
+
+class SQLiteCursor:
+    def __init__(self, connection, as_dict=True):
+        self._cursor = connection.cursor()
+        self._as_dict = as_dict
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def execute(self, query, args=None):
+        try:
+            self._cursor.execute(to_sqlite(query), tuple(args or ()))
+        except sqlite3.Error as e:
+            raise translate_error(e) from e
+        self.lastrowid = self._cursor.lastrowid
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, query, args):
+        try:
+            # Un solo statement preparato riusato per tutte le righe
+            self._cursor.executemany(to_sqlite(query), [tuple(row) for row in args])
+        except sqlite3.Error as e:
+            raise translate_error(e) from e
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def _row(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return (self._row(row) for row in self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteConnection:
+    # Parametri pensati per molte letture concorrenti e scritture brevi
+    PRAGMAS = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA busy_timeout=5000',
+        'PRAGMA cache_size=-20000',
+        'PRAGMA mmap_size=268435456',
+        'PRAGMA temp_store=MEMORY',
+    )
+
+    def __init__(self, path, dict_rows=True):
+        try:
+            self._connection = sqlite3.connect(path, timeout=5.0, check_same_thread=False, cached_statements=256)
+            for pragma in self.PRAGMAS:
+                self._connection.execute(pragma)
+        except sqlite3.Error as e:
+            raise translate_error(e) from e
+        self._dict_rows = dict_rows
+        self.open = True
+
+    @property
+    def server_status(self):
+        # Stesso significato del flag SERVER_STATUS_IN_TRANS di MySQL, usato dal pool
+        return 1 if self._connection.in_transaction else 0
+
+    def cursor(self, cursorclass=None):
+        if cursorclass is None:
+            as_dict = self._dict_rows
+        else:
+            as_dict = issubclass(cursorclass, pymysql.cursors.DictCursorMixin)
+        return SQLiteCursor(self._connection, as_dict=as_dict)
+
+    def commit(self):
+        try:
+            self._connection.commit()
+        except sqlite3.Error as e:
+            raise translate_error(e) from e
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise pymysql.err.InterfaceError(0, "Connessione chiusa")
+
+    def select_db(self, database):
+        raise pymysql.err.NotSupportedError(0, "SQLite usa un file per database")
+
+    def close(self):
+        if self.open:
+            self.open = False
+            self._connection.close()
+
+def sqlite_path(database):
+    """File SQLite che corrisponde a un nome di database MySQL."""
+    filename = re.sub(r'[^A-Za-z0-9_.-]', '_', database) + '.sqlite3'
+    return os.path.join(config.SQLITE_DIR, filename)
+
+def connect(database=None, dict_rows=True, read_timeout=config.DB_READ_TIMEOUT):
+    """Apre una connessione con il backend configurato; read_timeout=None per istruzioni lunghe."""
+    database = database or config.DB_NAME
+    if config.STORAGE_BACKEND == 'sqlite':
+        os.makedirs(config.SQLITE_DIR, exist_ok=True)
+        return SQLiteConnection(sqlite_path(database), dict_rows=dict_rows)
+    return pymysql.connect(
+        host=config.DB_HOST,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        database=database,
+        port=config.DB_PORT,
+        connect_timeout=config.DB_CONNECT_TIMEOUT,
+        read_timeout=read_timeout,
+        write_timeout=config.DB_WRITE_TIMEOUT,
+        cursorclass=pymysql.cursors.DictCursor if dict_rows else pymysql.cursors.Cursor
+    )
+
+def connect_server():
+    """Connessione al server senza database selezionato (solo MySQL)."""
+    return pymysql.connect(host=config.DB_HOST, user=config.DB_USER, password=config.DB_PASSWORD, port=config.DB_PORT,
+                           connect_timeout=config.DB_CONNECT_TIMEOUT)
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import atexit
+import random
+import datetime
+import threading
+import urllib.request
+import urllib.error
+from array import array
+import config
+
+# Telemetria delle partite (mosse del puzzle, carte girate e coppie del memory).
+# I giochi accumulano gli eventi e li inviano a lotti in formato binario compatto;
+# il server li scrive per colonne in file append-only, una cartella per gioco e per ora:
+#   TELEMETRY_DIR/<gioco>/<AAAAMMGGHH>/<pid>-<n>.seg
+# Le ore chiuse si compattano offline in un solo file per cartella:
+#   python telemetry.py compact [gioco ...]
+
+# Tipi di evento
+MOVE = 1       # Puzzle: x, y = tessera spostata; valore = 1 se il puzzle è risolto
+FLIP = 2       # Memory: x, y = colonna e riga della carta
+MATCH = 3      # Memory: valore = coppie consecutive
+MISMATCH = 4
+EVENT_TYPES = {MOVE: 'move', FLIP: 'flip', MATCH: 'match', MISMATCH: 'mismatch'}
+DIFFICULTY_CODES = {'easy': 0, 'medium': 1, 'hard': 2}
+DIFFICULTY_NAMES = {code: name for name, code in DIFFICULTY_CODES.items()}
+
+# Lotto inviato dal client: intestazione, nome utente, poi eventi di dimensione fissa.
+# magic, versione, difficoltà, partita, istante base (ms), lunghezza del nome utente
+BATCH_HEADER = struct.Struct('<2sBBIqH')
+# ms dall'istante base, tipo, x, y, valore
+EVENT = struct.Struct('<IBhhh')
+BATCH_MAGIC = b'TE'
+VERSION = 1
+
+# Blocco su disco: intestazione, metadati JSON, poi una colonna dopo l'altra
+BLOCK_HEADER = struct.Struct('<4sII')  # magic, numero di eventi, lunghezza dei metadati
+BLOCK_MAGIC = b'TLB1'
+COLUMNS = (('offset', 'I'), ('type', 'B'), ('x', 'h'), ('y', 'h'), ('value', 'h'))
+SEGMENT_SUFFIX = '.seg'
+COMPACTED_NAME = 'compacted.tlc'
+
+class InvalidBatch(ValueError):
+    """Lotto di telemetria malformato."""
+
+# --- Lato client -------------------------------------------------------------
+
+def encode_batch(events, user, difficulty, session):
+    """Codifica una lista di (ms, tipo, x, y, valore) in un lotto binario."""
+    base = events[0][0]
+    name = user.encode('utf-8')
+    parts = [BATCH_HEADER.pack(BATCH_MAGIC, VERSION, DIFFICULTY_CODES.get(difficulty, 255), session, base, len(name)), name]
+    pack = EVENT.pack
+    parts += [pack(ms - base, kind, x, y, value) for ms, kind, x, y, value in events]
+    return b''.join(parts)
+
+class TelemetryClient:
+    """Raccoglie gli eventi di una partita e li invia a lotti da un thread in background.
+
+    Se TELEMETRY_URL è vuoto non fa nulla. Gli errori di rete non fermano il gioco:
+    i lotti che non si riescono a inviare vengono scartati (e contati).
+    """
+    def __init__(self, game, user, difficulty, url=None, token=None, batch_size=None, flush_interval=None):
+        self.game = game
+        self.user = user
+        self.difficulty = difficulty
+        self.url = (config.TELEMETRY_URL if url is None else url).rstrip('/')
+        self.token = config.TELEMETRY_TOKEN if token is None else token
+        self.batch_size = batch_size or config.TELEMETRY_BATCH_SIZE
+        self.flush_interval = config.TELEMETRY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.session = random.getrandbits(32)  # Identifica la partita nei dati
+        self.enabled = bool(self.url)
+        self._events = []
+        self._first = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=64)
+        self._thread = None
+        # Statistiche
+        self.sent = 0
+        self.dropped = 0
+
+    def record(self, kind, x=0, y=0, value=0):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            if self._first is None:
+                self._first = now
+            self._events.append((int(now * 1000), kind, x, y, value))
+            if len(self._events) < self.batch_size and now - self._first < self.flush_interval:
+                return
+            events, self._events, self._first = self._events, [], None
+        self._send(events)
+
+    def _send(self, events):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        try:
+            self._queue.put_nowait(encode_batch(events, self.user, self.difficulty, self.session))
+        except queue.Full:
+            self.dropped += len(events)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            request = urllib.request.Request(f'{self.url}/api/telemetry/{self.game}', data=batch, method='POST',
+                                             headers={'Content-Type': 'application/octet-stream'})
+            if self.token:
+                request.add_header('Authorization', f'Bearer {self.token}')
+            events = (len(batch) - BATCH_HEADER.size - len(self.user.encode('utf-8'))) // EVENT.size
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    response.read()
+                self.sent += events
+            except (urllib.error.URLError, OSError) as e:
+                self.dropped += events
+                print(f"Invio della telemetria non riuscito: {e}")
+
+    def close(self, timeout=5.0):
+        """Invia gli eventi rimasti e attende il thread (al massimo `timeout` secondi)."""
+        with self._lock:
+            events, self._events, self._first = self._events, [], None
+        if events:
+            self._send(events)
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+# --- Lato server -------------------------------------------------------------
+
+def decode_batch(data):
+    """Restituisce (metadati, colonne) da un lotto binario; InvalidBatch se malformato."""
+    if len(data) < BATCH_HEADER.size:
+        raise InvalidBatch("Lotto troppo corto")
+    magic, version, difficulty, session, base, name_length = BATCH_HEADER.unpack_from(data)
+    if magic != BATCH_MAGIC or version != VERSION:
+        raise InvalidBatch("Formato del lotto non riconosciuto")
+    if difficulty not in DIFFICULTY_NAMES:
+        raise InvalidBatch("Difficoltà non valida")
+    start = BATCH_HEADER.size + name_length
+    body = memoryview(data)[start:]
+    if len(body) == 0 or len(body) % EVENT.size:
+        raise InvalidBatch("Lunghezza degli eventi non valida")
+    try:
+        user = bytes(data[BATCH_HEADER.size:start]).decode('utf-8')
+    except UnicodeDecodeError:
+        raise InvalidBatch("Nome utente non valido")
+    # Trasposizione da righe a colonne: una sola passata in C con zip
+    columns = [array(code, values) for (_, code), values in zip(COLUMNS, zip(*EVENT.iter_unpack(body)))]
+    if max(columns[1]) > max(EVENT_TYPES) or min(columns[1]) < min(EVENT_TYPES):
+        raise InvalidBatch("Tipo di evento non valido")
+    meta = {'user': user, 'difficulty': DIFFICULTY_NAMES[difficulty], 'session': session, 'base': base}
+    return meta, columns
+
+def encode_block(meta, columns):
+    header = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    parts = [BLOCK_HEADER.pack(BLOCK_MAGIC, len(columns[0]), len(header)), header]
+    for column in columns:
+        if sys.byteorder != 'little':
+            column = array(column.typecode, column)
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b''.join(parts)
+
+def read_blocks(path):
+    """Genera (metadati, colonne) dai blocchi di un file; un blocco finale incompleto viene ignorato."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    position = 0
+    while position + BLOCK_HEADER.size <= len(data):
+        magic, count, meta_length = BLOCK_HEADER.unpack_from(data, position)
+        if magic != BLOCK_MAGIC:
+            print(f"Blocco non valido in {path} alla posizione {position}")
+            return
+        position += BLOCK_HEADER.size
+        end = position + meta_length + count * sum(array(code).itemsize for _, code in COLUMNS)
+        if end > len(data):
+            return  # Scrittura interrotta
+        meta = json.loads(data[position:position + meta_length])
+        position += meta_length
+        columns = []
+        for _, code in COLUMNS:
+            column = array(code)
+            column.frombytes(data[position:position + count * column.itemsize])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            position += count * column.itemsize
+            columns.append(column)
+        yield meta, columns
+
+def hour_partition(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y%m%d%H')
+
+class SegmentWriter:
+    """Scrive i blocchi in file append-only, uno per processo, gioco e ora."""
+    def __init__(self, root):
+        self.root = root
+        self._files = {}  # gioco -> (ora, descrittore)
+        self._lock = threading.Lock()
+        self._pid = None
+        # Statistiche
+        self.events = 0
+        self.blocks = 0
+        self.bytes = 0
+
+    def append(self, game, meta, columns):
+        block = encode_block(meta, columns)
+        partition = hour_partition(time.time())
+        with self._lock:
+            fd = self._file(game, partition)
+            os.write(fd, block)  # Una sola write per blocco: i lettori vedono blocchi interi o troncati
+            self.events += len(columns[0])
+            self.blocks += 1
+            self.bytes += len(block)
+
+    def _file(self, game, partition):
+        if self._pid != os.getpid():
+            self._files = {}  # Dopo un fork ogni worker apre i propri segmenti
+            self._pid = os.getpid()
+        current = self._files.get(game)
+        if current is not None and current[0] == partition:
+            return current[1]
+        if current is not None:
+            os.close(current[1])  # Cambio d'ora: il segmento precedente è chiuso per sempre
+        directory = os.path.join(self.root, game, partition)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}-{int(time.time() * 1000)}{SEGMENT_SUFFIX}')
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._files[game] = (partition, fd)
+        return fd
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                for _, fd in self._files.values():
+                    os.close(fd)
+            self._files = {}
+
+    def stats(self):
+        return {'events': self.events, 'blocks': self.blocks, 'bytes': self.bytes}
+
+# --- Compattazione offline ---------------------------------------------------
+
+def compact_partition(directory):
+    """Unisce i segmenti (e l'eventuale file compattato) di una cartella oraria; restituisce gli eventi."""
+    sources = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+    if not sources:
+        return 0
+    if os.path.exists(os.path.join(directory, COMPACTED_NAME)):
+        sources.insert(0, COMPACTED_NAME)
+
+    # Un blocco per partita: i lotti piccoli della stessa partita diventano colonne lunghe
+    sessions = {}
+    for name in sources:
+        for meta, columns in read_blocks(os.path.join(directory, name)):
+            key = (meta['user'], meta['difficulty'], meta['session'])
+            sessions.setdefault(key, []).append((meta['base'], columns))
+
+    temporary = os.path.join(directory, COMPACTED_NAME + '.tmp')
+    total = 0
+    with open(temporary, 'wb') as f:
+        for (user, difficulty, session), blocks in sessions.items():
+            base = min(block_base for block_base, _ in blocks)
+            merged = [array(code) for _, code in COLUMNS]
+            for block_base, columns in sorted(blocks, key=lambda block: block[0]):
+                shift = block_base - base
+                merged[0].extend(offset + shift for offset in columns[0])
+                for target, column in zip(merged[1:], columns[1:]):
+                    target.extend(column)
+            meta = {'user': user, 'difficulty': difficulty, 'session': session, 'base': base}
+            f.write(encode_block(meta, merged))
+            total += len(merged[0])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, os.path.join(directory, COMPACTED_NAME))
+    for name in sources:
+        if name != COMPACTED_NAME:
+            os.remove(os.path.join(directory, name))
+    return total
+
+def compact(root, games=None, now=None):
+    """Compatta tutte le ore già chiuse; l'ora corrente è ancora in scrittura e resta com'è."""
+    current = hour_partition(time.time() if now is None else now)
+    results = {}
+    for game in games or sorted(os.listdir(root)):
+        game_dir = os.path.join(root, game)
+        if not os.path.isdir(game_dir):
+            continue
+        for partition in sorted(os.listdir(game_dir)):
+            if partition >= current:
+                continue
+            events = compact_partition(os.path.join(game_dir, partition))
+            if events:
+                results[(game, partition)] = events
+    return results
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'compact':
+        print("Uso: python telemetry.py compact [gioco ...]")
+        return 1
+    if not os.path.isdir(config.TELEMETRY_DIR):
+        print(f"Nessuna telemetria in {config.TELEMETRY_DIR}")
+        return 0
+    start = time.perf_counter()
+    results = compact(config.TELEMETRY_DIR, argv[2:] or None)
+    for (game, partition), events in results.items():
+        print(f"{game}/{partition}: {events} eventi compattati")
+    total = sum(results.values())
+    elapsed = time.perf_counter() - start
+    print(f"Totale: {total} eventi in {len(results)} cartelle ({elapsed:.2f} s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Limitazione delle richieste costose (login, registrazione) prima di calcolare l'hash:
+#  - token bucket per chiave (IP, username), in memoria oppure in un file SQLite
+#    locale condiviso fra i processi dello stesso server
+#  - limite di richieste contemporanee oltre il quale si risponde subito con 429
+
+class TokenBucketLimiter:
+    """Token bucket in memoria: `rate` gettoni al secondo, al massimo `burst` accumulati."""
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys  # Oltre questo numero di chiavi si scordano le meno recenti
+        self._buckets = OrderedDict()  # chiave -> (gettoni, aggiornato_il)
+        self._lock = threading.Lock()
+
+    def hit(self, key, cost=1.0):
+        """Consuma `cost` gettoni; restituisce 0 se permesso, altrimenti i secondi da attendere."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+class SQLiteTokenBucketLimiter:
+    """Token bucket salvato in un file SQLite, condiviso dai worker della stessa macchina."""
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, path, rate, burst, namespace=''):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.namespace = namespace
+        self._local = threading.local()
+
+    def _connection(self):
+        # Una connessione per thread, riaperta dopo un fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.hits = 0
+        return conn
+
+    def hit(self, key, cost=1.0):
+        key = self.namespace + key
+        now = time.time()  # Orologio condiviso fra processi
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated = row if row else (self.burst, now)
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                wait = 0.0
+                if tokens >= cost:
+                    tokens -= cost
+                else:
+                    wait = (cost - tokens) / self.rate
+                conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+                self._local.hits += 1
+                if self._local.hits % self.CLEANUP_EVERY == 0:
+                    # Un bucket pieno equivale a uno assente: si eliminano quelli fermi da abbastanza tempo
+                    conn.execute('DELETE FROM buckets WHERE updated < ?', (now - self.burst / self.rate,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            return wait
+        except sqlite3.Error as e:
+            # Meglio lasciar passare che bloccare tutti gli accessi per un errore locale
+            print(f"Errore nel limitatore {self.path}: {e}")
+            return 0.0
+
+def create_limiter(rate, burst, store_path=None, namespace=''):
+    """Limitatore in memoria, oppure condiviso se è indicato un file."""
+    if store_path:
+        return SQLiteTokenBucketLimiter(store_path, rate, burst, namespace)
+    return TokenBucketLimiter(rate, burst)
+
+class ConcurrencyLimiter:
+    """Numero massimo di richieste costose in corso; oltre il limite si rifiuta senza attendere."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
@@ -0,0 +1,358 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import struct
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+from daily import GRID_SIZES
+
+try:
+    from PIL import Image, ImageOps  # Opzionale: decodifica più veloce (JPEG ridotti già in decodifica)
+except ImportError:
+    Image = None
+
+# Immagini del puzzle caricate dagli utenti. Un pool di processi decodifica ogni immagine una
+# sola volta, la ritaglia al centro, la riduce a IMAGE_SIZE e la taglia nelle tessere di ogni
+# difficoltà; il risultato sta in una cartella che ha per nome lo SHA-256 del file caricato:
+#   UPLOAD_DIR/<2 caratteri>/<sha256>/manifest.json, full.png, <difficoltà>/<riga>-<colonna>.png
+# Lo stesso file caricato due volte non viene mai rielaborato. I giochi disegnano le tessere
+# così come arrivano, senza ridimensionamenti.
+#   python uploads.py process <immagine> [...]
+
+IMAGE_SIZE = 400  # Lato dell'immagine del puzzle sullo schermo (px)
+LOCK_TIMEOUT = 300  # Elaborazioni più vecchie di (s) si considerano interrotte
+
+class UploadQueueFull(Exception):
+    """Troppe immagini in elaborazione: il client deve riprovare più tardi."""
+
+class InvalidImage(ValueError):
+    """File non decodificabile come immagine, o troppo grande."""
+
+def image_id(data):
+    return hashlib.sha256(data).hexdigest()
+
+def is_image_id(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+def image_dir(root, key):
+    return os.path.join(root, key[:2], key)
+
+def read_manifest(directory):
+    """Manifest di una cartella di tessere, oppure None se l'elaborazione non è conclusa."""
+    try:
+        with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def load_manifest(root, key):
+    return read_manifest(image_dir(root, key))
+
+# --- Elaborazione (nei processi del pool) --------------------------------------
+
+def _square_pil(path, size, max_pixels):
+    with Image.open(path) as image:
+        if image.width * image.height > max_pixels:
+            raise InvalidImage(f"Immagine troppo grande ({image.width}x{image.height})")
+        image.draft('RGB', (size, size))  # JPEG: decodifica direttamente a 1/2, 1/4 o 1/8
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        side = min(image.size)
+        left, top = (image.width - side) // 2, (image.height - side) // 2
+        return image.resize((size, size), Image.LANCZOS, box=(left, top, left + side, top + side))
+
+def _tiles_pil(square, rows, cols):
+    tile_width, tile_height = square.width // cols, square.height // rows
+    for row in range(rows):
+        for col in range(cols):
+            left, top = col * tile_width, row * tile_height
+            yield row, col, square.crop((left, top, left + tile_width, top + tile_height))
+
+def _save_pil(image, path):
+    image.save(path, 'PNG', compress_level=6)
+
+def header_size(path):
+    """Larghezza e altezza lette dall'intestazione di PNG, GIF, BMP o JPEG, senza decodificare; None se sconosciuto."""
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:2] == b'BM' and len(head) >= 26:
+            width, height = struct.unpack('<ii', head[18:26])
+            return abs(width), abs(height)
+        if head[:2] != b'\xff\xd8':
+            return None
+        # JPEG: si scorrono i segmenti fino al primo SOF (dimensioni del frame)
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                continue  # Marcatori senza lunghezza
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                data = f.read(5)
+                if len(data) < 5:
+                    return None
+                height, width = struct.unpack('>HH', data[1:5])
+                return width, height
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
+def _square_pygame(path, size, max_pixels):
+    import pygame
+    # pygame decodifica tutta l'immagine: il limite dei pixel si controlla prima, sull'intestazione
+    dimensions = header_size(path)
+    if dimensions is None:
+        raise InvalidImage("Formato non riconosciuto (senza Pillow servono PNG, JPEG, GIF o BMP)")
+    if dimensions[0] * dimensions[1] > max_pixels:
+        raise InvalidImage(f"Immagine troppo grande ({dimensions[0]}x{dimensions[1]})")
+    try:
+        image = pygame.image.load(path)
+    except pygame.error as e:
+        raise InvalidImage(f"Immagine non valida: {e}")
+    width, height = image.get_size()
+    if width * height > max_pixels:
+        raise InvalidImage(f"Immagine troppo grande ({width}x{height})")
+    side = min(width, height)
+    # smoothscale richiede 24 o 32 bit: le immagini a palette si copiano prima su una superficie RGB
+    square = pygame.Surface((side, side), 0, 24)
+    square.blit(image, (0, 0), pygame.Rect((width - side) // 2, (height - side) // 2, side, side))
+    return pygame.transform.smoothscale(square, (size, size))
+
+def _tiles_pygame(square, rows, cols):
+    tile_width, tile_height = square.get_width() // cols, square.get_height() // rows
+    for row in range(rows):
+        for col in range(cols):
+            yield row, col, square.subsurface((col * tile_width, row * tile_height, tile_width, tile_height))
+
+def _save_pygame(image, path):
+    import pygame
+    pygame.image.save(image, path)
+
+def process_image(source, root, key, size=IMAGE_SIZE, max_pixels=config.UPLOAD_MAX_PIXELS):
+    """Crea le tessere di tutte le difficoltà; restituisce il manifest. Eseguita nel pool di processi."""
+    if Image is not None:
+        try:
+            square = _square_pil(source, size, max_pixels)
+        except (OSError, Image.DecompressionBombError) as e:
+            raise InvalidImage(f"Immagine non valida: {e}")
+        tiles, save = _tiles_pil, _save_pil
+    else:
+        os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+        square = _square_pygame(source, size, max_pixels)
+        tiles, save = _tiles_pygame, _save_pygame
+
+    # Si scrive in una cartella temporanea e la si pubblica con un solo rename
+    target = image_dir(root, key)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    save(square, os.path.join(temporary, 'full.png'))
+    manifest = {'id': key, 'size': size, 'image': 'full.png', 'grids': {}}
+    for difficulty, (rows, cols) in GRID_SIZES.items():
+        os.mkdir(os.path.join(temporary, difficulty))
+        names = []
+        for row, col, tile in tiles(square, rows, cols):
+            name = f'{difficulty}/{row}-{col}.png'
+            save(tile, os.path.join(temporary, name))
+            names.append(name)
+        manifest['grids'][difficulty] = {'rows': rows, 'cols': cols, 'tile': [size // cols, size // rows],
+                                         'tiles': names}
+    with open(os.path.join(temporary, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    try:
+        os.rename(temporary, target)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)  # Un altro processo l'ha già pubblicata
+    return manifest
+
+# --- Coda delle elaborazioni (nel processo dell'app) ---------------------------
+
+class UploadProcessor:
+    """Accoda le immagini al pool di processi, senza mai elaborare due volte lo stesso contenuto."""
+    def __init__(self, root, workers=None, max_pending=16):
+        self.root = root
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._executor = None  # Creato al primo uso: dopo il fork dei worker, non nel master
+        self._pending = {}  # id -> future
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.duplicates = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key[:2], key)
+        return base + '.upload', base + '.lock', base + '.error'
+
+    def submit(self, data):
+        """Restituisce (id, manifest) se l'immagine è già pronta, altrimenti (id, None) e la accoda."""
+        key = image_id(data)
+        manifest = load_manifest(self.root, key)
+        if manifest is not None:
+            self.duplicates += 1
+            return key, manifest
+        source, lock, error = self._paths(key)
+        with self._lock:
+            if key in self._pending:
+                self.duplicates += 1
+                return key, None
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                raise UploadQueueFull(f"{len(self._pending)} immagini già in elaborazione.")
+            if not self._claim(lock):
+                self.duplicates += 1
+                return key, None  # La sta elaborando un altro processo dell'app
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+            with open(source, 'wb') as f:
+                f.write(data)
+            if os.path.exists(error):
+                os.remove(error)
+            try:
+                future = self._submit(source, key)
+            except Exception:
+                self._remove(source, lock)
+                raise
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return key, None
+
+    def _submit(self, source, key):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            return self._executor.submit(process_image, source, self.root, key)
+        except BrokenProcessPool:
+            # Un processo del pool è morto (es. memoria esaurita): il pool non accetta più lavori
+            print("Pool di elaborazione delle immagini interrotto: viene ricreato")
+            self._executor.shutdown(wait=False)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor.submit(process_image, source, self.root, key)
+
+    @staticmethod
+    def _remove(*paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _claim(self, lock):
+        """Crea il file di lock (O_EXCL); un lock abbandonato da un processo morto si riprende."""
+        os.makedirs(os.path.dirname(lock), exist_ok=True)
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            if self._locked(lock):
+                return False
+            os.utime(lock, None)
+            return True
+
+    def _locked(self, lock):
+        try:
+            return time.time() - os.path.getmtime(lock) < LOCK_TIMEOUT
+        except FileNotFoundError:
+            return False
+
+    def _finished(self, key, future):
+        source, lock, error = self._paths(key)
+        try:
+            future.result()
+            self.processed += 1
+        except Exception as e:  # Immagine non valida o processo del pool terminato
+            self.failures += 1
+            with open(error, 'w', encoding='utf-8') as f:
+                f.write(str(e))
+        finally:
+            self._remove(source, lock)
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def status(self, key):
+        """('ready', manifest), ('processing', None), ('failed', messaggio) oppure None."""
+        manifest = load_manifest(self.root, key)
+        if manifest is not None:
+            return 'ready', manifest
+        source, lock, error = self._paths(key)
+        if key in self._pending or self._locked(lock):
+            return 'processing', None
+        try:
+            with open(error, encoding='utf-8') as f:
+                return 'failed', f.read()
+        except FileNotFoundError:
+            return None
+
+    def stats(self):
+        return {'pending': len(self._pending), 'processed': self.processed, 'duplicates': self.duplicates,
+                'failures': self.failures, 'rejected': self.rejected}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+# --- Client per i giochi desktop -----------------------------------------------
+
+def fetch_tiles(key, url=None, root=None):
+    """Cartella locale con le tessere dell'immagine, scaricate da UPLOAD_URL se mancano; None se non disponibili."""
+    root = root or config.UPLOAD_DIR
+    if load_manifest(root, key) is not None:
+        return image_dir(root, key)
+    url = (config.UPLOAD_URL if url is None else url).rstrip('/')
+    if not url:
+        print("Immagine non disponibile in locale e UPLOAD_URL non configurato")
+        return None
+    target = image_dir(root, key)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    try:
+        with urllib.request.urlopen(f'{url}/uploads/{key}/manifest.json', timeout=10) as response:
+            manifest_data = response.read()
+        manifest = json.loads(manifest_data)
+        names = [manifest['image']] + [name for grid in manifest['grids'].values() for name in grid['tiles']]
+        for name in names:
+            path = os.path.join(temporary, *name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with urllib.request.urlopen(f'{url}/uploads/{key}/{name}', timeout=10) as response, open(path, 'wb') as f:
+                shutil.copyfileobj(response, f)
+        with open(os.path.join(temporary, 'manifest.json'), 'wb') as f:
+            f.write(manifest_data)
+        os.replace(temporary, target)
+    except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+        print(f"Impossibile scaricare l'immagine {key}: {e}")
+        shutil.rmtree(temporary, ignore_errors=True)
+        return None
+    return target
+
+def main(argv):
+    if len(argv) < 3 or argv[1] != 'process':
+        print("Uso: python uploads.py process <immagine> [...]")
+        return 1
+    processor = UploadProcessor(config.UPLOAD_DIR, workers=config.UPLOAD_WORKERS, max_pending=len(argv))
+    keys = []
+    start = time.perf_counter()
+    for path in argv[2:]:
+        with open(path, 'rb') as f:
+            key, manifest = processor.submit(f.read())
+        keys.append((path, key))
+    processor.shutdown()
+    for path, key in keys:
+        state, detail = processor.status(key)
+        print(f"{path}: {key} {state}" + (f" ({detail})" if state == 'failed' else ''))
+    print(f"{len(keys)} immagini in {time.perf_counter() - start:.2f} s "
+          f"({'Pillow' if Image is not None else 'pygame'}, {processor.workers} processi)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))